@@ -0,0 +1,285 @@
+import ipaddress
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from aiohttp import web
+
+import constants
+from metrics import ADMISSION_REJECTED, route_name
+
+
+class TokenBucket:
+    """Allows rate requests per second on average with bursts up to burst.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        """Initialize a full bucket.
+
+        Args:
+            rate: Tokens added per second.
+            burst: Bucket capacity.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token if one is available.
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one is
+            available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per client, keeping the most recently seen clients.
+
+    Forgetting a client hands it a full bucket again, so the number of
+    tracked clients bounds memory without making the limit stricter.
+    """
+
+    def __init__(self, rate: float, burst: float,
+                 max_clients: int = constants.RATE_LIMIT_CLIENTS):
+        """Initialize the limiter.
+
+        Args:
+            rate: Requests per second per client, 0 disables the limit.
+            burst: Requests a client may send at once.
+            max_clients: Maximum number of tracked clients.
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_clients = max_clients
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def check(self, client: str) -> float:
+        """Count a request of a client against its bucket.
+
+        Args:
+            client: Client address.
+        Returns:
+            float: 0 if the request is allowed, otherwise seconds to wait.
+        """
+        if self.rate <= 0:
+            return 0
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate,
+                                                         self.burst)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket.take()
+
+
+class Budget:
+    """A capacity taken and returned without waiting, e.g. request slots or
+    bytes of uploads in flight.
+    """
+
+    def __init__(self, capacity: int):
+        """Initialize the budget.
+
+        Args:
+            capacity: Total capacity, 0 or less for no limit.
+        """
+        self.capacity = capacity
+        self.used = 0
+
+    def try_take(self, amount: int = 1) -> bool:
+        """Take amount if it fits.
+
+        An amount larger than the whole capacity is capped to it, so a
+        single large request can still run alone.
+
+        Args:
+            amount: Capacity to take.
+        Returns:
+            bool: True if taken; it must then be returned with release.
+        """
+        if self.capacity <= 0:
+            return True
+        amount = min(amount, self.capacity)
+        if self.used + amount > self.capacity:
+            return False
+        self.used += amount
+        return True
+
+    def release(self, amount: int = 1) -> None:
+        """Return capacity taken with try_take.
+
+        Args:
+            amount: Capacity to return.
+        """
+        if self.capacity > 0:
+            self.used -= min(amount, self.capacity)
+
+
+TRUSTED_NETWORKS = tuple(ipaddress.ip_network(proxy, strict=False)
+                         for proxy in constants.TRUSTED_PROXIES)
+
+
+def is_trusted_proxy(address: Optional[str], networks: tuple) -> bool:
+    """Checks whether a peer address belongs to a trusted proxy.
+
+    Args:
+        address: Peer IP address.
+        networks: Addresses and networks of the trusted proxies.
+    Returns:
+        bool: True if the address is in one of the networks.
+    """
+    try:
+        ip = ipaddress.ip_address(address or '')
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_address(request: web.Request) -> str:
+    """Returns the client address, as reported by nginx when it connects
+    from a trusted proxy address.
+
+    Any other peer could set X-Real-IP itself to get a fresh token bucket
+    with every request, so the header is ignored for them.
+
+    Args:
+        request: Request object.
+    Returns:
+        str: Client IP address.
+    """
+    real_ip = request.headers.get('X-Real-IP')
+    if real_ip and is_trusted_proxy(request.remote, TRUSTED_NETWORKS):
+        return real_ip
+    return request.remote or ''
+
+
+def request_kind(request: web.Request) -> Optional[str]:
+    """Classifies a request for admission control.
+
+    Args:
+        request: Request object.
+    Returns:
+        Optional[str]: 'upload', 'read' or None for requests that are
+        always admitted, including the long-lived event stream.
+    """
+    route = route_name(request)
+    if route == constants.EVENTS_ROUTE:
+        return None
+    if (request.method in ('POST', 'PATCH')
+            and route.startswith(constants.UPLOAD_ROUTE_PREFIXES)):
+        return constants.ADMISSION_UPLOAD
+    if request.method == 'GET' and route.startswith(
+            constants.READ_ROUTE_PREFIX):
+        return constants.ADMISSION_READ
+    return None
+
+
+def reject(status: int, text: str, retry_after: float, kind: str,
+           reason: str) -> web.Response:
+    """Builds a fast failure response telling the client when to retry.
+
+    Args:
+        status: 429 or 503.
+        text: Response text for the client.
+        retry_after: Seconds until a retry may succeed.
+        kind: Request kind.
+        reason: Limit that rejected the request.
+    Returns:
+        web.Response: The response.
+    """
+    ADMISSION_REJECTED.inc(kind=kind, reason=reason)
+    return web.Response(
+        status=status, text=text,
+        headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+
+class AdmissionControl:
+    """Rejects uploads and gallery reads over their limits before they run.
+
+    Each client gets a token bucket per request kind. Uploads and reads
+    have separate concurrency budgets, so a flood of uploads cannot take
+    the database connections readers need, and uploads are also limited
+    by the bytes they bring in. Requests over a limit fail at once with
+    429 or 503 and Retry-After instead of queueing.
+    """
+
+    def __init__(self):
+        """Initialize the limits from constants."""
+        self.limiters = {
+            constants.ADMISSION_UPLOAD: RateLimiter(
+                constants.UPLOAD_RATE_LIMIT, constants.UPLOAD_RATE_BURST),
+            constants.ADMISSION_READ: RateLimiter(
+                constants.READ_RATE_LIMIT, constants.READ_RATE_BURST),
+        }
+        self.slots = {
+            constants.ADMISSION_UPLOAD: Budget(constants.UPLOAD_CONCURRENCY),
+            constants.ADMISSION_READ: Budget(constants.READ_CONCURRENCY),
+        }
+        self.upload_bytes = Budget(constants.UPLOAD_BYTES_IN_FLIGHT)
+
+    @web.middleware
+    async def middleware(self, request: web.Request,
+                         handler: Callable) -> web.StreamResponse:
+        """Admit a request or reject it with 429 or 503.
+
+        Args:
+            request: Request object.
+            handler: Next handler.
+        Returns:
+            web.StreamResponse: The handler response or a rejection.
+        """
+        kind = request_kind(request)
+        if kind is None:
+            return await handler(request)
+        wait = self.limiters[kind].check(client_address(request))
+        if wait:
+            return reject(constants.HTTP_429_TOO_MANY_REQUESTS,
+                          constants.TOO_MANY_REQUESTS_RU, wait, kind,
+                          constants.REJECT_RATE)
+        slots = self.slots[kind]
+        if not slots.try_take():
+            return reject(constants.HTTP_503_SERVICE_UNAVAILABLE,
+                          constants.SERVICE_BUSY_RU,
+                          constants.RETRY_AFTER_SECONDS, kind,
+                          constants.REJECT_CONCURRENCY)
+        size = 0
+        if kind == constants.ADMISSION_UPLOAD:
+            size = request.content_length or constants.MAX_FILE_SIZE
+            if not self.upload_bytes.try_take(size):
+                slots.release()
+                return reject(constants.HTTP_503_SERVICE_UNAVAILABLE,
+                              constants.SERVICE_BUSY_RU,
+                              constants.RETRY_AFTER_SECONDS, kind,
+                              constants.REJECT_BYTES)
+        try:
+            return await handler(request)
+        finally:
+            slots.release()
+            if size:
+                self.upload_bytes.release(size)
+
+
+def setup_admission(app: web.Application) -> AdmissionControl:
+    """Install the admission control middleware.
+
+    Args:
+        app: aiohttp application instance
+    Returns:
+        AdmissionControl: The installed admission control.
+    """
+    admission = AdmissionControl()
+    app.middlewares.append(admission.middleware)
+    return admission
@@ -1,27 +1,53 @@
+import asyncio
 import json
 import os
+from contextlib import aclosing
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
 
-from aiohttp import web
+from aiohttp import BodyPartReader, web
 from loguru import logger
 
 import constants
+from admission import client_address, setup_admission
 from db import Database
-from utils import (check_file_size, check_file_type, check_file_uploaded,
-                   create_upload_response, get_html_page, read_file_async,
+from derivatives import (bucket_width, create_thumbnails, ensure_variant,
+                         get_thumbnail, negotiate_format, remove_variants)
+from executor import ExecutorSaturatedError
+from events import ImageEvents
+from export import write_ndjson, write_snapshot
+from jobs import JobQueue
+from log_config import log_request, setup_logging
+from metrics import REGISTRY, UPLOAD_STAGE_SECONDS, setup_metrics
+from reconcile import Reconciler
+from similarity import SimilarityIndex
+from storage import storage
+from uploads import SessionBusyError, SessionLimitError, UploadSessions
+from utils import (UploadedFile, UploadError, build_file_url,
+                   check_file_size, check_file_uploaded, check_received_file,
+                   create_upload_response, discard_file, examine_file,
+                   finish_save, get_html_page, image_executor, page_cache,
+                   receive_file, receive_part, remove_stored_files,
                    save_file)
 
 os.makedirs(constants.IMAGES_DIR, exist_ok=True)
-os.makedirs('logs', exist_ok=True)
-
-log_file = os.path.join('logs', constants.LOG_FILE)
-logger.add(log_file, format=constants.LOG_FORMAT, level=constants.LOG_LEVEL)
+os.makedirs(constants.DERIVATIVES_DIR, exist_ok=True)
+os.makedirs(constants.UPLOADS_DIR, exist_ok=True)
+setup_logging()
 
 routes = web.RouteTableDef()
 db = Database()
+job_queue = JobQueue()
+job_queue.register(constants.JOB_THUMBNAILS, create_thumbnails)
+upload_sessions = UploadSessions()
+similarity_index = SimilarityIndex()
+reconciler = Reconciler()
+export_slots = asyncio.Semaphore(constants.EXPORT_CONCURRENCY)
+image_events = ImageEvents()
 
 
 async def init_db(app: web.Application):
-    """Initialize database connection and tables.
+    """Initialize database connection and tables and warm the pool.
 
        Args:
            app: aiohttp application instance
@@ -33,6 +59,7 @@ async def init_db(app: web.Application):
         logger.info(constants.DB_CONNECT.format(db=constants.DB_NAME))
         await db.connect()
         await db.init_db()
+        await db.warm_up()
     except ConnectionError as e:
         logger.critical(constants.ERROR_DB_CONNECTION.format(error=e))
         raise ConnectionError(
@@ -43,6 +70,69 @@ async def init_db(app: web.Application):
             constants.ERROR_DB_INITIALIZE.format(error=e)) from e
 
 
+async def close_listener(app: web.Application):
+    """Stop the database notification listener.
+
+    Args:
+        app: aiohttp application instance
+    """
+    await db.stop_listener()
+
+
+async def close_jobs(app: web.Application):
+    """Stop the background job queue.
+
+    Args:
+        app: aiohttp application instance
+    """
+    await job_queue.stop()
+
+
+async def close_sweeper(app: web.Application):
+    """Stop removing expired upload sessions.
+
+    Args:
+        app: aiohttp application instance
+    """
+    await upload_sessions.stop_sweeper()
+
+
+async def close_reconciler(app: web.Application):
+    """Stop the periodic reconciliation.
+
+    Args:
+        app: aiohttp application instance
+    """
+    await reconciler.stop()
+
+
+async def close_events(app: web.Application):
+    """End the image event streams of all clients.
+
+    Args:
+        app: aiohttp application instance
+    """
+    await image_events.stop()
+
+
+async def close_db(app: web.Application):
+    """Close the database connection pool.
+
+    Args:
+        app: aiohttp application instance
+    """
+    await db.disconnect()
+
+
+async def close_executor(app: web.Application):
+    """Shut down the image executor.
+
+    Args:
+        app: aiohttp application instance
+    """
+    await image_executor.shutdown()
+
+
 @routes.get('/')
 async def get_main(request: web.Request) -> web.Response:
     """GET requests to the main page.
@@ -52,48 +142,121 @@ async def get_main(request: web.Request) -> web.Response:
     Returns:
         web.Response: Response with HTML content of the main page.
         """
-    logger.info(constants.GET_REQUEST.format(request=request.path))
-
-    html_content = await read_file_async(
-        os.path.join('static', constants.INDEX_HTML))
-    return web.Response(
-        status=constants.HTTP_200_OK,
-        text=html_content,
-        content_type=constants.CONTENT_TYPE_HTML
-    )
+    return await get_html_page(request, constants.INDEX_HTML,
+                               error_message=constants.INDEX_PAGE_ERROR)
 
 
 @routes.get('/api/images')
 async def get_all_images(request: web.Request) -> web.Response:
-    """Returns a list of all uploaded images.
+    """Returns a page of uploaded images.
+
+    Query parameters: page (1-based) or cursor (next_cursor of a previous
+    response), and count ('exact', 'approx' or 'none').
 
     Args:
         request: Request object.
     Returns:
         web.Response: Response with JSON list of images.
         """
-    logger.info(
+    log_request(
         constants.GET_REQUEST.format(
             request=request.query.get(constants.PAGE, 1)))
+    cursor = request.query.get(constants.CURSOR)
+    count = request.query.get(
+        constants.COUNT,
+        constants.COUNT_NONE if cursor else constants.COUNT_EXACT)
     try:
         page = int(request.query.get(constants.PAGE, 1))
-        images_data = await db.get_images(page)
-        if (images_data[constants.TOTAL_PAGES] < images_data[
-            constants.PAGE] and
-                images_data[constants.TOTAL_PAGES] != 0):
-            last_page = images_data[constants.TOTAL_PAGES]
-            return web.Response(status=constants.HTTP_404_NOT_FOUND,
-                                text=json.dumps({
-                                    constants.LAST_PAGE: last_page,
-                                    constants.MSG: constants.PAGE_NOT_FOUND,
-                                }))
-        return web.Response(status=constants.HTTP_200_OK,
-                            text=json.dumps(images_data),
-                            content_type=constants.CONTENT_TYPE_JSON)
+        if page < 1 or count not in constants.COUNT_MODES:
+            raise ValueError(request.query_string)
+        images_data = await db.get_images(page, cursor=cursor, count=count)
+    except ValueError as e:
+        logger.warning(constants.INVALID_PARAMETER.format(error=e))
+        return web.Response(status=constants.HTTP_400_BAD_REQUEST,
+                            text=constants.INVALID_PARAMETER_RU)
     except Exception as e:
         logger.error(constants.LOAD_IMAGE_GALLERY_ERROR.format(error=e))
         return web.Response(status=constants.HTTP_500_INTERNAL_SERVER_ERROR,
                             text=constants.LOAD_IMAGE_GALLERY_ERROR)
+    total_pages = images_data[constants.TOTAL_PAGES]
+    if (not cursor and total_pages is not None and
+            total_pages < images_data[constants.PAGE] and total_pages != 0):
+        return web.Response(status=constants.HTTP_404_NOT_FOUND,
+                            text=json.dumps({
+                                constants.LAST_PAGE: total_pages,
+                                constants.MSG: constants.PAGE_NOT_FOUND,
+                            }))
+    return web.Response(status=constants.HTTP_200_OK,
+                        text=json.dumps(images_data),
+                        content_type=constants.CONTENT_TYPE_JSON)
+
+
+@routes.get(constants.EVENTS_ROUTE)
+async def image_events_handler(request: web.Request) -> web.StreamResponse:
+    """Streams image changes as Server-Sent Events.
+
+    Events are 'insert' and 'update' with the new or changed records in
+    the format of /api/images, 'delete' with the IDs of deleted images,
+    and 'reset' when changes may have been missed and the client should
+    reload.
+
+    Args:
+        request: Request object.
+    Returns:
+        web.StreamResponse: The event stream, or 503 if too many clients
+        are connected.
+    """
+    queue = image_events.connect()
+    if queue is None:
+        return web.Response(
+            status=constants.HTTP_503_SERVICE_UNAVAILABLE,
+            text=constants.SERVICE_BUSY_RU,
+            headers={'Retry-After': str(constants.RETRY_AFTER_SECONDS)})
+    log_request(constants.GET_REQUEST.format(request=request.path))
+    return await image_events.stream(request, queue)
+
+
+@routes.get('/api/cache')
+async def cache_stats_handler(request: web.Request) -> web.Response:
+    """Returns hit and miss counters of the gallery listing cache.
+
+    Args:
+        request: Request object.
+    Returns:
+        web.Response: Response with JSON cache statistics.
+        """
+    return web.Response(status=constants.HTTP_200_OK,
+                        text=json.dumps(db.images_cache.stats()),
+                        content_type=constants.CONTENT_TYPE_JSON)
+
+
+@routes.get('/metrics')
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Returns in-process metrics in Prometheus text format.
+
+    Args:
+        request: Request object.
+    Returns:
+        web.Response: Response with metrics exposition text.
+        """
+    return web.Response(status=constants.HTTP_200_OK,
+                        text=REGISTRY.render(),
+                        content_type=constants.CONTENT_TYPE_METRICS)
+
+
+def cache_stats() -> list[tuple[str, str, float]]:
+    """Return gallery listing cache counters as metric samples.
+
+    Returns:
+        list: (name, documentation, value) tuples.
+    """
+    return [(f'images_cache_{name}',
+             constants.CACHE_STAT_HELP.format(stat=name), value)
+            for name, value in db.images_cache.stats().items()]
+
+
+REGISTRY.add_collector(db.pool_stats)
+REGISTRY.add_collector(cache_stats)
 
 
 @routes.get('/images')
@@ -110,6 +273,54 @@ async def images_gallery_handler(request: web.Request) -> web.Response:
         error_message=constants.LOAD_IMAGE_GALLERY_ERROR)
 
 
+@routes.get(constants.IMAGE_ROUTE)
+async def image_handler(request: web.Request) -> web.StreamResponse:
+    """Serves an image with sendfile, as WebP or AVIF if the client accepts
+    them.
+
+    Filenames are generated by save_file and never reused, so responses are
+    cacheable forever. Range, If-None-Match and If-Modified-Since are handled
+    by FileResponse. A missing variant is transcoded in the background while
+    the original is served, cacheable only briefly so that clients pick up
+    the variant once it is ready.
+
+    Args:
+        request: Contains file name in match_info['filename'].
+    Returns:
+        web.StreamResponse: File response, 404 if the file does not exist.
+        """
+    filename = request.match_info['filename']
+    headers = {'Cache-Control': constants.FILE_CACHE_CONTROL}
+    image_format = negotiate_format(filename,
+                                    request.headers.get('Accept', ''))
+    if image_format is not None:
+        headers['Vary'] = 'Accept'
+        variant = await ensure_variant(filename, image_format, track_variant)
+        if variant is not None:
+            headers['Content-Type'] = (
+                constants.VARIANT_CONTENT_TYPES[image_format])
+            return web.FileResponse(variant, headers=headers)
+        headers['Cache-Control'] = constants.VARIANT_PENDING_CACHE_CONTROL
+    return web.FileResponse(await storage.locate(filename), headers=headers)
+
+
+async def track_variant(filename: str, image_format: str, size: int) -> None:
+    """Records a new variant and removes the files of evicted ones.
+
+    Variants of images missing from the database are removed at once.
+
+    Args:
+        filename: Name of the original image.
+        image_format: Variant format.
+        size: Variant size in bytes.
+    """
+    tracked, evicted = await db.add_variant(filename, image_format, size)
+    if not tracked:
+        evicted.append((filename, image_format))
+    for evicted_filename, evicted_format in evicted:
+        await remove_variants(evicted_filename, [evicted_format])
+
+
 @routes.get('/upload')
 async def upload_form_handler(request: web.Request) -> web.Response:
     """Serves HTML form for uploading images.
@@ -122,6 +333,105 @@ async def upload_form_handler(request: web.Request) -> web.Response:
                                error_message=constants.UPLOAD_FORM_ERROR)
 
 
+async def find_similar(phash: int, max_distance: int, limit: int,
+                       exclude: Optional[int] = None) -> list[dict]:
+    """Finds stored images whose perceptual hash is close to phash.
+
+    Matches of images deleted before their removal reached the index are
+    dropped from it when their records are not found, and more matches
+    are searched for in their place.
+
+    Args:
+        phash: Perceptual hash to compare with.
+        max_distance: Maximum Hamming distance in bits.
+        limit: Maximum number of images.
+        exclude: ID of an image to leave out.
+    Returns:
+        list: Image records with their distance, closest first.
+    """
+    await similarity_index.refresh(db)
+    while True:
+        matches = similarity_index.search(phash, max_distance, limit,
+                                          exclude)
+        images = await db.get_images_by_ids(
+            [image_id for image_id, _ in matches])
+        missing = [image_id for image_id, _ in matches
+                   if image_id not in images]
+        if not missing:
+            return [dict(images[image_id], distance=distance)
+                    for image_id, distance in matches]
+        similarity_index.remove(missing)
+
+
+async def reject_near_duplicate(upload: UploadedFile) -> None:
+    """Rejects an upload nearly identical to a stored image.
+
+    Does nothing unless PHASH_REJECT_DISTANCE is set. With content
+    addressed storage a byte-identical file is let through, since it is
+    stored as another reference to the existing one.
+
+    Args:
+        upload: The received file.
+    Raises:
+        UploadError: If a different stored image is within
+            PHASH_REJECT_DISTANCE.
+    """
+    if constants.PHASH_REJECT_DISTANCE < 0 or upload.phash is None:
+        return
+    if (constants.CONTENT_ADDRESSED_STORAGE and
+            await db.find_by_content_hash(upload.content_hash) is not None):
+        return
+    matches = await find_similar(upload.phash,
+                                 constants.PHASH_REJECT_DISTANCE, 1)
+    if matches:
+        logger.info(constants.NEAR_DUPLICATE.format(
+            id=matches[0]['id'], distance=matches[0]['distance']))
+        raise UploadError(constants.HTTP_409_CONFLICT,
+                          constants.NEAR_DUPLICATE_RU.format(
+                              id=matches[0]['id']))
+
+
+async def store_upload(upload: UploadedFile, original_name: str) -> str:
+    """Moves a received file into place and records it in the database.
+
+    Args:
+        upload: The received file.
+        original_name: Original filename from the client.
+    Returns:
+        str: The name of the saved file.
+    Raises:
+        UploadError: If a near-identical image is already stored.
+    """
+    try:
+        await reject_near_duplicate(upload)
+        with UPLOAD_STAGE_SECONDS.time(stage=constants.STAGE_SAVE_FILE):
+            filename = await save_file(upload)
+    except Exception:
+        await discard_file(upload.temp_path)
+        raise
+    try:
+        with UPLOAD_STAGE_SECONDS.time(stage=constants.STAGE_INSERT_IMAGE):
+            await db.insert_image(filename=filename,
+                                  original_name=original_name,
+                                  size=upload.size,
+                                  file_type=upload.file_extension,
+                                  content_hash=(
+                                      upload.content_hash
+                                      if constants.CONTENT_ADDRESSED_STORAGE
+                                      else None),
+                                  width=upload.width,
+                                  height=upload.height,
+                                  orientation=upload.orientation,
+                                  placeholder=upload.placeholder,
+                                  phash=upload.phash,
+                                  jobs=constants.UPLOAD_JOBS)
+        await finish_save(upload, filename)
+    finally:
+        await discard_file(upload.temp_path)
+    job_queue.wake()
+    return filename
+
+
 @routes.post('/upload')
 async def post_handler(request: web.Request) -> web.Response:
     """ Handles the upload of an image.
@@ -133,43 +443,336 @@ async def post_handler(request: web.Request) -> web.Response:
     try:
         reader = await request.multipart()
         field = await reader.next()
-        logger.info(constants.POST_REQUEST.format(request=request.path))
+        log_request(constants.POST_REQUEST.format(request=request.path))
 
         if not await check_file_uploaded(field):
             return web.Response(status=constants.HTTP_400_BAD_REQUEST,
                                 text=constants.FILE_NOT_FOUND_RU)
 
-        content_length = int(request.headers.get('Content-Length', 0))
+        upload = await receive_file(field, constants.IMAGES_DIR,
+                                    constants.ALLOWED_EXTENSIONS,
+                                    constants.MAX_FILE_SIZE)
+        filename = await store_upload(upload, field.filename)
+        return await create_upload_response(filename, constants.BASE_URL)
 
-        if not await check_file_size(content_length, constants.MAX_FILE_SIZE):
-            return web.Response(
-                status=constants.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                text=constants.FILE_TOO_LARGE_RU.format(size=content_length))
+    except UploadError as e:
+        return web.Response(status=e.status, text=e.text)
+    except ExecutorSaturatedError:
+        return web.Response(
+            status=constants.HTTP_503_SERVICE_UNAVAILABLE,
+            text=constants.SERVICE_BUSY_RU,
+            headers={'Retry-After': str(constants.RETRY_AFTER_SECONDS)})
+    except Exception as e:
+        logger.error(constants.UPLOAD_ERROR.format(error=e))
+        return web.Response(status=constants.HTTP_500_INTERNAL_SERVER_ERROR,
+                            text=constants.ERROR_500)
 
-        file_data = await field.read()
-        file_extension, error = await check_file_type(
-            file_data,
-            constants.ALLOWED_EXTENSIONS)
 
-        if error:
-            return web.Response(
-                status=constants.HTTP_415_UNSUPPORTED_MEDIA_TYPE, text=error)
+async def store_batch_file(upload: UploadedFile,
+                           semaphore: asyncio.Semaphore
+                           ) -> tuple[UploadedFile, str]:
+    """Checks and saves one file of a batch upload and releases its fan-out
+    slot.
+
+    Args:
+        upload: The received file, not checked yet.
+        semaphore: Semaphore bounding concurrent batch work.
+    Returns:
+        tuple: The checked file and the name it was saved under.
+    Raises:
+        UploadError: If the file is not an allowed image or a
+            near-identical image is already stored.
+        ExecutorSaturatedError: If the image executor is saturated.
+    """
+    try:
+        upload = await check_received_file(upload,
+                                           constants.ALLOWED_EXTENSIONS)
+        await reject_near_duplicate(upload)
+        return upload, await save_file(upload)
+    except Exception:
+        await discard_file(upload.temp_path)
+        raise
+    finally:
+        semaphore.release()
+
+
+@routes.post('/api/images/batch')
+async def batch_upload_handler(request: web.Request) -> web.Response:
+    """Handles the upload of many images in one multipart request.
+
+    Parts are streamed to disk one after another. Each received part is
+    checked, described in the image executor and saved by a task of a
+    bounded fan-out while the next part is read, and all metadata rows are
+    inserted in one batch.
+
+    Args:
+        request: Request object.
+    Returns:
+        web.Response: Response with JSON list of per-file results, each
+        with original_name, status and either id and file_url or message.
+    """
+    log_request(constants.POST_REQUEST.format(request=request.path))
+    semaphore = asyncio.Semaphore(constants.BATCH_CONCURRENCY)
+    results: list[dict] = []
+    pending: list[tuple[dict, UploadedFile, asyncio.Task]] = []
+    try:
+        reader = await request.multipart()
+        async for field in reader:
+            if not isinstance(field, BodyPartReader) or not field.filename:
+                await field.release()
+                continue
+            result = {'original_name': field.filename}
+            results.append(result)
+            if len(results) > constants.BATCH_MAX_FILES:
+                await field.release()
+                result.update(
+                    status=constants.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    message=constants.TOO_MANY_FILES_RU.format(
+                        limit=constants.BATCH_MAX_FILES))
+                continue
+            try:
+                upload = await receive_part(field, constants.IMAGES_DIR,
+                                            constants.MAX_FILE_SIZE)
+            except UploadError as e:
+                result.update(status=e.status, message=e.text)
+                continue
+            await semaphore.acquire()
+            pending.append((result, upload, asyncio.create_task(
+                store_batch_file(upload, semaphore))))
 
-        filename = await save_file(file_data, file_extension,
-                                   constants.IMAGES_DIR)
-        await db.insert_image(filename=filename,
-                              original_name=field.filename,
-                              size=content_length,
-                              file_type=file_extension)
-        return await create_upload_response(filename, constants.BASE_URL,
-                                            constants.IMAGES_DIR)
+        rows = []
+        saved = []
+        for result, _, task in pending:
+            try:
+                upload, filename = await task
+            except UploadError as e:
+                result.update(status=e.status, message=e.text)
+                continue
+            except ExecutorSaturatedError:
+                result.update(status=constants.HTTP_503_SERVICE_UNAVAILABLE,
+                              message=constants.SERVICE_BUSY_RU)
+                continue
+            except Exception as e:
+                logger.error(constants.UPLOAD_ERROR.format(error=e))
+                result.update(
+                    status=constants.HTTP_500_INTERNAL_SERVER_ERROR,
+                    message=constants.ERROR_500)
+                continue
+            rows.append((filename, result['original_name'], upload.size,
+                         upload.file_extension,
+                         upload.content_hash
+                         if constants.CONTENT_ADDRESSED_STORAGE else None,
+                         upload.width, upload.height, upload.orientation,
+                         upload.placeholder, upload.phash))
+            saved.append((result, upload, filename))
 
+        image_ids = await db.insert_images(rows, jobs=constants.UPLOAD_JOBS)
+        for _, upload, filename in saved:
+            await finish_save(upload, filename)
+        job_queue.wake()
+        for (result, _, filename), image_id in zip(saved, image_ids):
+            result.update(status=constants.HTTP_201_CREATED, id=image_id,
+                          file_url=build_file_url(filename,
+                                                  constants.BASE_URL))
+        logger.info(constants.BATCH_UPLOAD_RESULT.format(
+            saved=len(image_ids), total=len(results)))
+        return web.Response(status=constants.HTTP_200_OK,
+                            text=json.dumps(results),
+                            content_type=constants.CONTENT_TYPE_JSON)
     except Exception as e:
         logger.error(constants.UPLOAD_ERROR.format(error=e))
+        for _, upload, task in pending:
+            task.cancel()
+            await discard_file(upload.temp_path)
         return web.Response(status=constants.HTTP_500_INTERNAL_SERVER_ERROR,
                             text=constants.ERROR_500)
 
 
+@routes.post('/api/uploads')
+async def create_upload_handler(request: web.Request) -> web.Response:
+    """Starts a resumable upload.
+
+    The JSON body holds the total size and the original filename. Chunks
+    are then sent with PATCH to the session URL, the received offset is
+    read with HEAD, and the upload is finished with POST to
+    /api/uploads/{id}/finalize.
+
+    Args:
+        request: Request object with JSON {"size": int, "filename": str}.
+    Returns:
+        web.Response: 201 with JSON session id, size and offset and the
+        session URL in Location, 400 or 413 on invalid input, 429 if too
+        many sessions are open.
+    """
+    log_request(constants.POST_REQUEST.format(request=request.path))
+    try:
+        data = await request.json()
+        size = int(data['size'])
+        filename = str(data['filename'])
+        if size < 1 or not filename:
+            raise ValueError(data)
+    except (ValueError, TypeError, KeyError) as e:
+        logger.warning(constants.INVALID_PARAMETER.format(error=e))
+        return web.Response(status=constants.HTTP_400_BAD_REQUEST,
+                            text=constants.INVALID_PARAMETER_RU)
+    if not await check_file_size(size, constants.MAX_FILE_SIZE):
+        return web.Response(
+            status=constants.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            text=constants.FILE_TOO_LARGE_RU.format(size=size))
+    try:
+        session = await upload_sessions.create(size, filename,
+                                               client_address(request))
+    except SessionLimitError:
+        return web.Response(
+            status=constants.HTTP_429_TOO_MANY_REQUESTS,
+            text=constants.UPLOAD_SESSIONS_LIMIT_RU)
+    return web.Response(
+        status=constants.HTTP_201_CREATED,
+        text=json.dumps({'id': session.id, 'size': session.size,
+                         'offset': session.offset}),
+        content_type=constants.CONTENT_TYPE_JSON,
+        headers={'Location': constants.UPLOAD_SESSION_URL.format(
+                     id=session.id),
+                 constants.UPLOAD_OFFSET: str(session.offset)})
+
+
+@routes.head(constants.UPLOAD_SESSION_ROUTE)
+async def upload_offset_handler(request: web.Request) -> web.Response:
+    """Returns the number of bytes received so far.
+
+    Args:
+        request: Contains session ID in match_info['id'].
+    Returns:
+        web.Response: Upload-Offset and Upload-Length headers, 404 if the
+        session does not exist.
+    """
+    session = await upload_sessions.load(request.match_info['id'])
+    if session is None:
+        return web.Response(status=constants.HTTP_404_NOT_FOUND)
+    return web.Response(status=constants.HTTP_200_OK, headers={
+        constants.UPLOAD_OFFSET: str(session.offset),
+        constants.UPLOAD_LENGTH: str(session.size),
+        'Cache-Control': 'no-store',
+    })
+
+
+@routes.patch(constants.UPLOAD_SESSION_ROUTE)
+async def upload_chunk_handler(request: web.Request) -> web.Response:
+    """Writes a chunk of a resumable upload at the given offset.
+
+    Args:
+        request: Contains session ID in match_info['id'], the offset of the
+            chunk in the Upload-Offset header and the chunk as the body.
+    Returns:
+        web.Response: 204 with the new Upload-Offset; 409 if the offset is
+        not the current one or the session is busy; 404 if the session
+        does not exist; 413 if the chunk goes past the upload size.
+    """
+    try:
+        async with upload_sessions.locked(request.match_info['id']) as session:
+            if session is None:
+                return web.Response(
+                    status=constants.HTTP_404_NOT_FOUND,
+                    text=constants.UPLOAD_SESSION_NOT_FOUND_RU)
+            if request.headers.get(constants.UPLOAD_OFFSET) != str(
+                    session.offset):
+                return web.Response(
+                    status=constants.HTTP_409_CONFLICT,
+                    text=constants.UPLOAD_OFFSET_MISMATCH_RU.format(
+                        offset=session.offset),
+                    headers={constants.UPLOAD_OFFSET: str(session.offset)})
+            try:
+                offset = await upload_sessions.write(
+                    session,
+                    request.content.iter_chunked(constants.UPLOAD_CHUNK_SIZE))
+            except ValueError as e:
+                logger.warning(str(e))
+                return web.Response(
+                    status=constants.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    text=constants.FILE_TOO_LARGE_RU.format(
+                        size=session.size),
+                    headers={constants.UPLOAD_OFFSET: str(session.offset)})
+    except SessionBusyError:
+        return web.Response(status=constants.HTTP_409_CONFLICT,
+                            text=constants.UPLOAD_SESSION_BUSY_RU)
+    return web.Response(status=constants.HTTP_204_NO_CONTENT,
+                        headers={constants.UPLOAD_OFFSET: str(offset)})
+
+
+@routes.post(constants.UPLOAD_SESSION_ROUTE + '/finalize')
+async def finalize_upload_handler(request: web.Request) -> web.Response:
+    """Checks a fully received upload and stores it like POST /upload.
+
+    Args:
+        request: Contains session ID in match_info['id'].
+    Returns:
+        web.Response: 201 with the file URL; 409 if bytes are missing or
+        the session is busy; 404 if the session does not exist; 415 for
+        unsupported files; 503 if the image executor is saturated, in
+        which case finalize can be retried.
+    """
+    session_id = request.match_info['id']
+    try:
+        async with upload_sessions.locked(session_id) as session:
+            if session is None:
+                return web.Response(
+                    status=constants.HTTP_404_NOT_FOUND,
+                    text=constants.UPLOAD_SESSION_NOT_FOUND_RU)
+            if session.offset < session.size:
+                return web.Response(
+                    status=constants.HTTP_409_CONFLICT,
+                    text=constants.UPLOAD_INCOMPLETE_RU.format(
+                        offset=session.offset, size=session.size),
+                    headers={constants.UPLOAD_OFFSET: str(session.offset)})
+            try:
+                upload = await examine_file(
+                    upload_sessions.data_path(session_id),
+                    constants.ALLOWED_EXTENSIONS)
+            except UploadError as e:
+                await upload_sessions.delete(session_id)
+                return web.Response(status=e.status, text=e.text)
+            except ExecutorSaturatedError:
+                return web.Response(
+                    status=constants.HTTP_503_SERVICE_UNAVAILABLE,
+                    text=constants.SERVICE_BUSY_RU,
+                    headers={'Retry-After': str(
+                        constants.RETRY_AFTER_SECONDS)})
+            try:
+                filename = await store_upload(upload, session.filename)
+            except UploadError as e:
+                return web.Response(status=e.status, text=e.text)
+            except Exception as e:
+                logger.error(constants.UPLOAD_ERROR.format(error=e))
+                return web.Response(
+                    status=constants.HTTP_500_INTERNAL_SERVER_ERROR,
+                    text=constants.ERROR_500)
+            finally:
+                await upload_sessions.delete(session_id, keep_data=True)
+    except SessionBusyError:
+        return web.Response(status=constants.HTTP_409_CONFLICT,
+                            text=constants.UPLOAD_SESSION_BUSY_RU)
+    return await create_upload_response(filename, constants.BASE_URL)
+
+
+@routes.delete(constants.UPLOAD_SESSION_ROUTE)
+async def cancel_upload_handler(request: web.Request) -> web.Response:
+    """Abandons a resumable upload and removes its data.
+
+    Args:
+        request: Contains session ID in match_info['id'].
+    Returns:
+        web.Response: 204, or 409 if the session is busy.
+    """
+    session_id = request.match_info['id']
+    try:
+        async with upload_sessions.locked(session_id):
+            await upload_sessions.delete(session_id)
+    except SessionBusyError:
+        return web.Response(status=constants.HTTP_409_CONFLICT,
+                            text=constants.UPLOAD_SESSION_BUSY_RU)
+    return web.Response(status=constants.HTTP_204_NO_CONTENT)
+
+
 @routes.delete('/api/images/{id}')
 async def delete_handler(request: web.Request) -> web.Response:
     """Delete image by ID from DB and filesystem.
@@ -179,27 +782,90 @@ async def delete_handler(request: web.Request) -> web.Response:
         Returns:
             Response with status:
             - 200: Success
+            - 400: Invalid ID
             - 404: Image not found
             - 500: Server error
         """
     try:
-        image_id = request.match_info['id']
+        image_id = int(request.match_info['id'])
+    except ValueError as e:
+        logger.warning(constants.INVALID_PARAMETER.format(error=e))
+        return web.Response(status=constants.HTTP_400_BAD_REQUEST,
+                            text=constants.INVALID_PARAMETER_RU)
+    try:
         success, filename = await db.delete_image(image_id)
         if not success:
             return web.Response(
                 status=constants.HTTP_404_NOT_FOUND,
                 text=constants.NOT_FOUND_IN_DB)
         if filename:
-            file_path = os.path.join(constants.IMAGES_DIR, filename[0])
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except OSError as e:
-                logger.error(constants.DELETE_FILE_ERROR.format(error=e))
+            similarity_index.remove([image_id])
+            await remove_stored_files([filename])
 
-            return web.Response(
-                status=constants.HTTP_200_OK,
-                text=constants.DELETE_FILE_SUCCESS)
+        return web.Response(
+            status=constants.HTTP_200_OK,
+            text=constants.DELETE_FILE_SUCCESS)
+    except Exception as e:
+        logger.error(constants.DELETE_FILE_ERROR.format(error=e))
+        return web.Response(
+            status=constants.HTTP_500_INTERNAL_SERVER_ERROR,
+            text=constants.ERROR_500)
+
+
+@routes.delete('/api/images')
+async def bulk_delete_handler(request: web.Request) -> web.Response:
+    """Delete many images by IDs or by upload time range.
+
+    The JSON body holds either "ids" (list of image IDs) or "from" and/or
+    "to" (ISO 8601 upload times, "to" exclusive). Rows are removed with a
+    single statement, then files are unlinked in parallel.
+
+        Args:
+            request: Request object.
+        Returns:
+            Response with status:
+            - 200: JSON with deleted, released and not_found IDs
+            - 400: Invalid body
+            - 500: Server error
+        """
+    try:
+        body = await request.json()
+        image_ids = body.get(constants.IDS)
+        if image_ids is not None:
+            image_ids = [int(image_id) for image_id in image_ids]
+            if len(image_ids) > constants.BULK_DELETE_MAX_IDS:
+                raise ValueError(len(image_ids))
+            since = until = None
+        else:
+            since, until = (
+                datetime.fromisoformat(body[key]) if body.get(key) else None
+                for key in (constants.TIME_FROM, constants.TIME_TO))
+            if since is None and until is None:
+                raise ValueError(body)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning(constants.INVALID_PARAMETER.format(error=e))
+        return web.Response(status=constants.HTTP_400_BAD_REQUEST,
+                            text=constants.INVALID_PARAMETER_RU)
+    try:
+        rows = await db.delete_images(image_ids=image_ids, since=since,
+                                      until=until)
+        similarity_index.remove(
+            image_id for image_id, filename in rows if filename)
+        await remove_stored_files(
+            [filename for _, filename in rows if filename])
+        affected = {image_id for image_id, _ in rows}
+        return web.Response(
+            status=constants.HTTP_200_OK,
+            text=json.dumps({
+                constants.DELETED: [
+                    image_id for image_id, filename in rows if filename],
+                constants.RELEASED: [
+                    image_id for image_id, filename in rows if not filename],
+                constants.NOT_FOUND: [
+                    image_id for image_id in image_ids or ()
+                    if image_id not in affected],
+            }),
+            content_type=constants.CONTENT_TYPE_JSON)
     except Exception as e:
         logger.error(constants.DELETE_FILE_ERROR.format(error=e))
         return web.Response(
@@ -207,6 +873,194 @@ async def delete_handler(request: web.Request) -> web.Response:
             text=constants.ERROR_500)
 
 
+@routes.get('/api/images/{id}/thumb')
+async def thumbnail_handler(request: web.Request) -> web.StreamResponse:
+    """Serves a size-bucketed thumbnail, rendering it on first request.
+
+    Args:
+        request: Contains image ID in match_info['id'] and optional
+            width in query parameter 'w'.
+    Returns:
+        web.StreamResponse: Thumbnail file response or error:
+        - 400: Invalid ID or width
+        - 404: Image not found
+        - 503: Image executor saturated
+        - 500: Server error
+    """
+    try:
+        image_id = int(request.match_info['id'])
+        width = request.query.get(constants.WIDTH)
+        width = bucket_width(int(width) if width else None)
+    except ValueError as e:
+        logger.warning(constants.INVALID_PARAMETER.format(error=e))
+        return web.Response(status=constants.HTTP_400_BAD_REQUEST,
+                            text=constants.INVALID_PARAMETER_RU)
+    try:
+        filename = await db.get_filename(image_id)
+        if filename is None:
+            return web.Response(status=constants.HTTP_404_NOT_FOUND,
+                                text=constants.NOT_FOUND_IN_DB)
+        file_path = await get_thumbnail(filename, width)
+        return web.FileResponse(
+            file_path,
+            headers={'Cache-Control': constants.FILE_CACHE_CONTROL})
+    except FileNotFoundError as e:
+        logger.error(constants.THUMBNAIL_ERROR.format(filename=image_id,
+                                                      error=e))
+        return web.Response(status=constants.HTTP_404_NOT_FOUND,
+                            text=constants.NOT_FOUND_IN_DB)
+    except ExecutorSaturatedError:
+        return web.Response(
+            status=constants.HTTP_503_SERVICE_UNAVAILABLE,
+            text=constants.SERVICE_BUSY_RU,
+            headers={'Retry-After': str(constants.RETRY_AFTER_SECONDS)})
+    except Exception as e:
+        logger.error(constants.THUMBNAIL_ERROR.format(filename=image_id,
+                                                      error=e))
+        return web.Response(
+            status=constants.HTTP_500_INTERNAL_SERVER_ERROR,
+            text=constants.ERROR_500)
+
+
+@routes.get('/api/images/{id}/similar')
+async def similar_images_handler(request: web.Request) -> web.Response:
+    """Returns images that look like the given one.
+
+    Images are compared by the Hamming distance of their perceptual hashes.
+    Query parameters: distance (maximum differing bits, default
+    SIMILAR_DEFAULT_DISTANCE) and limit (default SIMILAR_DEFAULT_LIMIT).
+
+    Args:
+        request: Contains image ID in match_info['id'].
+    Returns:
+        web.Response: Response with status:
+        - 200: JSON with images, closest first, each with its distance
+        - 400: Invalid ID, distance or limit
+        - 404: Image not found
+        - 500: Server error
+    """
+    try:
+        image_id = int(request.match_info['id'])
+        max_distance = int(request.query.get(
+            constants.DISTANCE, constants.SIMILAR_DEFAULT_DISTANCE))
+        limit = int(request.query.get(constants.LIMIT,
+                                      constants.SIMILAR_DEFAULT_LIMIT))
+        if (not 0 <= max_distance <= constants.PHASH_BITS
+                or not 0 < limit <= constants.SIMILAR_MAX_LIMIT):
+            raise ValueError(request.query_string)
+    except ValueError as e:
+        logger.warning(constants.INVALID_PARAMETER.format(error=e))
+        return web.Response(status=constants.HTTP_400_BAD_REQUEST,
+                            text=constants.INVALID_PARAMETER_RU)
+    try:
+        found, phash = await db.get_phash(image_id)
+        if not found:
+            return web.Response(status=constants.HTTP_404_NOT_FOUND,
+                                text=constants.NOT_FOUND_IN_DB)
+        images = [] if phash is None else await find_similar(
+            phash, max_distance, limit, exclude=image_id)
+        return web.Response(status=constants.HTTP_200_OK,
+                            text=json.dumps({constants.IMAGES: images}),
+                            content_type=constants.CONTENT_TYPE_JSON)
+    except Exception as e:
+        logger.error(constants.LOAD_IMAGE_GALLERY_ERROR.format(error=e))
+        return web.Response(
+            status=constants.HTTP_500_INTERNAL_SERVER_ERROR,
+            text=constants.ERROR_500)
+
+
+async def stream_export(
+        request: web.Request, content_type: str, name: str,
+        writer: Callable[[web.StreamResponse,
+                          AsyncIterator[dict[str, Any]]], Awaitable[int]]
+) -> web.StreamResponse:
+    """Streams an export of image records read through a server-side cursor.
+
+    Exports hold a database connection for their whole duration, so only
+    EXPORT_CONCURRENCY of them run at once. Errors after the response has
+    started abort the connection, so a client never mistakes a truncated
+    export for a complete one.
+
+    Args:
+        request: Request with an optional ISO 8601 'since' query parameter.
+        content_type: Content type of the export.
+        name: File name suggested to the client.
+        writer: Coroutine writing records to the response and returning
+            their count.
+    Returns:
+        web.StreamResponse: The export, 400 for an invalid 'since' or 503
+        if too many exports are running.
+    """
+    try:
+        since = request.query.get(constants.SINCE)
+        since = datetime.fromisoformat(since) if since else None
+    except ValueError as e:
+        logger.warning(constants.INVALID_PARAMETER.format(error=e))
+        return web.Response(status=constants.HTTP_400_BAD_REQUEST,
+                            text=constants.INVALID_PARAMETER_RU)
+    if export_slots.locked():
+        return web.Response(
+            status=constants.HTTP_503_SERVICE_UNAVAILABLE,
+            text=constants.SERVICE_BUSY_RU,
+            headers={'Retry-After': str(constants.RETRY_AFTER_SECONDS)})
+    async with export_slots:
+        log_request(constants.GET_REQUEST.format(request=request.path_qs))
+        response = web.StreamResponse(headers={
+            'Content-Type': content_type,
+            'Content-Disposition': f'attachment; filename="{name}"',
+        })
+        await response.prepare(request)
+        try:
+            async with aclosing(db.export_images(since)) as records:
+                count = await writer(response, records)
+            await response.write_eof()
+        except Exception as e:
+            logger.error(constants.EXPORT_ERROR.format(name=name, error=e))
+            raise
+        logger.info(constants.EXPORT_FINISHED.format(name=name, count=count))
+        return response
+
+
+def export_name(template: str) -> str:
+    """Names an export file by the current UTC time."""
+    return template.format(
+        time=datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S'))
+
+
+@routes.get('/api/export/images.ndjson')
+async def export_metadata_handler(request: web.Request) -> web.StreamResponse:
+    """Streams the metadata of all images as NDJSON, one image per line.
+
+    With 'since' only images uploaded at or after that time are exported,
+    for incremental backups.
+
+    Args:
+        request: Request object.
+    Returns:
+        web.StreamResponse: NDJSON stream ordered by image ID.
+    """
+    return await stream_export(request, constants.CONTENT_TYPE_NDJSON,
+                               export_name(constants.EXPORT_NDJSON_NAME),
+                               write_ndjson)
+
+
+@routes.get('/api/export/snapshot.tar')
+async def export_snapshot_handler(request: web.Request) -> web.StreamResponse:
+    """Streams a tar archive of image files and their metadata.
+
+    The archive holds images/<filename> for each image and images.ndjson
+    with the same records as the NDJSON export. 'since' works the same way.
+
+    Args:
+        request: Request object.
+    Returns:
+        web.StreamResponse: Tar stream.
+    """
+    return await stream_export(request, constants.CONTENT_TYPE_TAR,
+                               export_name(constants.EXPORT_TAR_NAME),
+                               write_snapshot)
+
+
 @routes.route('*', '/{tail:.*}')
 async def incorrect_url_handler(request: web.Request) -> web.Response:
     """Handles invalid URLs.
@@ -226,8 +1080,30 @@ async def init_app() -> web.Application:
     Returns:
         web.Application: The application instance."""
     app = web.Application()
+    setup_metrics(app)
+    setup_admission(app)
     app.add_routes(routes)
+    app.on_shutdown.append(close_events)
+    app.on_cleanup.append(close_jobs)
+    app.on_cleanup.append(close_sweeper)
+    app.on_cleanup.append(close_reconciler)
+    app.on_cleanup.append(close_executor)
+    app.on_cleanup.append(close_listener)
+    app.on_cleanup.append(close_db)
     await init_db(app)
+    await similarity_index.load(db)
+    db.subscribe(similarity_index.publish)
+    if constants.DB_LISTENER:
+        db.start_listener()
+    image_events.start(db)
+    image_executor.start()
+    if constants.UPLOAD_JOBS:
+        job_queue.start(db)
+    upload_sessions.start_sweeper()
+    if constants.RECONCILE_INTERVAL > 0:
+        reconciler.start(db)
+    await page_cache.preload((constants.INDEX_HTML, constants.UPLOAD_HTML,
+                              constants.IMAGES_HTML))
     return app
 
 
@@ -0,0 +1,334 @@
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Iterable, Optional
+
+import constants
+from cache import TTLCache
+from constants import ITEMS_PER_PAGE
+from db import decode_cursor, encode_cursor
+from derivatives import bucket_width
+
+
+class MemoryDatabase:
+    """In-memory stand-in for db.Database used by benchmarks.
+
+    Implements the same public coroutines so that the app can run without
+    Postgres. Records are kept in insertion order and read newest first.
+    """
+
+    def __init__(self):
+        """Initialize an empty store."""
+        self.images_cache = TTLCache(constants.IMAGES_CACHE_SIZE,
+                                     constants.IMAGES_CACHE_TTL)
+        self._rows: dict[int, dict[str, Any]] = {}
+        self._by_hash: dict[str, dict[str, Any]] = {}
+        self._next_id = 1
+        self._jobs: dict[int, dict[str, Any]] = {}
+        self._next_job_id = 1
+        self._subscribers: list[Callable[[dict[str, Any]], None]] = []
+
+    async def connect(self, dsn: Optional[str] = None) -> None:
+        """No-op, there is nothing to connect to."""
+
+    async def disconnect(self) -> None:
+        """No-op, there is nothing to disconnect from."""
+
+    async def init_db(self) -> None:
+        """No-op, the store needs no schema."""
+
+    async def warm_up(self) -> None:
+        """No-op, there are no connections to warm."""
+
+    def start_listener(self, dsn: Optional[str] = None) -> None:
+        """No-op, a single process has nothing to listen to."""
+
+    async def stop_listener(self) -> None:
+        """No-op, the listener is never started."""
+
+    def subscribe(self, callback: Callable[[dict[str, Any]], None]) -> None:
+        """Receive changes, mirroring Database.subscribe."""
+        self._subscribers.append(callback)
+
+    def _publish(self, op: str, image_id: Any) -> None:
+        """Pass a change to subscribers right away, there is no NOTIFY."""
+        for callback in self._subscribers:
+            callback({'op': op, 'id': image_id})
+
+    def pool_stats(self) -> list[tuple[str, str, float]]:
+        """Return no pool statistics."""
+        return []
+
+    async def insert_image(self, filename: str, original_name: str,
+                           size: int, file_type: str,
+                           content_hash: Optional[str] = None,
+                           width: Optional[int] = None,
+                           height: Optional[int] = None,
+                           orientation: Optional[int] = None,
+                           placeholder: Optional[str] = None,
+                           phash: Optional[int] = None,
+                           jobs: Iterable[str] = ()) -> int:
+        """Insert image metadata, mirroring Database.insert_image."""
+        if content_hash is not None and content_hash in self._by_hash:
+            row = self._by_hash[content_hash]
+            row['ref_count'] += 1
+            return row['id']
+        row = {
+            'id': self._next_id,
+            'filename': filename,
+            'original_name': original_name,
+            'size': size,
+            'file_type': file_type,
+            'upload_time': datetime.now(timezone.utc),
+            'content_hash': content_hash,
+            'ref_count': 1,
+            'width': width,
+            'height': height,
+            'orientation': orientation,
+            'placeholder': placeholder,
+            'phash': phash,
+            'processing_status': constants.STATUS_READY,
+        }
+        self._next_id += 1
+        self._rows[row['id']] = row
+        if content_hash is not None:
+            self._by_hash[content_hash] = row
+        self._enqueue_jobs(row, jobs)
+        self.images_cache.clear()
+        self._publish(constants.OP_INSERT, row['id'])
+        return row['id']
+
+    async def insert_images(self, rows: list[tuple],
+                            jobs: Iterable[str] = ()) -> list[int]:
+        """Insert many images, mirroring Database.insert_images."""
+        jobs = list(jobs)
+        return [await self.insert_image(*row, jobs=jobs) for row in rows]
+
+    def _enqueue_jobs(self, row: dict[str, Any], jobs: Iterable[str]) -> None:
+        """Queue jobs of a new image, mirroring Database._enqueue_jobs."""
+        for kind in jobs:
+            self._jobs[self._next_job_id] = {
+                'id': self._next_job_id,
+                'image_id': row['id'],
+                'kind': kind,
+                'status': constants.STATUS_PENDING,
+                'attempts': 0,
+                'run_after': time.time(),
+                'last_error': None,
+            }
+            self._next_job_id += 1
+            row['processing_status'] = constants.STATUS_PENDING
+
+    async def claim_jobs(self, limit: int,
+                         lease: float = constants.JOB_LEASE
+                         ) -> list[tuple[int, str, int, int, str]]:
+        """Claim due jobs, mirroring Database.claim_jobs."""
+        now = time.time()
+        due = sorted((job for job in self._jobs.values()
+                      if job['status'] != constants.STATUS_FAILED
+                      and job['run_after'] <= now),
+                     key=lambda job: job['run_after'])[:limit]
+        claimed = []
+        for job in due:
+            job['status'] = constants.STATUS_RUNNING
+            job['attempts'] += 1
+            job['run_after'] = now + lease
+            claimed.append((job['id'], job['kind'], job['attempts'],
+                            job['image_id'],
+                            self._rows[job['image_id']]['filename']))
+        return claimed
+
+    async def complete_job(self, job_id: int) -> None:
+        """Remove a finished job, mirroring Database.complete_job."""
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return
+        row = self._rows[job['image_id']]
+        if (row['processing_status'] == constants.STATUS_PENDING
+                and not any(other['image_id'] == row['id']
+                            for other in self._jobs.values())):
+            row['processing_status'] = constants.STATUS_READY
+            self._publish(constants.OP_UPDATE, row['id'])
+        self.images_cache.clear()
+
+    async def fail_job(self, job_id: int, error: str, delay: float,
+                       max_attempts: int = constants.JOB_MAX_ATTEMPTS
+                       ) -> None:
+        """Retry or give up on a job, mirroring Database.fail_job."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        job['run_after'] = time.time() + delay
+        job['last_error'] = error
+        if job['attempts'] >= max_attempts:
+            job['status'] = constants.STATUS_FAILED
+            self._rows[job['image_id']]['processing_status'] = (
+                constants.STATUS_FAILED)
+            self._publish(constants.OP_UPDATE, job['image_id'])
+        else:
+            job['status'] = constants.STATUS_PENDING
+        self.images_cache.clear()
+
+    async def get_images(self, page: int = 1, cursor: Optional[str] = None,
+                         count: str = constants.COUNT_EXACT,
+                         per_page: int = ITEMS_PER_PAGE) -> dict[str, Any]:
+        """Get a page of images, mirroring Database.get_images."""
+        cache_key = (page, cursor, count, per_page)
+        cached = self.images_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        newest_first = reversed(self._rows.values())
+        if cursor:
+            position = decode_cursor(cursor)
+            rows = list(islice(
+                (row for row in newest_first
+                 if (row['upload_time'], row['id']) < position),
+                per_page + 1))
+            page = None
+        else:
+            offset = (page - 1) * per_page
+            rows = list(islice(newest_first, offset,
+                               offset + per_page + 1))
+
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_cursor = encode_cursor(rows[-1]['upload_time'],
+                                        rows[-1]['id'])
+        images = [self._record(row) for row in rows]
+        total = None if count == constants.COUNT_NONE else len(self._rows)
+        images_data = {
+            constants.IMAGES: images,
+            constants.TOTAL_IMAGES: total,
+            constants.PAGE: page,
+            constants.PER_PAGE: per_page,
+            constants.TOTAL_PAGES: (
+                None if total is None
+                else (total + per_page - 1) // per_page),
+            constants.NEXT_CURSOR: next_cursor,
+        }
+        self.images_cache.set(cache_key, images_data)
+        return images_data
+
+    @staticmethod
+    def _record(row: dict[str, Any]) -> dict[str, Any]:
+        """Format a stored row like the records of Database.get_images."""
+        return {
+            'id': row['id'],
+            'filename': row['filename'],
+            'original_name': row['original_name'],
+            'size': row['size'],
+            'file_type': row['file_type'],
+            'size_kb': row['size'] // 1024,
+            'upload_date': row['upload_time'].strftime('%Y-%m-%d %H:%M:%S'),
+            'width': row['width'],
+            'height': row['height'],
+            'orientation': row['orientation'],
+            'placeholder': row['placeholder'],
+            'processing_status': row['processing_status'],
+            constants.THUMBNAIL_URL_KEY: constants.THUMBNAIL_URL.format(
+                id=row['id'], width=bucket_width(None)),
+        }
+
+    async def get_images_by_ids(
+            self, image_ids: list[int]) -> dict[int, dict[str, Any]]:
+        """Get image records by IDs, mirroring Database.get_images_by_ids."""
+        return {image_id: self._record(self._rows[image_id])
+                for image_id in image_ids if image_id in self._rows}
+
+    async def export_images(self, since: Optional[datetime] = None,
+                            batch_size: int = constants.EXPORT_BATCH_SIZE
+                            ) -> AsyncIterator[dict[str, Any]]:
+        """Stream image records, mirroring Database.export_images."""
+        for row in list(self._rows.values()):
+            if since is None or row['upload_time'] >= since:
+                yield dict(row)
+
+    async def get_filenames(self, after: str,
+                            limit: int) -> list[tuple[int, str]]:
+        """Get filenames in order, mirroring Database.get_filenames."""
+        rows = sorted((row['filename'], row['id'])
+                      for row in self._rows.values()
+                      if row['filename'] > after)[:limit]
+        return [(image_id, filename) for filename, image_id in rows]
+
+    async def find_filenames(self, filenames: list[str]) -> set[str]:
+        """Get stored filenames, mirroring Database.find_filenames."""
+        stored = {row['filename'] for row in self._rows.values()}
+        return stored.intersection(filenames)
+
+    async def get_phash(self, image_id: int) -> tuple[bool, Optional[int]]:
+        """Get the hash of an image, mirroring Database.get_phash."""
+        row = self._rows.get(image_id)
+        return (True, row['phash']) if row else (False, None)
+
+    async def find_by_content_hash(self, content_hash: str) -> Optional[int]:
+        """Find an image by hash, mirroring Database.find_by_content_hash."""
+        row = self._by_hash.get(content_hash)
+        return row['id'] if row else None
+
+    async def get_phashes(self, after_id: int,
+                          limit: int) -> list[tuple[int, int]]:
+        """Get hashes by ID, mirroring Database.get_phashes."""
+        return list(islice(
+            ((row['id'], row['phash']) for row in self._rows.values()
+             if row['id'] > after_id and row['phash'] is not None), limit))
+
+    async def get_phashes_by_ids(
+            self, image_ids: list[int]) -> list[tuple[int, int]]:
+        """Get hashes of images, mirroring Database.get_phashes_by_ids."""
+        return [(image_id, self._rows[image_id]['phash'])
+                for image_id in image_ids if image_id in self._rows
+                and self._rows[image_id]['phash'] is not None]
+
+    async def add_variant(self, filename: str, image_format: str,
+                          size: int) -> tuple[bool, list[tuple[str, str]]]:
+        """Keep every variant, mirroring Database.add_variant."""
+        return True, []
+
+    async def get_filename(self, image_id: int) -> Optional[str]:
+        """Get the filename of an image, mirroring Database.get_filename."""
+        row = self._rows.get(image_id)
+        return row['filename'] if row else None
+
+    async def delete_image(self, image_id: int) -> tuple[bool, Optional[str]]:
+        """Delete one image, mirroring Database.delete_image."""
+        rows = await self.delete_images(image_ids=[image_id])
+        if not rows:
+            return False, None
+        return True, rows[0][1]
+
+    async def delete_images(
+            self,
+            image_ids: Optional[list[int]] = None,
+            since: Optional[datetime] = None,
+            until: Optional[datetime] = None,
+            force: bool = False,
+    ) -> list[tuple[int, Optional[str]]]:
+        """Delete images, mirroring Database.delete_images."""
+        if image_ids is not None:
+            targets = [self._rows[image_id] for image_id in image_ids
+                       if image_id in self._rows]
+        else:
+            targets = [row for row in self._rows.values()
+                       if (since is None or row['upload_time'] >= since)
+                       and (until is None or row['upload_time'] < until)]
+        result = []
+        for row in targets:
+            if row['ref_count'] > 1 and not force:
+                row['ref_count'] -= 1
+                result.append((row['id'], None))
+                continue
+            del self._rows[row['id']]
+            self._by_hash.pop(row['content_hash'], None)
+            for job_id in [job['id'] for job in self._jobs.values()
+                           if job['image_id'] == row['id']]:
+                del self._jobs[job_id]
+            result.append((row['id'], row['filename']))
+        self.images_cache.clear()
+        deleted_ids = [image_id for image_id, filename in result
+                       if filename is not None]
+        if deleted_ids:
+            self._publish(constants.OP_DELETE, deleted_ids)
+        return result
@@ -0,0 +1,305 @@
+"""Benchmark the upload and gallery endpoints.
+
+Usage:
+    python -m benchmarks.run run --db memory --requests 500 --concurrency 32
+    python -m benchmarks.run compare base.json new.json --threshold 0.1
+
+The run command starts init_app() in-process (against Postgres from
+DATABASE_URL or the in-memory MemoryDatabase) or targets --url, drives the
+upload, list, deep_page and delete scenarios and prints JSON with
+throughput, p50/p95/p99 latency and peak RSS. The compare command exits
+with status 1 when any scenario regressed by more than the threshold.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+import uuid
+from io import BytesIO
+from typing import Any, Awaitable, Callable, Optional
+
+SCENARIOS = ('upload', 'list', 'deep_page', 'delete')
+
+os.environ.setdefault('ALLOWED_EXTENSIONS', 'jpg,jpeg,png,gif')
+os.environ.setdefault('APP_PORT', '8000')
+os.environ.setdefault('BASE_URL', 'http://localhost')
+os.environ.setdefault('MAX_FILE_SIZE', str(30 * 1024 * 1024))
+# Every request comes from one address, so per-client rate limits would
+# measure the limiter instead of the server.
+os.environ.setdefault('UPLOAD_RATE_LIMIT', '0')
+os.environ.setdefault('READ_RATE_LIMIT', '0')
+
+
+def percentile(values: list[float], fraction: float) -> Optional[float]:
+    """Return the nearest-rank percentile of the values.
+
+    Args:
+        values: Sorted observations.
+        fraction: Percentile between 0 and 1.
+    Returns:
+        Optional[float]: The percentile or None without observations.
+    """
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+def make_image(size: str, image_format: str) -> bytes:
+    """Generate a noise image of the given size.
+
+    Args:
+        size: WIDTHxHEIGHT in pixels.
+        image_format: Pillow format name.
+    Returns:
+        bytes: Encoded image.
+    """
+    from PIL import Image
+
+    width, height = (int(value) for value in size.lower().split('x'))
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+async def drive(requests: int, concurrency: int,
+                call: Callable[[int], Awaitable[bool]]) -> dict[str, Any]:
+    """Run calls with bounded concurrency and summarize latencies.
+
+    Args:
+        requests: Total number of calls.
+        concurrency: Number of concurrent workers.
+        call: Coroutine taking the request index, returning success.
+    Returns:
+        dict: requests, errors, seconds, throughput and percentiles in ms.
+    """
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for index in counter:
+            started = time.perf_counter()
+            try:
+                ok = await call(index)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+    latencies.sort()
+    stats = {
+        'requests': requests,
+        'errors': errors,
+        'seconds': round(seconds, 4),
+        'throughput': round(requests / seconds, 2) if seconds else None,
+    }
+    for name, fraction in (('p50_ms', 0.5), ('p95_ms', 0.95),
+                           ('p99_ms', 0.99)):
+        value = percentile(latencies, fraction)
+        stats[name] = round(value * 1000, 3) if value is not None else None
+    return stats
+
+
+async def seed(database: Any, rows: int) -> None:
+    """Insert metadata rows without files so deep pages exist.
+
+    Args:
+        database: Database or MemoryDatabase.
+        rows: Number of rows to insert.
+    """
+    batch = 1000
+    for start in range(0, rows, batch):
+        await database.insert_images([
+            (f'{uuid.uuid4().hex}.jpg', f'seed-{index}.jpg', 1024, 'jpg',
+             None, None, None, None, None, None)
+            for index in range(start, min(rows, start + batch))])
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    """Run the selected scenarios.
+
+    Args:
+        args: Parsed command line arguments.
+    Returns:
+        dict: Benchmark report.
+    """
+    from aiohttp import ClientSession, FormData
+    from aiohttp.test_utils import TestServer
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        import app as app_module
+        if args.db == 'memory':
+            from benchmarks.memory_db import MemoryDatabase
+            app_module.db = MemoryDatabase()
+        server = TestServer(await app_module.init_app())
+        await server.start_server()
+        base_url = str(server.make_url('')).rstrip('/')
+        if args.seed:
+            await seed(app_module.db, args.seed)
+
+    payload = make_image(args.image_size, args.image_format)
+    extension = args.image_format.lower()
+    uploaded: list[int] = []
+    report: dict[str, Any] = {
+        'config': {key: value for key, value in vars(args).items()
+                   if key != 'command'},
+        'image_bytes': len(payload),
+        'scenarios': {},
+    }
+
+    async with ClientSession() as session:
+        async def upload(index: int) -> bool:
+            form = FormData()
+            form.add_field('file', payload, filename=f'bench-{index}.'
+                                                     f'{extension}')
+            async with session.post(f'{base_url}/upload', data=form) as resp:
+                await resp.read()
+                return resp.status == 201
+
+        async def list_page(index: int) -> bool:
+            async with session.get(f'{base_url}/api/images',
+                                   params={'page': 1}) as resp:
+                await resp.read()
+                return resp.status == 200
+
+        async def deep_page(index: int) -> bool:
+            async with session.get(f'{base_url}/api/images',
+                                   params={'page': args.deep_page}) as resp:
+                await resp.read()
+                return resp.status in (200, 404)
+
+        async def delete(index: int) -> bool:
+            if index >= len(uploaded):
+                return True
+            async with session.delete(
+                    f'{base_url}/api/images/{uploaded[index]}') as resp:
+                await resp.read()
+                return resp.status == 200
+
+        calls = {'upload': upload, 'list': list_page,
+                 'deep_page': deep_page, 'delete': delete}
+        for scenario in args.scenarios:
+            if scenario == 'delete':
+                uploaded = await newest_ids(session, base_url, args.requests)
+            report['scenarios'][scenario] = await drive(
+                args.requests, args.concurrency, calls[scenario])
+
+    if server is not None:
+        await server.close()
+    report['peak_rss_kb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+
+async def newest_ids(session: Any, base_url: str, limit: int) -> list[int]:
+    """Collect IDs of the newest images by following cursors.
+
+    Args:
+        session: Client session.
+        base_url: Server URL.
+        limit: Maximum number of IDs.
+    Returns:
+        list: Image IDs, newest first.
+    """
+    ids: list[int] = []
+    params = {'count': 'none'}
+    while len(ids) < limit:
+        async with session.get(f'{base_url}/api/images',
+                               params=params) as resp:
+            data = await resp.json()
+        ids.extend(image['id'] for image in data['images'])
+        if not data.get('next_cursor'):
+            break
+        params = {'cursor': data['next_cursor']}
+    return ids[:limit]
+
+
+def compare(args: argparse.Namespace) -> int:
+    """Compare two reports and print per-scenario changes.
+
+    Args:
+        args: Parsed command line arguments.
+    Returns:
+        int: 1 if any scenario regressed beyond the threshold, otherwise 0.
+    """
+    with open(args.base) as base_file, open(args.new) as new_file:
+        base, new = json.load(base_file), json.load(new_file)
+    regressions = []
+    result: dict[str, Any] = {}
+    for scenario, base_stats in base['scenarios'].items():
+        new_stats = new['scenarios'].get(scenario)
+        if new_stats is None:
+            continue
+        changes = {}
+        for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if not base_stats.get(key) or new_stats.get(key) is None:
+                continue
+            change = (new_stats[key] - base_stats[key]) / base_stats[key]
+            changes[key] = round(change, 4)
+            worse = -change if key == 'throughput' else change
+            if worse > args.threshold:
+                regressions.append(f'{scenario}.{key}')
+        result[scenario] = changes
+    result['peak_rss_kb'] = round(
+        (new['peak_rss_kb'] - base['peak_rss_kb']) / base['peak_rss_kb'], 4)
+    result['regressions'] = regressions
+    print(json.dumps(result, indent=2))
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    """Parse arguments and run the selected command.
+
+    Returns:
+        int: Process exit status.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run scenarios')
+    run_parser.add_argument('--db', choices=('memory', 'postgres'),
+                            default='memory')
+    run_parser.add_argument('--url', help='benchmark a running server')
+    run_parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS,
+                            default=list(SCENARIOS))
+    run_parser.add_argument('--requests', type=int, default=200)
+    run_parser.add_argument('--concurrency', type=int, default=16)
+    run_parser.add_argument('--image-size', default='1024x768')
+    run_parser.add_argument('--image-format', default='JPEG')
+    run_parser.add_argument('--seed', type=int, default=0,
+                            help='metadata rows to insert before running')
+    run_parser.add_argument('--deep-page', type=int, default=1000)
+    run_parser.add_argument('--output', help='write the report to a file')
+
+    compare_parser = commands.add_parser('compare',
+                                         help='compare two reports')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        return compare(args)
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
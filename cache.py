@@ -0,0 +1,85 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries expire after a TTL.
+
+    Attributes:
+        hits: Number of lookups served from the cache.
+        misses: Number of lookups that missed or found an expired entry.
+        invalidations: Number of times the cache was cleared, also used
+            as the generation of the entries.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of entries, 0 disables caching.
+            ttl: Entry lifetime in seconds.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a cached value and mark it as recently used.
+
+        Args:
+            key: Cache key.
+        Returns:
+            Optional[Any]: The value or None on a miss.
+        """
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any,
+            generation: Optional[int] = None) -> None:
+        """Store a value, evicting the least recently used entry if full.
+
+        Args:
+            key: Cache key.
+            value: Value to store.
+            generation: invalidations when the value was read. The value is
+                dropped if the cache was cleared since, as it may predate
+                the change that cleared it.
+        """
+        if self.maxsize <= 0:
+            return
+        if generation is not None and generation != self.invalidations:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop all entries."""
+        self._data.clear()
+        self.invalidations += 1
+
+    def stats(self) -> dict[str, int]:
+        """Return cache counters.
+
+        Returns:
+            dict: size, maxsize, hits, misses and invalidations.
+        """
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
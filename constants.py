@@ -15,12 +15,30 @@ UNSUPPORTED_EXTENSION_RU = 'Неподдерживаемое расширени
 UNSUPPORTED_FILE_TYPE = 'Unsupported file type: {error}'
 LOAD_IMAGE_GALLERY_ERROR = 'Error loading images gallery: {error}'
 UPLOAD_FORM_ERROR = 'Error loading upload form: {error}'
+INDEX_PAGE_ERROR = 'Error loading main page: {error}'
 UPLOAD_ERROR = 'Error during file upload: {error}'
+BATCH_UPLOAD_RESULT = 'Batch upload: {saved} of {total} files saved'
+TOO_MANY_FILES_RU = 'Превышено количество файлов в одном запросе: {limit}'
 UNSUPPORTED_FILE_TYPE_RU = 'Неподдерживаемый тип файла'
 FILE_UPLOAD_SUCCESS = 'File uploaded successfully: {file_path}'
+DUPLICATE_UPLOAD = 'Duplicate upload, reusing stored file: {file_path}'
+TEMP_FILE_REMOVE_ERROR = 'Failed to remove temporary file {file_path}: {error}'
 UPLOAD_SUCCESS_MESSAGE = 'Изображение успешно загружено'
 INVALID_URL = 'Invalid URL: {path}'
 ERROR_500 = 'Ошибка сервера'
+SERVICE_BUSY_RU = 'Сервер перегружен, повторите попытку позже'
+TOO_MANY_REQUESTS_RU = 'Слишком много запросов, повторите попытку позже'
+UPLOAD_SESSION_NOT_FOUND_RU = 'Сессия загрузки не найдена или истекла'
+UPLOAD_OFFSET_MISMATCH_RU = 'Неверное смещение, текущее: {offset}'
+UPLOAD_SESSION_BUSY_RU = 'Сессия загрузки уже используется другим запросом'
+UPLOAD_SESSIONS_LIMIT_RU = ('Слишком много незавершенных загрузок, завершите '
+                            'или отмените их')
+UPLOAD_INCOMPLETE_RU = 'Загрузка не завершена: получено {offset} из {size} байт'
+UPLOAD_SESSION_CREATED = 'Upload session {session_id} created: {size} bytes'
+UPLOAD_SESSIONS_LIMITED = ('Upload session of {client} refused: {total} open, '
+                           '{of_client} of the client')
+UPLOAD_SESSIONS_EXPIRED = 'Expired upload sessions removed: {count}'
+UPLOAD_SWEEP_ERROR = 'Failed to sweep upload sessions: {error}'
 INVALID_PATH = "Invalid path: {path}"
 DELETE_FILE_ERROR = 'Failed to delete file {error}'
 DELETE_FILE_SUCCESS = 'File deleted successfully: {id}'
@@ -31,18 +49,116 @@ IMAGES = 'images'
 PER_PAGE = 'per_page'
 PAGE = 'page'
 LAST_PAGE = 'last_page'
+CURSOR = 'cursor'
+IDS = 'ids'
+TIME_FROM = 'from'
+TIME_TO = 'to'
+DELETED = 'deleted'
+RELEASED = 'released'
+NOT_FOUND = 'not_found'
+NEXT_CURSOR = 'next_cursor'
+COUNT = 'count'
+COUNT_EXACT = 'exact'
+COUNT_APPROX = 'approx'
+COUNT_NONE = 'none'
+COUNT_MODES = (COUNT_EXACT, COUNT_APPROX, COUNT_NONE)
+UPLOAD_TIME = 'upload_time'
+INVALID_CURSOR = 'Invalid cursor: {cursor}'
+THUMBNAIL_URL_KEY = 'thumbnail_url'
+THUMBNAIL_URL = '/api/images/{id}/thumb?w={width}'
+WIDTH = 'w'
+DISTANCE = 'distance'
+SINCE = 'since'
+LIMIT = 'limit'
+INVALID_PARAMETER = 'Invalid parameter: {error}'
+INVALID_PARAMETER_RU = 'Некорректный параметр запроса'
+THUMBNAIL_ERROR = 'Failed to create thumbnail for {filename}: {error}'
+THUMBNAIL_CREATED = 'Thumbnails created for {filename}: {widths}'
+VARIANT_SOURCE_EXTENSIONS = ('jpg', 'jpeg', 'png')
+VARIANT_CONTENT_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+VARIANT_CREATED = 'Variant {format} created for {filename}: {size} bytes'
+VARIANT_ERROR = 'Failed to create {format} variant of {filename}: {error}'
+VARIANTS_EVICTED = 'Variants evicted: {count}'
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+PLACEHOLDER_PREFIX = 'data:image/jpeg;base64,'
+PHASH_SIZE = 8
+PHASH_BITS = PHASH_SIZE * PHASH_SIZE
+SIMILAR_DEFAULT_DISTANCE = 10
+SIMILAR_DEFAULT_LIMIT = 20
+SIMILAR_MAX_LIMIT = 100
+SIMILARITY_LOAD_BATCH = 50000
+SIMILARITY_BLOCK_SIZE = 1 << 20
+RECONCILE_BATCH_SIZE = 1000
+RECONCILE_LOCK = '.reconcile.lock'
+RECONCILE_BUSY = 'Reconciliation already running in another process'
+RECONCILE_ORPHAN_FILE = 'File without a database row: {file_path} ' \
+                        '({size} bytes)'
+RECONCILE_MISSING_FILE = 'Image {id} has no file: {filename}'
+RECONCILE_DONE = 'Reconciliation done: {files} files, ' \
+                 '{orphan_files} orphaned ({recent_files} too recent), ' \
+                 '{missing_files} rows without files; removed ' \
+                 '{removed_files} files and {removed_rows} rows'
+RECONCILE_ERROR = 'Reconciliation failed: {error}'
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_CURSOR = 'export_images'
+EXPORT_METADATA_NAME = 'images.ndjson'
+EXPORT_NDJSON_NAME = 'images-{time}.ndjson'
+EXPORT_TAR_NAME = 'snapshot-{time}.tar'
+EXPORT_FINISHED = 'Export {name} finished: {count} images'
+EXPORT_ERROR = 'Export {name} failed: {error}'
+EXPORT_FILE_MISSING = 'Export skipped missing file {filename}'
+SIMILARITY_LOADED = 'Similarity index loaded: {count} hashes'
+NEAR_DUPLICATE = 'Upload rejected, near duplicate of image {id} ' \
+                 '(distance {distance})'
+NEAR_DUPLICATE_RU = 'Очень похожее изображение уже загружено: {id}'
+BACKFILL_BATCH_SIZE = 500
+BACKFILL_PROGRESS = 'Metadata backfilled: {updated} images, {missing} missing'
+BACKFILL_FAILED = 'Failed to describe {filename}: {error}'
+SHARD_MIGRATE_BATCH_SIZE = 1000
+SHARD_MIGRATE_PAUSE = 0.5
+SHARD_MIGRATE_PROGRESS = 'Files moved into shards: {moved}, {failed} failed'
+SHARD_MIGRATE_ERROR = 'Failed to move {filename} into its shard: {error}'
 MSG = 'message'
 
 # logs
 LOG_FORMAT = '{time:YYYY-MM-DD HH:mm:ss} {level}: {message}'
 LOG_LEVEL = 'INFO'
 LOG_FILE = 'app.log'
+WORKER_LOG_FILE = 'app-worker-{index}.log'
+MANAGE_LOG_FILE = 'manage.log'
 LOG_DIR = 'logs'
+LOG_ROTATION_SIZE = int(os.getenv('LOG_ROTATION_SIZE', 50 * 1024 * 1024))
+LOG_ROTATION_INTERVAL = float(os.getenv('LOG_ROTATION_INTERVAL', 24 * 3600))
+LOG_RETENTION = int(os.getenv('LOG_RETENTION', 10))
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 1))
 
 # images
 IMAGES_DIR = 'images'
+UPLOAD_CHUNK_SIZE = 64 * 1024
+FILE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+VARIANT_PENDING_CACHE_CONTROL = 'public, max-age=60'
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+FILENAME_PATTERN = r'[0-9a-f]+\.(?:{extensions})'
+TEMP_FILE_SUFFIX = '.part'
+UPLOAD_SESSION_SUFFIX = '.upload'
+UPLOAD_META_SUFFIX = '.json'
+UPLOAD_SESSIONS_LOCK = '.sessions.lock'
+UPLOAD_SESSION_ROUTE = '/api/uploads/{id:[0-9a-f]{32}}'
+UPLOAD_SESSION_URL = '/api/uploads/{id}'
+UPLOAD_OFFSET = 'Upload-Offset'
+UPLOAD_LENGTH = 'Upload-Length'
+CONTENT_HASH_SIZE = 32
 
 # HTML
+STATIC_DIR = 'static'
+STATIC_PAGES_CHECK_MTIME = os.getenv('STATIC_PAGES_CHECK_MTIME',
+                                     'false').lower() == 'true'
+PAGE_CACHE_CONTROL = 'no-cache'
+PAGE_CACHED = 'Static page cached: {page}'
+PAGE_CACHE_ERROR = 'Failed to cache static page {page}: {error}'
 INDEX_HTML = 'index.html'
 IMAGES_HTML = 'images/images.html'
 UPLOAD_HTML = 'upload.html'
@@ -50,15 +166,48 @@ UPLOAD_HTML = 'upload.html'
 # HTTP status
 HTTP_200_OK = 200
 HTTP_201_CREATED = 201
+HTTP_204_NO_CONTENT = 204
+HTTP_304_NOT_MODIFIED = 304
 HTTP_400_BAD_REQUEST = 400
 HTTP_404_NOT_FOUND = 404
+HTTP_409_CONFLICT = 409
 HTTP_413_REQUEST_ENTITY_TOO_LARGE = 413
 HTTP_415_UNSUPPORTED_MEDIA_TYPE = 415
+HTTP_429_TOO_MANY_REQUESTS = 429
 HTTP_500_INTERNAL_SERVER_ERROR = 500
+HTTP_503_SERVICE_UNAVAILABLE = 503
+RETRY_AFTER_SECONDS = 1
 
 # Content-type
 CONTENT_TYPE_HTML = "text/html"
 CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_NDJSON = "application/x-ndjson"
+CONTENT_TYPE_EVENT_STREAM = "text/event-stream"
+CONTENT_TYPE_TAR = "application/x-tar"
+CONTENT_TYPE_METRICS = "text/plain; version=0.0.4"
+
+# Admission control
+ADMISSION_UPLOAD = 'upload'
+ADMISSION_READ = 'read'
+UPLOAD_ROUTE_PREFIXES = ('/upload', '/api/images/batch', '/api/uploads')
+READ_ROUTE_PREFIX = '/api/images'
+RATE_LIMIT_CLIENTS = 10000
+REJECT_RATE = 'rate'
+REJECT_CONCURRENCY = 'concurrency'
+REJECT_BYTES = 'bytes'
+
+# Metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 5 * 1024 ** 2,
+                30 * 1024 ** 2)
+POOL_STAT_HELP = 'Connection pool statistic {stat}.'
+CACHE_STAT_HELP = 'Gallery listing cache statistic {stat}.'
+STAGE_MULTIPART_READ = 'multipart_read'
+STAGE_CHECK_FILE_TYPE = 'check_file_type'
+STAGE_DESCRIBE_IMAGE = 'describe_image'
+STAGE_SAVE_FILE = 'save_file'
+STAGE_INSERT_IMAGE = 'insert_image'
 
 # .env
 ALLOWED_EXTENSIONS = tuple(os.getenv('ALLOWED_EXTENSIONS').split(','))
@@ -67,6 +216,63 @@ BASE_URL = os.getenv('BASE_URL')
 MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE'))
 DATABASE_URL = os.getenv('DATABASE_URL')
 DB_NAME = os.getenv('POSTGRES_DB')
+IMAGE_ROUTE = '/images/{{filename:{pattern}}}'.format(
+    pattern=FILENAME_PATTERN.format(extensions='|'.join(ALLOWED_EXTENSIONS)))
+IMAGE_EXECUTOR = os.getenv('IMAGE_EXECUTOR', 'process')
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', os.cpu_count() or 1))
+IMAGE_QUEUE_SIZE = int(os.getenv('IMAGE_QUEUE_SIZE', 32))
+DERIVATIVES_DIR = os.getenv('DERIVATIVES_DIR', 'derivatives')
+THUMBNAIL_WIDTHS = tuple(sorted(
+    int(width) for width in os.getenv('THUMBNAIL_WIDTHS',
+                                      '160,320,640').split(',')))
+THUMBNAIL_DEFAULT_WIDTH = int(os.getenv('THUMBNAIL_DEFAULT_WIDTH', 320))
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 85))
+CONTENT_ADDRESSED_STORAGE = os.getenv('CONTENT_ADDRESSED_STORAGE',
+                                      'false').lower() == 'true'
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 8))
+RECONCILE_INTERVAL = float(os.getenv('RECONCILE_INTERVAL', 0))
+RECONCILE_DELETE = os.getenv('RECONCILE_DELETE', 'false').lower() == 'true'
+RECONCILE_RATE = float(os.getenv('RECONCILE_RATE', 200))
+RECONCILE_GRACE = float(os.getenv('RECONCILE_GRACE', 3600))
+EXPORT_CONCURRENCY = int(os.getenv('EXPORT_CONCURRENCY', 2))
+UPLOAD_RATE_LIMIT = float(os.getenv('UPLOAD_RATE_LIMIT', 2))
+UPLOAD_RATE_BURST = float(os.getenv('UPLOAD_RATE_BURST', 10))
+READ_RATE_LIMIT = float(os.getenv('READ_RATE_LIMIT', 20))
+READ_RATE_BURST = float(os.getenv('READ_RATE_BURST', 50))
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', 16))
+READ_CONCURRENCY = int(os.getenv('READ_CONCURRENCY', 64))
+UPLOAD_BYTES_IN_FLIGHT = int(os.getenv('UPLOAD_BYTES_IN_FLIGHT',
+                                       256 * 1024 ** 2))
+EVENTS_MAX_CLIENTS = int(os.getenv('EVENTS_MAX_CLIENTS', 1000))
+EVENTS_KEEPALIVE = float(os.getenv('EVENTS_KEEPALIVE', 15))
+TRUSTED_PROXIES = tuple(
+    proxy.strip() for proxy in os.getenv('TRUSTED_PROXIES', '').split(',')
+    if proxy.strip())
+PHASH_REJECT_DISTANCE = int(os.getenv('PHASH_REJECT_DISTANCE', -1))
+SIMILARITY_REFRESH_INTERVAL = float(os.getenv('SIMILARITY_REFRESH_INTERVAL',
+                                              1))
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', 1000))
+BULK_DELETE_MAX_IDS = int(os.getenv('BULK_DELETE_MAX_IDS', 10000))
+FILE_REMOVE_CONCURRENCY = int(os.getenv('FILE_REMOVE_CONCURRENCY', 16))
+EAGER_THUMBNAILS = os.getenv('EAGER_THUMBNAILS', 'false').lower() == 'true'
+VARIANT_FORMATS = tuple(
+    image_format for image_format in os.getenv('VARIANT_FORMATS',
+                                               'avif,webp').split(',')
+    if image_format)
+WEBP_QUALITY = int(os.getenv('WEBP_QUALITY', 80))
+AVIF_QUALITY = int(os.getenv('AVIF_QUALITY', 60))
+VARIANT_CACHE_MAX_BYTES = int(os.getenv('VARIANT_CACHE_MAX_BYTES',
+                                        1024 ** 3))
+UPLOADS_DIR = os.getenv('UPLOADS_DIR', os.path.join(IMAGES_DIR, '.uploads'))
+UPLOAD_SESSION_TTL = float(os.getenv('UPLOAD_SESSION_TTL', 24 * 3600))
+UPLOAD_SWEEP_INTERVAL = float(os.getenv('UPLOAD_SWEEP_INTERVAL', 600))
+UPLOAD_SESSIONS_MAX = int(os.getenv('UPLOAD_SESSIONS_MAX', 100))
+UPLOAD_SESSIONS_PER_CLIENT = int(os.getenv('UPLOAD_SESSIONS_PER_CLIENT', 5))
+JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', 4))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 5))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 2))
+JOB_LEASE = float(os.getenv('JOB_LEASE', 300))
 # Requests
 GET_REQUEST = 'GET: {request}'
 POST_REQUEST = 'POST: {request}'
@@ -75,14 +281,27 @@ POST_REQUEST = 'POST: {request}'
 ITEMS_PER_PAGE = 10
 
 # Database
-DB_POOL_MIN_SIZE = 1
-DB_POOL_MAX_SIZE = 10
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 4))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+DB_CONNECTION_BUDGET = int(os.getenv('DB_CONNECTION_BUDGET', 40))
+DB_POOL_CLOSE_TIMEOUT = float(os.getenv('DB_POOL_CLOSE_TIMEOUT', 10))
+DB_PREPARE_THRESHOLD = (int(os.getenv('DB_PREPARE_THRESHOLD', 0))
+                        if os.getenv('DB_PREPARE_THRESHOLD') != 'none'
+                        else None)
+IMAGES_CACHE_SIZE = int(os.getenv('IMAGES_CACHE_SIZE', 256))
+IMAGES_CACHE_TTL = float(os.getenv('IMAGES_CACHE_TTL', 5))
+IMAGES_CACHE_LISTEN = os.getenv('IMAGES_CACHE_LISTEN',
+                                'true').lower() == 'true'
+# The listener feeds both cache invalidation and the image event stream,
+# and holds one connection outside the pool.
+DB_LISTENER = IMAGES_CACHE_LISTEN or EVENTS_MAX_CLIENTS > 0
 
 ERROR_DB_CONNECTION = 'Database connection error {error}'
 ERROR_DB_INITIALIZE  = 'Database initialization error {error}'
 ERROR_DB_OPERATION = 'Database operation failed {error}'
 DB_POOL_SUCCESS = 'Database pool created successfully'
 DB_POOL_CLOSE_SUCCESS = 'Database pool closed successfully'
+DB_POOL_WARMED = 'Database pool warmed: {connections} connections'
 DISCONNECT_FAILED = 'Failed to disconnect from database {error}'
 CREATE_TABLE_SUCCESS = 'Database tables initialized'
 CREATE_TABLE_ERROR = 'Database table initialization failed {error}'
@@ -91,6 +310,61 @@ IMG_INSERT_FAILED = 'Image insert failed {error}'
 IMG_DELETE_FAILED = 'Image deletion failed {error}'
 IMG_INSERT_SUCCESS = 'Image inserted with ID: {image_id}'
 IMG_DELETE_SUCCESS = 'Image deleted successfully: {filename}'
+IMAGES_DELETED = 'Images deleted: {deleted}, references released: {released}'
 FAIL_TO_FETCH_IMG = 'Failed to fetch images: {error}'
 NOT_FOUND_IN_DB = 'Image not found in database'
-DB_CONNECT = 'Connected to database: {db}'
\ No newline at end of file
+DB_CONNECT = 'Connected to database: {db}'
+IMAGES_CHANNEL = 'images_changed'
+NOTIFY_PAYLOAD_LIMIT = 7999
+OP_INSERT = 'insert'
+OP_UPDATE = 'update'
+OP_DELETE = 'delete'
+OP_RESET = 'reset'
+LISTENER_STARTED = 'Listening for notifications on {channel}'
+LISTENER_ERROR = 'Notification listener failed, reconnecting: {error}'
+LISTENER_RECONNECT_DELAY = 1
+# Events
+EVENTS_ROUTE = '/api/images/events'
+EVENTS_QUEUE_SIZE = 64
+EVENTS_RETRY_MS = 3000
+EVENTS_KEEPALIVE_LINE = b': keepalive\n\n'
+EVENTS_ERROR = 'Failed to build image event: {error}'
+# Jobs
+JOB_THUMBNAILS = 'thumbnails'
+UPLOAD_JOBS = (JOB_THUMBNAILS,) if EAGER_THUMBNAILS else ()
+STATUS_PENDING = 'pending'
+STATUS_READY = 'ready'
+STATUS_FAILED = 'failed'
+STATUS_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_RETRY = 'retry'
+JOBS_STARTED = 'Job queue started: {concurrency} concurrent jobs'
+JOBS_STOPPED = 'Job queue stopped'
+JOB_FAILED = 'Job {kind} of image {image_id} failed on attempt {attempt}: ' \
+             '{error}'
+JOB_POLL_ERROR = 'Failed to claim jobs: {error}'
+UNKNOWN_JOB = 'Unknown job kind: {kind}'
+# Image executor
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_PROCESS = 'process'
+EXECUTOR_STARTED = 'Image executor started: {kind}, {workers} workers'
+EXECUTOR_STOPPED = 'Image executor stopped'
+EXECUTOR_SATURATED = 'Image executor saturated: {pending} tasks pending'
+EXECUTOR_BROKEN = 'Image executor worker died, restarting the pool: {error}'
+UNKNOWN_EXECUTOR = 'Unknown image executor: {kind}'
+
+# Server
+APP_HOST = os.getenv('APP_HOST', '0.0.0.0')
+WORKERS = int(os.getenv('WORKERS', os.cpu_count() or 1))
+WORKER_STOP_TIMEOUT = float(os.getenv('WORKER_STOP_TIMEOUT', 30))
+WORKER_READY_TIMEOUT = 60
+WORKER_READY_POLL = 0.1
+WORKER_STARTED = 'Worker {index} started: pid {pid}, pool size {pool_size}'
+WORKER_EXITED = 'Worker {index} exited with code {code}, restarting'
+WORKER_NOT_READY = 'Worker {index} did not become ready in time'
+WORKER_START_FAILED = 'Worker {index} exited during startup with code {code}'
+SERVER_RESTART = 'Rolling restart of {workers} workers'
+SERVER_STOP = 'Stopping {workers} workers'
+WORKERS_CAPPED = ('{workers} workers exceed DB_CONNECTION_BUDGET={budget}, '
+                  'starting {limit}')
+SERVER_LISTENING = 'Listening on {host}:{port} with {workers} workers'
@@ -1,17 +1,61 @@
-import os
-from typing import Any, Optional
+import asyncio
+import base64
+import json
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Iterable, Optional
 
 import psycopg
 from loguru import logger
 from psycopg_pool import AsyncConnectionPool
 
 import constants
+from cache import TTLCache
 from constants import ITEMS_PER_PAGE
-from queries import (COUNT_IMAGES, CREATE_TABLE, DELETE_BY_ID, FIND_BY_ID,
-                     GET_IMAGES, INSERT_IMAGE)
+from derivatives import bucket_width
+from log_config import log_request
+from metrics import DB_CHECKOUT_SECONDS
+from queries import (ADD_VARIANT, CLAIM_JOBS, COMPLETE_JOB, COUNT_IMAGES,
+                     CREATE_TABLE, DELETE_BY_IDS, DELETE_BY_TIME_RANGE,
+                     ENQUEUE_JOBS, ESTIMATE_IMAGES, EVICT_VARIANTS,
+                     EXPORT_IMAGES, FAIL_JOB, FIND_BY_CONTENT_HASH,
+                     FIND_BY_ID, FIND_FILENAMES, GET_FILENAMES, GET_IMAGES,
+                     GET_IMAGES_AFTER,
+                     GET_IMAGES_BY_IDS, GET_PHASH, GET_PHASHES,
+                     GET_PHASHES_BY_IDS, GET_UNDESCRIBED, INSERT_IMAGE,
+                     NOTIFY, PURGE_BY_IDS, UPDATE_METADATA)
 
-log_file = os.path.join('logs', constants.LOG_FILE)
-logger.add(log_file, format=constants.LOG_FORMAT, level=constants.LOG_LEVEL)
+
+def encode_cursor(upload_time: datetime, image_id: int) -> str:
+    """Encode a keyset position into an opaque cursor.
+
+    Args:
+        upload_time: Upload time of the last image on the page.
+        image_id: ID of the last image on the page.
+    Returns:
+        str: URL-safe cursor string.
+    """
+    raw = json.dumps([upload_time.isoformat(), image_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Decode a cursor produced by encode_cursor.
+
+    Args:
+        cursor: Cursor string.
+    Returns:
+        tuple: (upload_time, image_id).
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        upload_time, image_id = json.loads(raw)
+        return datetime.fromisoformat(upload_time), int(image_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(constants.INVALID_CURSOR.format(cursor=cursor)) from e
 
 
 class Database:
@@ -33,6 +77,11 @@ class Database:
         """Initialize the database instance."""
         if not self._initialized:
             self.pool: Optional[AsyncConnectionPool] = None
+            self.images_cache = TTLCache(constants.IMAGES_CACHE_SIZE,
+                                         constants.IMAGES_CACHE_TTL)
+            self._listener: Optional[asyncio.Task] = None
+            self._subscribers: list[Callable[[dict[str, Any]], None]] = []
+            self._schema_ready = False
             self._initialized: bool = True
 
     async def connect(self, dsn: str = constants.DATABASE_URL) -> None:
@@ -48,8 +97,11 @@ class Database:
         try:
             self.pool = AsyncConnectionPool(
                 conninfo=dsn,
-                min_size=constants.DB_POOL_MIN_SIZE,
+                min_size=min(constants.DB_POOL_MIN_SIZE,
+                             constants.DB_POOL_MAX_SIZE),
                 max_size=constants.DB_POOL_MAX_SIZE,
+                kwargs={'prepare_threshold': constants.DB_PREPARE_THRESHOLD},
+                configure=self._configure,
                 open=False
             )
             await self.pool.open()
@@ -62,19 +114,283 @@ class Database:
     async def disconnect(self) -> None:
         """Close all connections in the pool.
 
+        Connections still in use are waited for up to
+        DB_POOL_CLOSE_TIMEOUT seconds.
+
         Raises:
             ConnectionError: If disconnection fails.
         """
         if self.pool is None:
             return
         try:
-            await self.pool.close()
+            await self.pool.close(timeout=constants.DB_POOL_CLOSE_TIMEOUT)
             self.pool = None
             logger.success(constants.DB_POOL_CLOSE_SUCCESS)
         except psycopg.OperationalError as e:
             logger.error(constants.DISCONNECT_FAILED)
             raise ConnectionError(constants.DISCONNECT_FAILED) from e
 
+    async def _configure(self, conn: psycopg.AsyncConnection) -> None:
+        """Prepare the hot read statements on a new pooled connection.
+
+        Skipped until init_db has created the schema.
+
+        Args:
+            conn: The new connection.
+        """
+        if self._schema_ready:
+            await self._prepare_statements(conn)
+
+    @staticmethod
+    async def _prepare_statements(conn: psycopg.AsyncConnection) -> None:
+        """Run the cheap gallery queries once so they are planned and
+        prepared.
+
+        Parameters match the first gallery page, so the prepared statements
+        are reused by real requests. The exact count is left out: it scans
+        the whole table, which would slow down every new connection.
+
+        Args:
+            conn: Connection to prepare the statements on.
+        """
+        await conn.execute(GET_IMAGES, (ITEMS_PER_PAGE + 1, 0), prepare=True)
+        await conn.execute(ESTIMATE_IMAGES, prepare=True)
+        await conn.commit()
+
+    async def warm_up(self) -> None:
+        """Prepare statements on every connection opened at startup.
+
+        The connections are checked out concurrently so each one of the
+        pool minimum is warmed, not the same connection repeatedly.
+
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If a statement cannot be prepared.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+
+        async def warm() -> None:
+            async with self.pool.connection() as conn:
+                await self._prepare_statements(conn)
+
+        try:
+            await asyncio.gather(*(warm() for _ in
+                                   range(self.pool.min_size)))
+        except psycopg.Error as e:
+            logger.error(constants.ERROR_DB_OPERATION.format(error=e))
+            raise RuntimeError(
+                constants.ERROR_DB_OPERATION.format(error=e)) from e
+        logger.info(constants.DB_POOL_WARMED.format(
+            connections=self.pool.min_size))
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[psycopg.AsyncConnection]:
+        """Check out a pooled connection, recording the wait time.
+
+        Yields:
+            psycopg.AsyncConnection: Connection inside a transaction that
+            is committed on exit.
+        """
+        started = time.perf_counter()
+        async with self.pool.connection() as conn:
+            DB_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+            yield conn
+
+    def pool_stats(self) -> list[tuple[str, str, float]]:
+        """Return connection pool statistics as metric samples.
+
+        Returns:
+            list: (name, documentation, value) tuples, empty if not
+            connected.
+        """
+        if self.pool is None:
+            return []
+        return [(f'db_{name}', constants.POOL_STAT_HELP.format(stat=name),
+                 value) for name, value in self.pool.get_stats().items()]
+
+    def start_listener(self, dsn: str = constants.DATABASE_URL) -> None:
+        """Start listening for image changes made by other workers.
+
+        Args:
+            dsn: Database connection string. Defaults from constants.
+        """
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen(dsn))
+
+    async def stop_listener(self) -> None:
+        """Stop the notification listener."""
+        if self._listener is None:
+            return
+        self._listener.cancel()
+        try:
+            await self._listener
+        except asyncio.CancelledError:
+            pass
+        self._listener = None
+
+    async def _listen(self, dsn: str) -> None:
+        """Invalidate caches and pass every notification to subscribers,
+        reconnecting on errors.
+
+        Notifications sent while disconnected are lost, so subscribers get
+        a reset change on every (re)connect.
+
+        Args:
+            dsn: Database connection string.
+        """
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                        dsn, autocommit=True) as conn:
+                    await conn.execute(f'LISTEN {constants.IMAGES_CHANNEL}')
+                    self.images_cache.clear()
+                    self._publish({'op': constants.OP_RESET, 'id': None})
+                    logger.info(constants.LISTENER_STARTED.format(
+                        channel=constants.IMAGES_CHANNEL))
+                    async for notify in conn.notifies():
+                        self.images_cache.clear()
+                        try:
+                            change = json.loads(notify.payload)
+                        except ValueError:
+                            change = {'op': constants.OP_RESET, 'id': None}
+                        self._publish(change)
+            except psycopg.Error as e:
+                logger.error(constants.LISTENER_ERROR.format(error=e))
+                await asyncio.sleep(constants.LISTENER_RECONNECT_DELAY)
+
+    def subscribe(self, callback: Callable[[dict[str, Any]], None]) -> None:
+        """Receive image changes seen by the notification listener.
+
+        Args:
+            callback: Called with every change, {'op': 'insert', 'update',
+                'delete' or 'reset', 'id': ID, list of IDs or None if
+                unknown}. It runs in the listener task and must not block.
+        """
+        self._subscribers.append(callback)
+
+    def _publish(self, change: dict[str, Any]) -> None:
+        """Pass a change to all subscribers."""
+        for callback in self._subscribers:
+            callback(change)
+
+    @staticmethod
+    async def _notify(conn: psycopg.AsyncConnection, op: str,
+                      image_id: Any) -> None:
+        """Queue an image change notification in the current transaction.
+
+        Payloads over the NOTIFY size limit are sent without IDs.
+
+        Args:
+            conn: Connection holding the transaction.
+            op: 'insert', 'update' or 'delete'.
+            image_id: ID or list of IDs of the changed images.
+        """
+        payload = json.dumps({'op': op, 'id': image_id})
+        if len(payload) > constants.NOTIFY_PAYLOAD_LIMIT:
+            payload = json.dumps({'op': op, 'id': None})
+        await conn.execute(NOTIFY, (constants.IMAGES_CHANNEL, payload))
+
+    @staticmethod
+    async def _enqueue_jobs(conn: psycopg.AsyncConnection,
+                            image_ids: list[int], jobs: Iterable[str]) -> None:
+        """Enqueue background jobs in the current transaction.
+
+        Args:
+            conn: Connection holding the transaction.
+            image_ids: IDs of the images to process.
+            jobs: Kinds of jobs to run on every image.
+        """
+        jobs = list(jobs)
+        if image_ids and jobs:
+            await conn.execute(ENQUEUE_JOBS, (image_ids, jobs))
+
+    async def claim_jobs(self, limit: int,
+                         lease: float = constants.JOB_LEASE
+                         ) -> list[tuple[int, str, int, int, str]]:
+        """Claim due jobs that no other worker holds.
+
+        A claimed job becomes due again after the lease, so jobs of a
+        crashed worker are picked up by others.
+
+        Args:
+            limit: Maximum number of jobs.
+            lease: Seconds the jobs are reserved for this worker.
+        Returns:
+            list: (job_id, kind, attempt, image_id, filename) tuples.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If the jobs cannot be claimed.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+
+        try:
+            async with self.connection() as conn:
+                result = await conn.execute(CLAIM_JOBS, (lease, limit))
+                return await result.fetchall()
+        except psycopg.Error as e:
+            raise RuntimeError(
+                constants.ERROR_DB_OPERATION.format(error=e)) from e
+
+    async def complete_job(self, job_id: int) -> None:
+        """Remove a finished job, marking its image ready when it was the
+        last one.
+
+        Args:
+            job_id: ID of the job.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If the job cannot be updated.
+        """
+        await self._finish_job(COMPLETE_JOB, {'id': job_id})
+
+    async def fail_job(self, job_id: int, error: str, delay: float,
+                       max_attempts: int = constants.JOB_MAX_ATTEMPTS
+                       ) -> None:
+        """Schedule a retry of a failed job or give up on it.
+
+        The image is marked failed once the job runs out of attempts.
+
+        Args:
+            job_id: ID of the job.
+            error: Error message stored with the job.
+            delay: Seconds before the retry.
+            max_attempts: Attempts after which the job fails for good.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If the job cannot be updated.
+        """
+        await self._finish_job(FAIL_JOB, {'id': job_id, 'error': error,
+                                          'delay': delay,
+                                          'max_attempts': max_attempts})
+
+    async def _finish_job(self, query: str, params: dict[str, Any]) -> None:
+        """Run a job update and drop cached listings that show its status,
+        notifying other workers when the image status changed.
+
+        Args:
+            query: COMPLETE_JOB or FAIL_JOB.
+            params: Query parameters.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If the job cannot be updated.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+
+        try:
+            async with self.connection() as conn:
+                result = await conn.execute(query, params)
+                row = await result.fetchone()
+                if row is not None:
+                    await self._notify(conn, constants.OP_UPDATE, row[0])
+            self.images_cache.clear()
+        except psycopg.Error as e:
+            logger.error(constants.ERROR_DB_OPERATION.format(error=e))
+            raise RuntimeError(
+                constants.ERROR_DB_OPERATION.format(error=e)) from e
+
     async def init_db(self) -> None:
         """Initialize database tables.
 
@@ -86,9 +402,11 @@ class Database:
             raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
 
         try:
-            async with self.pool.connection() as conn:
-                await conn.execute(CREATE_TABLE)
+            async with self.connection() as conn:
+                # Several statements cannot be sent as a prepared one.
+                await conn.execute(CREATE_TABLE, prepare=False)
                 logger.success(constants.CREATE_TABLE_SUCCESS)
+            self._schema_ready = True
         except psycopg.Error as e:
             logger.error(f'{constants.CREATE_TABLE_ERROR}: {e}')
             raise RuntimeError(constants.CREATE_TABLE_ERROR) from e
@@ -98,17 +416,35 @@ class Database:
             filename: str,
             original_name: str,
             size: int,
-            file_type: str
+            file_type: str,
+            content_hash: Optional[str] = None,
+            width: Optional[int] = None,
+            height: Optional[int] = None,
+            orientation: Optional[int] = None,
+            placeholder: Optional[str] = None,
+            phash: Optional[int] = None,
+            jobs: Iterable[str] = ()
     ) -> int:
         """Insert image metadata into database.
 
+        If a record with the same content hash exists, its reference count
+        is incremented instead. Jobs for a new record are enqueued in the
+        same transaction.
+
         Args:
             filename: Generated unique filename.
             original_name: Original filename from user.
             size: File size in bytes.
             file_type: File extension/type.
+            content_hash: Content hash for content-addressed storage.
+            width: Displayed width in pixels.
+            height: Displayed height in pixels.
+            orientation: EXIF orientation of the stored file.
+            placeholder: Placeholder data URI.
+            phash: 64-bit perceptual hash as a signed integer.
+            jobs: Kinds of background jobs to run on the new image.
         Returns:
-            int: The ID of the inserted image record.
+            int: The ID of the inserted or referenced image record.
         Raises:
             RuntimeError: If database connection is not established.
             RuntimeError: If image insertion fails.
@@ -117,16 +453,68 @@ class Database:
             raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
 
         try:
-            async with self.pool.connection() as conn:
+            async with self.connection() as conn:
                 result = await conn.execute(
                     INSERT_IMAGE,
-                    (filename, original_name, size, file_type)
+                    (filename, original_name, size, file_type, content_hash,
+                     width, height, orientation, placeholder, phash)
                 )
-                row = await result.fetchone()
-                image_id = row[0]
-                logger.info(
-                    constants.IMG_INSERT_SUCCESS.format(image_id=image_id))
-                return image_id
+                image_id, inserted = await result.fetchone()
+                if inserted:
+                    await self._enqueue_jobs(conn, [image_id], jobs)
+                    await self._notify(conn, constants.OP_INSERT, image_id)
+            self.images_cache.clear()
+            log_request(
+                constants.IMG_INSERT_SUCCESS.format(image_id=image_id))
+            return image_id
+        except psycopg.Error as e:
+            logger.error(constants.IMG_INSERT_FAILED.format(error=e))
+            raise RuntimeError(constants.IMG_INSERT_FAILED) from e
+
+    async def insert_images(
+            self,
+            rows: list[tuple],
+            jobs: Iterable[str] = ()
+    ) -> list[int]:
+        """Insert metadata of many images in a single batch.
+
+        Args:
+            rows: Tuples of (filename, original_name, size, file_type,
+                content_hash, width, height, orientation, placeholder,
+                phash) as accepted by insert_image.
+            jobs: Kinds of background jobs to run on each new image.
+        Returns:
+            list: IDs of the inserted or referenced records, in row order.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image insertion fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+        if not rows:
+            return []
+
+        try:
+            async with self.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.executemany(INSERT_IMAGE, rows, returning=True)
+                    image_ids = []
+                    inserted_ids = []
+                    while True:
+                        image_id, inserted = await cur.fetchone()
+                        image_ids.append(image_id)
+                        if inserted:
+                            inserted_ids.append(image_id)
+                        if not cur.nextset():
+                            break
+                await self._enqueue_jobs(conn, inserted_ids, jobs)
+                if inserted_ids:
+                    await self._notify(conn, constants.OP_INSERT,
+                                       inserted_ids)
+            self.images_cache.clear()
+            logger.info(
+                constants.IMG_INSERT_SUCCESS.format(image_id=image_ids))
+            return image_ids
         except psycopg.Error as e:
             logger.error(constants.IMG_INSERT_FAILED.format(error=e))
             raise RuntimeError(constants.IMG_INSERT_FAILED) from e
@@ -134,61 +522,486 @@ class Database:
     async def get_images(
             self,
             page: int = 1,
+            cursor: Optional[str] = None,
+            count: str = constants.COUNT_EXACT,
+            per_page: int = ITEMS_PER_PAGE,
     ) -> dict[str, Any]:
         """Get paginated list of images from database.
 
+        With a cursor the page is fetched by keyset on (upload_time, id),
+        otherwise by page number.
+
         Args:
-            page: Page number to retrieve (1-based).
+            page: Page number to retrieve (1-based), ignored with a cursor.
+            cursor: Opaque cursor from a previous next_cursor.
+            count: 'exact', 'approx' (from pg_class statistics) or 'none'.
+            per_page: Items per page.
 
         Returns:
             dict: Dictionary containing:
                 - images: List of image records
-                - total: Total number of images
-                - page: Current page number
+                - total: Total number of images or None
+                - page: Current page number or None with a cursor
                 - per_page: Items per page
-                - total_pages: Total number of pages
+                - total_pages: Total number of pages or None
+                - next_cursor: Cursor of the next page or None
+
+            Each image record includes a thumbnail_url.
 
         Raises:
+            ValueError: If the cursor is malformed.
             RuntimeError: If database connection is not established.
             RuntimeError: If image retrieval fails.
         """
         if self.pool is None:
             raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
 
-        offset: int = (page - 1) * ITEMS_PER_PAGE
+        cache_key = (page, cursor, count, per_page)
+        cached = self.images_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        generation = self.images_cache.invalidations
+
+        if cursor:
+            upload_time, last_id = decode_cursor(cursor)
+            query = GET_IMAGES_AFTER
+            params = (upload_time, last_id, per_page + 1)
+            page = None
+        else:
+            query = GET_IMAGES
+            params = (per_page + 1, (page - 1) * per_page)
         try:
-            async with self.pool.connection() as conn:
+            async with self.connection() as conn:
                 async with conn.cursor() as images_cur:
-                    await images_cur.execute(GET_IMAGES,
-                                             (ITEMS_PER_PAGE, offset))
+                    await images_cur.execute(query, params)
                     columns = [desc[0] for desc in images_cur.description]
                     images = [dict(zip(columns, row)) for row in
                               await images_cur.fetchall()]
 
-                async with conn.cursor() as count_cur:
-                    await count_cur.execute(COUNT_IMAGES)
-                    result = await count_cur.fetchone()
-                    total = result[0] if result else 0
+                next_cursor = None
+                if len(images) > per_page:
+                    images = images[:per_page]
+                    next_cursor = encode_cursor(
+                        images[-1][constants.UPLOAD_TIME], images[-1]['id'])
+                thumbnail_width = bucket_width(None)
+                for image in images:
+                    del image[constants.UPLOAD_TIME]
+                    image[constants.THUMBNAIL_URL_KEY] = (
+                        constants.THUMBNAIL_URL.format(
+                            id=image['id'], width=thumbnail_width))
+
+                total = None
+                if count == constants.COUNT_APPROX:
+                    total = await self._fetch_count(conn, ESTIMATE_IMAGES)
+                if count == constants.COUNT_EXACT or (total is not None
+                                                      and total < 0):
+                    total = await self._fetch_count(conn, COUNT_IMAGES)
 
-                return {
+                images_data = {
                     constants.IMAGES: images,
                     constants.TOTAL_IMAGES: total,
                     constants.PAGE: page,
-                    constants.PER_PAGE: ITEMS_PER_PAGE,
-                    constants.TOTAL_PAGES: (total + ITEMS_PER_PAGE - 1
-                                            ) // ITEMS_PER_PAGE
+                    constants.PER_PAGE: per_page,
+                    constants.TOTAL_PAGES: (
+                        None if total is None
+                        else (total + per_page - 1) // per_page),
+                    constants.NEXT_CURSOR: next_cursor,
                 }
+                self.images_cache.set(cache_key, images_data, generation)
+                return images_data
         except psycopg.Error as e:
             logger.error(constants.FAIL_TO_FETCH_IMG.format(error=e))
             raise RuntimeError(constants.FAIL_TO_FETCH_IMG) from e
 
-    async def delete_image(self, image_id: str) -> tuple[bool, Optional[str]]:
+    @staticmethod
+    async def _fetch_count(conn: psycopg.AsyncConnection, query: str) -> int:
+        """Run a single-value count query.
+
+        Args:
+            conn: Connection to run the query on.
+            query: COUNT_IMAGES or ESTIMATE_IMAGES.
+        Returns:
+            int: The count, or 0 if nothing was returned.
+        """
+        async with conn.cursor() as count_cur:
+            await count_cur.execute(query)
+            result = await count_cur.fetchone()
+            return result[0] if result else 0
+
+    async def get_filename(self, image_id: int) -> Optional[str]:
+        """Get the stored filename of an image.
+
+        Args:
+            image_id: ID of the image.
+        Returns:
+            Optional[str]: The filename or None if image not found.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image retrieval fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+
+        try:
+            async with self.connection() as conn:
+                result = await conn.execute(FIND_BY_ID, (image_id,))
+                row = await result.fetchone()
+                return row[0] if row else None
+        except psycopg.Error as e:
+            logger.error(constants.FAIL_TO_FETCH_IMG.format(error=e))
+            raise RuntimeError(constants.FAIL_TO_FETCH_IMG) from e
+
+    async def get_images_by_ids(
+            self, image_ids: list[int]) -> dict[int, dict[str, Any]]:
+        """Get image records by IDs, in the format of get_images.
+
+        Args:
+            image_ids: IDs of the images.
+        Returns:
+            dict: Image records by ID; missing images are left out.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image retrieval fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+        if not image_ids:
+            return {}
+
+        try:
+            async with self.connection() as conn:
+                async with conn.cursor() as images_cur:
+                    await images_cur.execute(GET_IMAGES_BY_IDS, (image_ids,))
+                    columns = [desc[0] for desc in images_cur.description]
+                    images = [dict(zip(columns, row)) for row in
+                              await images_cur.fetchall()]
+        except psycopg.Error as e:
+            logger.error(constants.FAIL_TO_FETCH_IMG.format(error=e))
+            raise RuntimeError(constants.FAIL_TO_FETCH_IMG) from e
+        thumbnail_width = bucket_width(None)
+        for image in images:
+            del image[constants.UPLOAD_TIME]
+            image[constants.THUMBNAIL_URL_KEY] = (
+                constants.THUMBNAIL_URL.format(id=image['id'],
+                                               width=thumbnail_width))
+        return {image['id']: image for image in images}
+
+    async def export_images(
+            self,
+            since: Optional[datetime] = None,
+            batch_size: int = constants.EXPORT_BATCH_SIZE
+    ) -> AsyncIterator[dict[str, Any]]:
+        """Stream all image records through a server-side cursor.
+
+        Rows are fetched batch_size at a time, so memory use does not grow
+        with the number of images. The connection stays checked out until
+        the iteration ends or the generator is closed.
+
+        Args:
+            since: Export only images uploaded at or after this time.
+            batch_size: Rows fetched from the cursor at once.
+        Yields:
+            dict: Image record with every stored column, ordered by ID.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image retrieval fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+
+        try:
+            async with self.connection() as conn:
+                async with conn.cursor(name=constants.EXPORT_CURSOR) as cur:
+                    cur.itersize = batch_size
+                    await cur.execute(EXPORT_IMAGES, (since,))
+                    columns = [desc[0] for desc in cur.description]
+                    async for row in cur:
+                        yield dict(zip(columns, row))
+        except psycopg.Error as e:
+            logger.error(constants.FAIL_TO_FETCH_IMG.format(error=e))
+            raise RuntimeError(constants.FAIL_TO_FETCH_IMG) from e
+
+    async def get_phash(self, image_id: int) -> tuple[bool, Optional[int]]:
+        """Get the perceptual hash of an image.
+
+        Args:
+            image_id: ID of the image.
+        Returns:
+            tuple: (found, phash). phash is None for images not hashed yet.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image retrieval fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+
+        try:
+            async with self.connection() as conn:
+                result = await conn.execute(GET_PHASH, (image_id,))
+                row = await result.fetchone()
+                return (True, row[0]) if row else (False, None)
+        except psycopg.Error as e:
+            logger.error(constants.FAIL_TO_FETCH_IMG.format(error=e))
+            raise RuntimeError(constants.FAIL_TO_FETCH_IMG) from e
+
+    async def find_by_content_hash(self, content_hash: str) -> Optional[int]:
+        """Get the ID of the image stored with a content hash.
+
+        Args:
+            content_hash: Content hash of the file.
+        Returns:
+            Optional[int]: The image ID or None if no image has the hash.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image retrieval fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+
+        try:
+            async with self.connection() as conn:
+                result = await conn.execute(FIND_BY_CONTENT_HASH,
+                                            (content_hash,))
+                row = await result.fetchone()
+                return row[0] if row else None
+        except psycopg.Error as e:
+            logger.error(constants.FAIL_TO_FETCH_IMG.format(error=e))
+            raise RuntimeError(constants.FAIL_TO_FETCH_IMG) from e
+
+    async def get_phashes(self, after_id: int,
+                          limit: int) -> list[tuple[int, int]]:
+        """Get perceptual hashes of images, in batches by ID.
+
+        Args:
+            after_id: Return only images with a greater ID.
+            limit: Maximum number of hashes.
+        Returns:
+            list: (id, phash) tuples ordered by ID.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image retrieval fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+
+        try:
+            async with self.connection() as conn:
+                result = await conn.execute(GET_PHASHES, (after_id, limit))
+                return await result.fetchall()
+        except psycopg.Error as e:
+            logger.error(constants.FAIL_TO_FETCH_IMG.format(error=e))
+            raise RuntimeError(constants.FAIL_TO_FETCH_IMG) from e
+
+    async def get_phashes_by_ids(
+            self, image_ids: list[int]) -> list[tuple[int, int]]:
+        """Get perceptual hashes of the given images.
+
+        Args:
+            image_ids: IDs of the images.
+        Returns:
+            list: (id, phash) tuples of the images that have a hash.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image retrieval fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+        if not image_ids:
+            return []
+
+        try:
+            async with self.connection() as conn:
+                result = await conn.execute(GET_PHASHES_BY_IDS, (image_ids,))
+                return await result.fetchall()
+        except psycopg.Error as e:
+            logger.error(constants.FAIL_TO_FETCH_IMG.format(error=e))
+            raise RuntimeError(constants.FAIL_TO_FETCH_IMG) from e
+
+    async def get_filenames(self, after: str,
+                            limit: int) -> list[tuple[int, str]]:
+        """Get filenames in byte order, in batches.
+
+        Args:
+            after: Return only filenames sorting after this one.
+            limit: Maximum number of rows.
+        Returns:
+            list: (id, filename) tuples ordered by filename.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image retrieval fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+
+        try:
+            async with self.connection() as conn:
+                result = await conn.execute(GET_FILENAMES, (after, limit))
+                return await result.fetchall()
+        except psycopg.Error as e:
+            logger.error(constants.FAIL_TO_FETCH_IMG.format(error=e))
+            raise RuntimeError(constants.FAIL_TO_FETCH_IMG) from e
+
+    async def find_filenames(self, filenames: list[str]) -> set[str]:
+        """Get which of the given filenames have rows.
+
+        Args:
+            filenames: Filenames to look up.
+        Returns:
+            set: The filenames found.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image retrieval fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+        if not filenames:
+            return set()
+
+        try:
+            async with self.connection() as conn:
+                result = await conn.execute(FIND_FILENAMES, (filenames,))
+                return {row[0] for row in await result.fetchall()}
+        except psycopg.Error as e:
+            logger.error(constants.FAIL_TO_FETCH_IMG.format(error=e))
+            raise RuntimeError(constants.FAIL_TO_FETCH_IMG) from e
+
+    async def get_undescribed(self, after_id: int,
+                              limit: int) -> list[tuple[int, str]]:
+        """Get images stored before dimensions or hashes were recorded.
+
+        Args:
+            after_id: Return only images with a greater ID.
+            limit: Maximum number of images.
+        Returns:
+            list: (id, filename) tuples ordered by ID.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image retrieval fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+
+        try:
+            async with self.connection() as conn:
+                result = await conn.execute(GET_UNDESCRIBED,
+                                            (after_id, limit))
+                return await result.fetchall()
+        except psycopg.Error as e:
+            logger.error(constants.FAIL_TO_FETCH_IMG.format(error=e))
+            raise RuntimeError(constants.FAIL_TO_FETCH_IMG) from e
+
+    async def update_metadata(
+            self,
+            rows: list[tuple[int, int, int, str, int, int]]
+    ) -> None:
+        """Store dimensions, orientation, placeholders and perceptual hashes
+        of images.
+
+        Args:
+            rows: Tuples of (width, height, orientation, placeholder, phash,
+                id).
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If the update fails.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+        if not rows:
+            return
+
+        try:
+            async with self.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.executemany(UPDATE_METADATA, rows)
+                await self._notify(conn, constants.OP_UPDATE,
+                                   [row[-1] for row in rows])
+            self.images_cache.clear()
+        except psycopg.Error as e:
+            logger.error(constants.ERROR_DB_OPERATION.format(error=e))
+            raise RuntimeError(
+                constants.ERROR_DB_OPERATION.format(error=e)) from e
+
+    async def add_variant(
+            self,
+            filename: str,
+            image_format: str,
+            size: int,
+            max_bytes: int = constants.VARIANT_CACHE_MAX_BYTES
+    ) -> tuple[bool, list[tuple[str, str]]]:
+        """Record a transcoded variant and evict the oldest ones over budget.
+
+        Args:
+            filename: Name of the original image.
+            image_format: Variant format.
+            size: Variant size in bytes.
+            max_bytes: Total size of variants to keep.
+        Returns:
+            tuple: (tracked, evicted). tracked is False if the image is not
+            in the database; evicted lists (filename, format) of variants
+            whose files should be removed.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If the variant cannot be recorded.
+        """
+        if self.pool is None:
+            raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
+
+        try:
+            async with self.connection() as conn:
+                result = await conn.execute(ADD_VARIANT,
+                                            (image_format, size, filename))
+                tracked = await result.fetchone() is not None
+                result = await conn.execute(EVICT_VARIANTS, (max_bytes,))
+                evicted = await result.fetchall()
+            if evicted:
+                logger.info(constants.VARIANTS_EVICTED.format(
+                    count=len(evicted)))
+            return tracked, evicted
+        except psycopg.Error as e:
+            logger.error(constants.ERROR_DB_OPERATION.format(error=e))
+            raise RuntimeError(
+                constants.ERROR_DB_OPERATION.format(error=e)) from e
+
+    async def delete_image(self, image_id: int) -> tuple[bool, Optional[str]]:
         """Delete an image record from database.
 
+        A record shared by several uploads only loses one reference.
+
         Args:
             image_id: ID of the image to delete.
         Returns:
-            bool: True if success, False if image not found.
+            tuple: (success, filename). success is False if image not found,
+            filename is the file to remove, or None while the record is
+            still referenced.
+        Raises:
+            RuntimeError: If database connection is not established.
+            RuntimeError: If image deletion fails.
+        """
+        rows = await self.delete_images(image_ids=[image_id])
+        if not rows:
+            logger.warning(constants.FILE_NOT_FOUND)
+            return False, None
+        return True, rows[0][1]
+
+    async def delete_images(
+            self,
+            image_ids: Optional[list[int]] = None,
+            since: Optional[datetime] = None,
+            until: Optional[datetime] = None,
+            force: bool = False,
+    ) -> list[tuple[int, Optional[str]]]:
+        """Delete image records by IDs or by upload time range in one
+        statement.
+
+        Args:
+            image_ids: IDs of the images to delete.
+            since: Delete images uploaded at or after this time.
+            until: Delete images uploaded before this time.
+            force: Delete the records given by IDs even if other uploads
+                still reference them, e.g. because their file is gone.
+        Returns:
+            list: (id, filename) of every affected record. filename is None
+            for records that only lost a reference.
         Raises:
             RuntimeError: If database connection is not established.
             RuntimeError: If image deletion fails.
@@ -196,26 +1009,26 @@ class Database:
         if self.pool is None:
             raise RuntimeError(constants.DB_CONNECTION_NOT_ESTABLISH)
 
+        if image_ids is not None:
+            query = PURGE_BY_IDS if force else DELETE_BY_IDS
+            params = (image_ids,)
+        else:
+            query, params = DELETE_BY_TIME_RANGE, (since, until)
         try:
-            async with self.pool.connection() as conn:
+            async with self.connection() as conn:
                 async with conn.cursor() as cur:
-                    await cur.execute(
-                        FIND_BY_ID,
-                        (image_id,)
-                    )
-                    filename = await cur.fetchone()
-                    if not filename:
-                        logger.warning(constants.FILE_NOT_FOUND)
-                        return False, None
-
-                    await cur.execute(
-                        DELETE_BY_ID,
-                        (image_id,)
-                    )
-                    await cur.fetchone()
-                    logger.info(
-                        constants.IMG_DELETE_SUCCESS.format(filename=filename))
-                    return True, filename
+                    await cur.execute(query, params)
+                    rows = await cur.fetchall()
+                deleted_ids = [image_id for image_id, filename in rows
+                               if filename is not None]
+                if deleted_ids:
+                    await self._notify(conn, constants.OP_DELETE, deleted_ids)
+            if deleted_ids:
+                self.images_cache.clear()
+            log_request(constants.IMAGES_DELETED.format(
+                deleted=len(deleted_ids),
+                released=len(rows) - len(deleted_ids)))
+            return rows
         except psycopg.Error as e:
             logger.error(constants.IMG_DELETE_FAILED.format(error=e))
             raise RuntimeError(constants.IMG_DELETE_FAILED) from e
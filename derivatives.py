@@ -0,0 +1,346 @@
+import asyncio
+import base64
+import os
+from io import BytesIO
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+import aiofiles.os
+from loguru import logger
+from PIL import ExifTags, Image, ImageOps
+
+import constants
+from executor import ImageExecutor
+from log_config import log_request
+from pages import accepted_tokens
+from storage import Storage, derivative_storage, storage
+
+image_executor = ImageExecutor()
+_rendering: dict[str, asyncio.Future] = {}
+
+
+def supported_variant_formats(
+        formats: Iterable[str] = constants.VARIANT_FORMATS) -> tuple[str, ...]:
+    """Returns the configured variant formats Pillow can write.
+
+    Args:
+        formats: Formats in order of preference.
+    Returns:
+        tuple: Supported formats in the same order.
+    """
+    Image.init()
+    return tuple(image_format for image_format in formats
+                 if image_format.upper() in Image.SAVE)
+
+
+VARIANT_FORMATS = supported_variant_formats()
+
+
+def bucket_width(width: Optional[int]) -> int:
+    """Rounds a requested width up to the nearest thumbnail bucket.
+
+    Args:
+        width: Requested width in pixels or None for the default.
+    Returns:
+        int: The bucketed width.
+    """
+    if width is None:
+        width = constants.THUMBNAIL_DEFAULT_WIDTH
+    for bucket in constants.THUMBNAIL_WIDTHS:
+        if width <= bucket:
+            return bucket
+    return constants.THUMBNAIL_WIDTHS[-1]
+
+
+def thumbnail_name(filename: str, width: int) -> str:
+    """Returns the name of a thumbnail, which keeps the image prefix.
+
+    Args:
+        filename: Name of the original image.
+        width: Bucketed thumbnail width.
+    Returns:
+        str: Name of the thumbnail file.
+    """
+    stem, extension = os.path.splitext(filename)
+    return f'{stem}_w{width}{extension}'
+
+
+def thumbnail_path(filename: str, width: int,
+                   derivatives: Storage = derivative_storage) -> str:
+    """Returns the cache path of a thumbnail in the sharded layout.
+
+    Args:
+        filename: Name of the original image.
+        width: Bucketed thumbnail width.
+        derivatives: Storage of the derivatives directory.
+    Returns:
+        str: Path to the thumbnail file.
+    """
+    return derivatives.path(thumbnail_name(filename, width))
+
+
+def perceptual_hash(image: Image.Image,
+                    hash_size: int = constants.PHASH_SIZE) -> int:
+    """Computes the difference hash (dHash) of an image.
+
+    Each bit tells whether a pixel of the downscaled grayscale image is
+    brighter than its right neighbour, so resized or re-encoded copies get
+    hashes a few bits apart.
+
+    Args:
+        image: The decoded image.
+        hash_size: Side of the bit grid; 8 gives a 64-bit hash.
+    Returns:
+        int: The hash as a signed 64-bit integer, as stored in BIGINT.
+    """
+    pixels = list(image.convert('L').resize(
+        (hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(hash_size):
+            value = (value << 1) | (pixels[offset + column]
+                                    > pixels[offset + column + 1])
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def describe_image(source: str,
+                   placeholder_size: int = constants.PLACEHOLDER_SIZE,
+                   quality: int = constants.PLACEHOLDER_QUALITY
+                   ) -> tuple[int, int, int, str, int]:
+    """Reads display dimensions, orientation, a placeholder and the
+    perceptual hash of an image.
+
+    Runs inside the image executor, so it must stay a module-level function.
+    Dimensions are those of the image as displayed, after EXIF rotation.
+    The placeholder is a tiny JPEG data URI to be scaled up and blurred by
+    the client while the image loads.
+
+    Args:
+        source: Path to the image.
+        placeholder_size: Longest side of the placeholder in pixels.
+        quality: JPEG quality of the placeholder.
+    Returns:
+        tuple: (width, height, orientation, placeholder, phash).
+    Raises:
+        PIL.UnidentifiedImageError: If the file is not an image.
+        OSError: If the image data is truncated or corrupt.
+    """
+    with Image.open(source) as original:
+        width, height = original.size
+        orientation = original.getexif().get(ExifTags.Base.Orientation, 1)
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+        original.draft('RGB', (placeholder_size, placeholder_size))
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        phash = perceptual_hash(image)
+        image.thumbnail((placeholder_size, placeholder_size))
+        buffer = BytesIO()
+        image.save(buffer, format='JPEG', quality=quality)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return (width, height, orientation,
+            constants.PLACEHOLDER_PREFIX + encoded, phash)
+
+
+def render_thumbnails(source: str, targets: list[tuple[int, str]],
+                      quality: int = constants.THUMBNAIL_QUALITY) -> None:
+    """Decodes an image once and writes thumbnails of the given widths.
+
+    Runs inside the image executor, so it must stay a module-level function.
+    Each thumbnail is written to a temporary file and renamed into place,
+    creating its shard directory if needed.
+
+    Args:
+        source: Path to the original image.
+        targets: Pairs of (width, target path).
+        quality: JPEG quality of the thumbnails.
+    """
+    with Image.open(source) as original:
+        image_format = original.format
+        largest = max(width for width, _ in targets)
+        original.draft(original.mode, (largest, largest))
+        image = ImageOps.exif_transpose(original)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        for width, target in sorted(targets, reverse=True):
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.LANCZOS)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp_path = f'{target}{constants.TEMP_FILE_SUFFIX}'
+            image.save(temp_path, format=image_format, quality=quality)
+            os.replace(temp_path, target)
+
+
+def variant_path(filename: str, image_format: str) -> str:
+    """Returns the path of a transcoded variant, next to the original.
+
+    Args:
+        filename: Name of the original image.
+        image_format: Variant format, e.g. 'webp'.
+    Returns:
+        str: Path to the variant file in the sharded layout.
+    """
+    return storage.path(f'{filename}.{image_format}')
+
+
+def negotiate_format(filename: str, accept: str) -> Optional[str]:
+    """Picks the preferred variant format the client accepts.
+
+    Args:
+        filename: Name of the original image.
+        accept: Accept header of the request.
+    Returns:
+        Optional[str]: Variant format or None to serve the original.
+    """
+    extension = os.path.splitext(filename)[1].lstrip('.').lower()
+    if extension not in constants.VARIANT_SOURCE_EXTENSIONS:
+        return None
+    accepted = accepted_tokens(accept)
+    for image_format in VARIANT_FORMATS:
+        if constants.VARIANT_CONTENT_TYPES[image_format] in accepted:
+            return image_format
+    return None
+
+
+def transcode_image(source: str, target: str, image_format: str,
+                    quality: int) -> int:
+    """Writes the image in another format and returns the new size.
+
+    Runs inside the image executor, so it must stay a module-level function.
+    EXIF orientation is applied since the variant carries no EXIF.
+
+    Args:
+        source: Path to the original image.
+        target: Path to the variant.
+        image_format: Pillow format name of the variant.
+        quality: Encoder quality.
+    Returns:
+        int: Size of the variant in bytes.
+    """
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA' if 'transparency' in image.info
+                                  else 'RGB')
+        temp_path = f'{target}{constants.TEMP_FILE_SUFFIX}'
+        image.save(temp_path, format=image_format, quality=quality)
+    os.replace(temp_path, target)
+    return os.path.getsize(target)
+
+
+async def ensure_variant(
+        filename: str, image_format: str,
+        on_created: Callable[[str, str, int], Awaitable[Any]]
+        ) -> Optional[str]:
+    """Returns the path of a variant, scheduling a transcode on a miss.
+
+    The transcode runs in the background so the request can be answered
+    with the original at once; concurrent misses share one transcode.
+
+    Args:
+        filename: Name of the original image.
+        image_format: Variant format.
+        on_created: Coroutine called with (filename, format, size) once the
+            variant is written.
+    Returns:
+        Optional[str]: Path to the variant or None if it is not ready.
+    """
+    variant = await storage.locate(f'{filename}.{image_format}')
+    if await aiofiles.os.path.exists(variant):
+        return variant
+    target = variant_path(filename, image_format)
+    source = await storage.locate(filename)
+    if target in _rendering or not await aiofiles.os.path.exists(source):
+        return None
+
+    async def create() -> None:
+        quality = (constants.AVIF_QUALITY if image_format == 'avif'
+                   else constants.WEBP_QUALITY)
+        try:
+            await storage.prepare(f'{filename}.{image_format}')
+            size = await image_executor.run(
+                transcode_image, source, target, image_format.upper(),
+                quality)
+            log_request(constants.VARIANT_CREATED.format(
+                format=image_format, filename=filename, size=size))
+            await on_created(filename, image_format, size)
+        except Exception as e:
+            logger.warning(constants.VARIANT_ERROR.format(
+                format=image_format, filename=filename, error=e))
+
+    pending = asyncio.ensure_future(create())
+    _rendering[target] = pending
+    pending.add_done_callback(lambda _: _rendering.pop(target, None))
+    return None
+
+
+async def remove_variants(
+        filename: str,
+        formats: Iterable[str] = constants.VARIANT_FORMATS) -> None:
+    """Removes transcoded variants of an image.
+
+    Args:
+        filename: Name of the original image.
+        formats: Variant formats to remove.
+    """
+    for image_format in formats:
+        await storage.remove(f'{filename}.{image_format}')
+
+
+async def get_thumbnail(filename: str, width: int) -> str:
+    """Returns the path of a thumbnail, rendering it on a cache miss.
+
+    Concurrent requests for the same thumbnail share a single render.
+
+    Args:
+        filename: Name of the original image.
+        width: Bucketed thumbnail width.
+    Returns:
+        str: Path to the thumbnail file.
+    Raises:
+        FileNotFoundError: If the original image does not exist.
+        ExecutorSaturatedError: If the image executor is saturated.
+    """
+    target = thumbnail_path(filename, width)
+    if await aiofiles.os.path.exists(target):
+        return target
+    pending = _rendering.get(target)
+    if pending is None:
+        pending = asyncio.ensure_future(image_executor.run(
+            render_thumbnails, await storage.locate(filename),
+            [(width, target)]))
+        _rendering[target] = pending
+        pending.add_done_callback(lambda _: _rendering.pop(target, None))
+    await asyncio.shield(pending)
+    return target
+
+
+async def create_thumbnails(filename: str,
+                            widths: Iterable[int] = constants.THUMBNAIL_WIDTHS
+                            ) -> None:
+    """Renders all thumbnail buckets of an image ahead of requests.
+
+    Args:
+        filename: Name of the original image.
+        widths: Bucketed widths to render.
+    Raises:
+        FileNotFoundError: If the original image does not exist.
+        ExecutorSaturatedError: If the image executor is saturated.
+    """
+    targets = [(width, thumbnail_path(filename, width)) for width in widths]
+    await image_executor.run(render_thumbnails,
+                             await storage.locate(filename), targets)
+    logger.info(constants.THUMBNAIL_CREATED.format(
+        filename=filename, widths=[width for width, _ in targets]))
+
+
+async def remove_thumbnails(filename: str) -> None:
+    """Removes all cached thumbnails of an image, in either layout.
+
+    Args:
+        filename: Name of the original image.
+    """
+    for width in constants.THUMBNAIL_WIDTHS:
+        await derivative_storage.remove(thumbnail_name(filename, width))
@@ -0,0 +1,195 @@
+import asyncio
+import json
+from typing import Any, Optional
+
+from aiohttp import web
+from loguru import logger
+
+import constants
+
+
+def format_event(event: str, data: dict[str, Any]) -> bytes:
+    """Encodes one Server-Sent Event.
+
+    Args:
+        event: Event name.
+        data: Event data, sent as JSON on a single line.
+    Returns:
+        bytes: The event followed by a blank line.
+    """
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f'event: {event}\ndata: {payload}\n\n'.encode()
+
+
+RESET_EVENT = format_event(constants.OP_RESET, {})
+
+
+class ImageEvents:
+    """Fans image changes out to Server-Sent Events clients.
+
+    Changes come from the database notification listener, so every worker
+    sees changes made by all of them over the one connection it already
+    holds. Inserted and updated records are fetched once per change and
+    the encoded event is shared by all clients. A client too slow to keep up
+    has its backlog replaced with a reset event, telling it to reload.
+    """
+
+    def __init__(self, queue_size: int = constants.EVENTS_QUEUE_SIZE,
+                 max_clients: int = constants.EVENTS_MAX_CLIENTS):
+        """Initialize the fan-out without clients.
+
+        Args:
+            queue_size: Events buffered per client.
+            max_clients: Maximum number of connected clients.
+        """
+        self.queue_size = queue_size
+        self.max_clients = max_clients
+        self.db: Any = None
+        self._clients: set[asyncio.Queue] = set()
+        self._changes: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def publish(self, change: dict[str, Any]) -> None:
+        """Queue a change for delivery; used as a database subscriber.
+
+        Args:
+            change: {'op': ..., 'id': ...} as sent by Database._notify.
+        """
+        if self._clients:
+            self._changes.put_nowait(change)
+
+    def connect(self) -> Optional[asyncio.Queue]:
+        """Register a client.
+
+        Returns:
+            Optional[asyncio.Queue]: Queue of encoded events for the client,
+            or None if max_clients are connected.
+        """
+        if len(self._clients) >= self.max_clients:
+            return None
+        queue = asyncio.Queue(self.queue_size)
+        self._clients.add(queue)
+        return queue
+
+    def disconnect(self, queue: asyncio.Queue) -> None:
+        """Unregister a client.
+
+        Args:
+            queue: Queue returned by connect.
+        """
+        self._clients.discard(queue)
+
+    async def stream(self, request: web.Request,
+                     queue: asyncio.Queue) -> web.StreamResponse:
+        """Send events from a client queue until the client goes away.
+
+        A comment is sent when there is nothing to say for
+        EVENTS_KEEPALIVE seconds, so proxies keep the connection open.
+
+        Args:
+            request: Request object.
+            queue: Queue returned by connect.
+        Returns:
+            web.StreamResponse: The event stream.
+        """
+        response = web.StreamResponse(headers={
+            'Content-Type': constants.CONTENT_TYPE_EVENT_STREAM,
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        try:
+            await response.prepare(request)
+            await response.write(
+                f'retry: {constants.EVENTS_RETRY_MS}\n\n'.encode())
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), constants.EVENTS_KEEPALIVE)
+                except TimeoutError:
+                    event = constants.EVENTS_KEEPALIVE_LINE
+                if event is None:
+                    break
+                await response.write(event)
+        except ConnectionResetError:
+            pass
+        finally:
+            self.disconnect(queue)
+        return response
+
+    def _broadcast(self, event: bytes) -> None:
+        """Queue an encoded event for every client."""
+        for queue in self._clients:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESET_EVENT)
+
+    async def _event(self, change: dict[str, Any]) -> Optional[bytes]:
+        """Encode a change as an event.
+
+        Args:
+            change: {'op': ..., 'id': ...} from the listener.
+        Returns:
+            Optional[bytes]: The event, or None if there is nothing to send.
+        """
+        op = change.get('op')
+        image_ids = change.get('id')
+        if image_ids is None or op not in (constants.OP_INSERT,
+                                           constants.OP_UPDATE,
+                                           constants.OP_DELETE):
+            return RESET_EVENT
+        if not isinstance(image_ids, list):
+            image_ids = [image_ids]
+        if op == constants.OP_DELETE:
+            return format_event(op, {constants.IDS: image_ids})
+        records = await self.db.get_images_by_ids(image_ids)
+        images = [records[image_id] for image_id in dict.fromkeys(image_ids)
+                  if image_id in records]
+        if not images:
+            return None
+        return format_event(op, {constants.IMAGES: images})
+
+    async def _run(self) -> None:
+        """Turn queued changes into events, in the order they came."""
+        while True:
+            change = await self._changes.get()
+            if not self._clients:
+                continue
+            try:
+                event = await self._event(change)
+            except RuntimeError as e:
+                logger.error(constants.EVENTS_ERROR.format(error=e))
+                event = RESET_EVENT
+            if event is not None:
+                self._broadcast(event)
+
+    def start(self, db: Any) -> None:
+        """Subscribe to database changes and start delivering them.
+
+        Args:
+            db: Database providing subscribe and get_images_by_ids.
+        """
+        if self._task is None:
+            self.db = db
+            db.subscribe(self.publish)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop delivering changes and end the streams of all clients."""
+        for queue in self._clients:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
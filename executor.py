@@ -0,0 +1,138 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import (Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+import constants
+
+
+class ExecutorSaturatedError(RuntimeError):
+    """Raised when the image executor has no free slots."""
+
+
+class ExecutorBrokenError(ExecutorSaturatedError):
+    """Raised when a pool worker died; the pool is rebuilt and the task can
+    be retried."""
+
+
+class ImageExecutor:
+    """Singleton bounded executor for CPU-bound image work.
+
+    Tasks are submitted to a process pool (or a thread pool) so that Pillow
+    decoding never runs on the event loop. At most ``workers + queue_size``
+    tasks may be pending; further submissions fail fast with
+    ExecutorSaturatedError instead of queueing without bound. A process
+    pool is rebuilt when one of its workers dies, e.g. killed for memory.
+    """
+    _instance = None
+    _initialized = False
+
+    def __new__(cls):
+        """Create or return singleton instance.
+
+        Returns:
+            ImageExecutor: Singleton executor instance.
+        """
+        if not cls._instance:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        """Initialize the executor instance."""
+        if not self._initialized:
+            self.executor: Optional[Executor] = None
+            self.kind: str = constants.IMAGE_EXECUTOR
+            self.workers: int = constants.IMAGE_WORKERS
+            self.queue_size: int = constants.IMAGE_QUEUE_SIZE
+            self.capacity: int = 0
+            self.pending: int = 0
+            self._initialized: bool = True
+
+    def start(self, kind: str = constants.IMAGE_EXECUTOR,
+              workers: int = constants.IMAGE_WORKERS,
+              queue_size: int = constants.IMAGE_QUEUE_SIZE) -> None:
+        """Create the underlying executor.
+
+        Args:
+            kind: 'process' or 'thread'.
+            workers: Number of worker processes or threads.
+            queue_size: Number of tasks allowed to wait for a worker.
+        Raises:
+            ValueError: If the executor kind is unknown.
+        """
+        if self.executor is not None:
+            return
+        if kind == constants.EXECUTOR_PROCESS:
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'))
+        elif kind == constants.EXECUTOR_THREAD:
+            self.executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='image')
+        else:
+            raise ValueError(constants.UNKNOWN_EXECUTOR.format(kind=kind))
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+        self.capacity = workers + queue_size
+        logger.info(constants.EXECUTOR_STARTED.format(kind=kind,
+                                                      workers=workers))
+
+    async def shutdown(self) -> None:
+        """Stop the executor, cancelling tasks that have not started.
+
+        Running tasks are waited for in a thread, so the event loop keeps
+        serving other cleanup meanwhile.
+        """
+        if self.executor is None:
+            return
+        executor, self.executor = self.executor, None
+        await asyncio.to_thread(executor.shutdown, wait=True,
+                                cancel_futures=True)
+        logger.info(constants.EXECUTOR_STOPPED)
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a function in the executor.
+
+        Args:
+            func: Picklable module-level function.
+            *args: Positional arguments for the function.
+        Returns:
+            Any: The function result.
+        Raises:
+            ExecutorSaturatedError: If all slots are taken.
+            ExecutorBrokenError: If a pool worker died while the task was
+                pending.
+        """
+        if self.executor is None:
+            self.start()
+        if self.pending >= self.capacity:
+            logger.warning(
+                constants.EXECUTOR_SATURATED.format(pending=self.pending))
+            raise ExecutorSaturatedError(
+                constants.EXECUTOR_SATURATED.format(pending=self.pending))
+        self.pending += 1
+        executor = self.executor
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, partial(func, *args))
+        except BrokenProcessPool as e:
+            logger.error(constants.EXECUTOR_BROKEN.format(error=e))
+            self._rebuild(executor)
+            raise ExecutorBrokenError(
+                constants.EXECUTOR_BROKEN.format(error=e)) from e
+        finally:
+            self.pending -= 1
+
+    def _rebuild(self, broken: Executor) -> None:
+        """Replace a broken pool, once for all of its failed tasks."""
+        if self.executor is not broken:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        self.start(self.kind, self.workers, self.queue_size)
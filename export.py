@@ -0,0 +1,169 @@
+import json
+import tarfile
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator
+
+import aiofiles
+import aiofiles.os
+import aiofiles.tempfile
+from aiohttp import web
+from loguru import logger
+
+import constants
+from storage import storage
+
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+def _json_default(value: Any) -> str:
+    """Serializes values json does not handle, i.e. timestamps."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(type(value).__name__)
+
+
+def ndjson_line(record: dict[str, Any]) -> bytes:
+    """Encodes a record as one NDJSON line.
+
+    Args:
+        record: Image record.
+    Returns:
+        bytes: UTF-8 JSON followed by a newline.
+    """
+    return (json.dumps(record, ensure_ascii=False, default=_json_default)
+            + '\n').encode()
+
+
+async def write_ndjson(response: web.StreamResponse,
+                       records: AsyncIterator[dict[str, Any]],
+                       chunk_size: int = constants.EXPORT_CHUNK_SIZE) -> int:
+    """Writes records as NDJSON, about chunk_size bytes per write.
+
+    Each write waits for the client to drain, so a slow reader slows the
+    cursor down instead of growing the buffer.
+
+    Args:
+        response: Prepared stream response.
+        records: Image records.
+        chunk_size: Bytes buffered before a write.
+    Returns:
+        int: Number of records written.
+    """
+    buffer = bytearray()
+    count = 0
+    async for record in records:
+        buffer += ndjson_line(record)
+        count += 1
+        if len(buffer) >= chunk_size:
+            await response.write(bytes(buffer))
+            buffer.clear()
+    if buffer:
+        await response.write(bytes(buffer))
+    return count
+
+
+class TarWriter:
+    """Writes a tar archive to a stream response one member at a time.
+
+    Members are copied in chunks, so memory use does not depend on file
+    sizes or on the number of members.
+    """
+
+    def __init__(self, response: web.StreamResponse,
+                 chunk_size: int = constants.EXPORT_CHUNK_SIZE):
+        """Initialize the writer.
+
+        Args:
+            response: Prepared stream response.
+            chunk_size: Bytes read and written at once.
+        """
+        self.response = response
+        self.chunk_size = chunk_size
+
+    async def add_file(self, name: str, file_path: str) -> bool:
+        """Add a file from disk.
+
+        Args:
+            name: Member name in the archive.
+            file_path: Path to the file.
+        Returns:
+            bool: False if the file does not exist.
+        """
+        try:
+            stat = await aiofiles.os.stat(file_path)
+            f = await aiofiles.open(file_path, 'rb')
+        except FileNotFoundError:
+            return False
+        try:
+            await self.add_stream(name, f, stat.st_size, stat.st_mtime)
+        finally:
+            await f.close()
+        return True
+
+    async def add_stream(self, name: str, f: Any, size: int,
+                         mtime: float) -> None:
+        """Add size bytes read from an open async file.
+
+        A file that shrinks while it is copied is padded with zeros, so the
+        archive stays well-formed.
+
+        Args:
+            name: Member name in the archive.
+            f: File opened with aiofiles in binary mode.
+            size: Number of bytes to copy.
+            mtime: Modification time of the member.
+        """
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        await self.response.write(info.tobuf(format=tarfile.PAX_FORMAT))
+        remaining = size
+        while remaining:
+            chunk = await f.read(min(self.chunk_size, remaining))
+            if not chunk:
+                chunk = bytes(min(self.chunk_size, remaining))
+            await self.response.write(chunk)
+            remaining -= len(chunk)
+        padding = -size % TAR_BLOCK_SIZE
+        if padding:
+            await self.response.write(bytes(padding))
+
+    async def close(self) -> None:
+        """Write the end-of-archive marker."""
+        await self.response.write(bytes(2 * TAR_BLOCK_SIZE))
+
+
+async def write_snapshot(response: web.StreamResponse,
+                         records: AsyncIterator[dict[str, Any]]) -> int:
+    """Writes a tar archive of image files followed by their metadata.
+
+    Files are stored under images/ by their public names. Metadata is
+    spooled to a temporary file while the images are written and added at
+    the end as images.ndjson, since a tar member needs its size up front.
+
+    Args:
+        response: Prepared stream response.
+        records: Image records.
+    Returns:
+        int: Number of records written.
+    """
+    tar = TarWriter(response)
+    count = 0
+    async with aiofiles.tempfile.TemporaryFile('w+b') as metadata:
+        async for record in records:
+            await metadata.write(ndjson_line(record))
+            count += 1
+            filename = record['filename']
+            if not await tar.add_file(
+                    f'{constants.IMAGES_DIR}/{filename}',
+                    await storage.locate(filename)):
+                logger.warning(constants.EXPORT_FILE_MISSING.format(
+                    filename=filename))
+        size = await metadata.tell()
+        await metadata.seek(0)
+        await tar.add_stream(constants.EXPORT_METADATA_NAME, metadata, size,
+                             time.time())
+    await tar.close()
+    return count
@@ -0,0 +1,140 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from loguru import logger
+
+import constants
+from metrics import JOB_SECONDS, JOBS_TOTAL
+
+JobHandler = Callable[[str], Awaitable[Any]]
+
+
+class JobQueue:
+    """Runs background jobs stored in the jobs table.
+
+    Jobs are claimed with FOR UPDATE SKIP LOCKED, so any number of worker
+    processes can share the table. At most ``concurrency`` jobs run at
+    once in this process; failed jobs are retried with exponential backoff.
+    """
+
+    def __init__(self, concurrency: int = constants.JOB_CONCURRENCY,
+                 poll_interval: float = constants.JOB_POLL_INTERVAL):
+        """Initialize the queue.
+
+        Args:
+            concurrency: Maximum number of jobs running at once.
+            poll_interval: Seconds between polls when idle.
+        """
+        self.db: Any = None
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.handlers: dict[str, JobHandler] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._running: set[asyncio.Task] = set()
+        self._poller: Optional[asyncio.Task] = None
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        """Register the coroutine that runs jobs of a kind.
+
+        Args:
+            kind: Job kind as stored in the jobs table.
+            handler: Coroutine taking the image filename.
+        """
+        self.handlers[kind] = handler
+
+    def start(self, db: Any) -> None:
+        """Start polling for jobs.
+
+        Args:
+            db: Database providing claim_jobs, complete_job and fail_job.
+        """
+        if self._poller is None:
+            self.db = db
+            self._poller = asyncio.create_task(self._poll())
+            logger.info(constants.JOBS_STARTED.format(
+                concurrency=self.concurrency))
+
+    async def stop(self) -> None:
+        """Stop polling and cancel running jobs.
+
+        Cancelled jobs stay claimed and are retried once their lease ends.
+        """
+        if self._poller is None:
+            return
+        self._poller.cancel()
+        for task in self._running:
+            task.cancel()
+        await asyncio.gather(self._poller, *self._running,
+                             return_exceptions=True)
+        self._poller = None
+        logger.info(constants.JOBS_STOPPED)
+
+    def wake(self) -> None:
+        """Poll immediately, e.g. right after jobs were enqueued."""
+        self._wakeup.set()
+
+    async def _poll(self) -> None:
+        """Claim jobs whenever a slot is free."""
+        while True:
+            await self._semaphore.acquire()
+            free = 1
+            while not self._semaphore.locked():
+                await self._semaphore.acquire()
+                free += 1
+            self._wakeup.clear()
+            try:
+                jobs = await self.db.claim_jobs(free)
+            except RuntimeError as e:
+                logger.error(constants.JOB_POLL_ERROR.format(error=e))
+                jobs = []
+            for job in jobs:
+                task = asyncio.create_task(self._run(*job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            for _ in range(free - len(jobs)):
+                self._semaphore.release()
+            if len(jobs) < free:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(),
+                                           self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _run(self, job_id: int, kind: str, attempt: int,
+                   image_id: int, filename: str) -> None:
+        """Run one claimed job and record its outcome.
+
+        Args:
+            job_id: ID of the job.
+            kind: Job kind.
+            attempt: Number of this attempt, starting at 1.
+            image_id: ID of the image.
+            filename: Name of the image file.
+        """
+        try:
+            handler = self.handlers.get(kind)
+            try:
+                if handler is None:
+                    raise ValueError(constants.UNKNOWN_JOB.format(kind=kind))
+                with JOB_SECONDS.time(kind=kind):
+                    await handler(filename)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(constants.JOB_FAILED.format(
+                    kind=kind, image_id=image_id, attempt=attempt, error=e))
+                JOBS_TOTAL.inc(kind=kind, result=(
+                    constants.STATUS_FAILED
+                    if attempt >= constants.JOB_MAX_ATTEMPTS
+                    else constants.JOB_RETRY))
+                await self.db.fail_job(
+                    job_id, str(e),
+                    constants.JOB_RETRY_DELAY * 2 ** (attempt - 1))
+                return
+            JOBS_TOTAL.inc(kind=kind, result=constants.JOB_DONE)
+            await self.db.complete_job(job_id)
+        except RuntimeError as e:
+            logger.error(constants.ERROR_DB_OPERATION.format(error=e))
+        finally:
+            self._semaphore.release()
@@ -0,0 +1,80 @@
+import os
+import random
+import sys
+import time
+
+from loguru import logger
+
+import constants
+
+_configured = False
+
+
+class Rotation:
+    """Loguru rotation condition triggered by file size or age."""
+
+    def __init__(self, max_bytes: int, interval: float):
+        """Initialize the condition.
+
+        Args:
+            max_bytes: Rotate once the file reaches this size.
+            interval: Rotate once the file is older than this many seconds.
+        """
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._opened_at = time.monotonic()
+
+    def __call__(self, message, file) -> bool:
+        """Check whether the file should be rotated before the message.
+
+        Args:
+            message: The message about to be written.
+            file: The opened log file.
+        Returns:
+            bool: True to rotate.
+        """
+        now = time.monotonic()
+        if (file.tell() + len(message) > self.max_bytes
+                or now - self._opened_at > self.interval):
+            self._opened_at = now
+            return True
+        return False
+
+
+def setup_logging(log_dir: str = constants.LOG_DIR,
+                  log_file: str = constants.LOG_FILE) -> None:
+    """Configure loguru sinks once per process.
+
+    Records are handed to a queue and written by a background thread, so
+    logging never does file I/O on the event loop. The queue only orders
+    writes within one process, so every process needs a file of its own,
+    or rotations of a shared file would race.
+
+    Args:
+        log_dir: The directory for the log file.
+        log_file: Name of the log file.
+    """
+    global _configured
+    if _configured:
+        return
+    os.makedirs(log_dir, exist_ok=True)
+    logger.remove()
+    logger.add(sys.stderr, level=constants.LOG_LEVEL, enqueue=True)
+    logger.add(os.path.join(log_dir, log_file),
+               format=constants.LOG_FORMAT, level=constants.LOG_LEVEL,
+               enqueue=True,
+               rotation=Rotation(constants.LOG_ROTATION_SIZE,
+                                 constants.LOG_ROTATION_INTERVAL),
+               retention=constants.LOG_RETENTION)
+    _configured = True
+
+
+def log_request(message: str) -> None:
+    """Log a per-request INFO line, sampled by LOG_SAMPLE_RATE.
+
+    Args:
+        message: The message to log.
+    """
+    if (constants.LOG_SAMPLE_RATE >= 1
+            or random.random() < constants.LOG_SAMPLE_RATE):
+        logger.opt(depth=1).info(message)
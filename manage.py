@@ -0,0 +1,155 @@
+"""Maintenance commands run against the configured database.
+
+Usage:
+    python manage.py backfill-metadata [--batch-size N]
+    python manage.py migrate-shards [--batch-size N] [--pause SECONDS]
+    python manage.py reconcile [--delete] [--rate N] [--grace SECONDS]
+
+The backfill-metadata command records dimensions, orientation,
+placeholders and perceptual hashes of images uploaded before they were
+stored at upload time.
+The migrate-shards command moves files from the flat images and
+derivatives directories into shard directories; it is safe to run while
+the server is up.
+The reconcile command reports files without rows and rows without files,
+and removes them with --delete.
+"""
+import argparse
+import asyncio
+import sys
+
+from loguru import logger
+
+import constants
+from db import Database
+from derivatives import describe_image
+from executor import ImageExecutor
+from log_config import setup_logging
+from reconcile import Reconciler
+from storage import derivative_storage, storage
+
+
+async def backfill_metadata(args: argparse.Namespace) -> int:
+    """Describe every image without dimensions, in batches by ID.
+
+    Args:
+        args: Parsed command line arguments.
+    Returns:
+        int: Process exit status.
+    """
+    db = Database()
+    image_executor = ImageExecutor()
+    await db.connect()
+    image_executor.start()
+    # Stay within the executor capacity instead of failing fast.
+    semaphore = asyncio.Semaphore(image_executor.capacity)
+    updated = missing = 0
+    last_id = 0
+
+    async def describe(filename: str) -> tuple[int, int, int, str, int]:
+        async with semaphore:
+            return await image_executor.run(
+                describe_image, await storage.locate(filename))
+
+    try:
+        while True:
+            images = await db.get_undescribed(last_id, args.batch_size)
+            if not images:
+                break
+            last_id = images[-1][0]
+            results = await asyncio.gather(
+                *(describe(filename) for _, filename in images),
+                return_exceptions=True)
+            rows = []
+            for (image_id, filename), result in zip(images, results):
+                if isinstance(result, Exception):
+                    logger.warning(constants.BACKFILL_FAILED.format(
+                        filename=filename, error=result))
+                    missing += 1
+                    continue
+                rows.append((*result, image_id))
+            await db.update_metadata(rows)
+            updated += len(rows)
+            logger.info(constants.BACKFILL_PROGRESS.format(
+                updated=updated, missing=missing))
+    finally:
+        await image_executor.shutdown()
+        await db.disconnect()
+    return 0
+
+
+async def migrate_shards(args: argparse.Namespace) -> int:
+    """Move flat image files and thumbnails into shards, in batches.
+
+    Args:
+        args: Parsed command line arguments.
+    Returns:
+        int: Process exit status.
+    """
+    for target in (storage, derivative_storage):
+        await target.migrate(args.batch_size, args.pause)
+    return 0
+
+
+async def reconcile(args: argparse.Namespace) -> int:
+    """Reconcile the images directory with the images table.
+
+    Args:
+        args: Parsed command line arguments.
+    Returns:
+        int: Process exit status, 1 if another run is in progress.
+    """
+    db = Database()
+    await db.connect()
+    try:
+        reconciler = Reconciler(db, rate=args.rate, grace=args.grace,
+                                batch_size=args.batch_size)
+        report = await reconciler.run(delete=args.delete)
+    finally:
+        await db.disconnect()
+    return 0 if report is not None else 1
+
+
+def main() -> int:
+    """Parse arguments and run the selected command.
+
+    Returns:
+        int: Process exit status.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backfill_parser = commands.add_parser(
+        'backfill-metadata', help='record dimensions of existing images')
+    backfill_parser.add_argument('--batch-size', type=int,
+                                 default=constants.BACKFILL_BATCH_SIZE)
+
+    migrate_parser = commands.add_parser(
+        'migrate-shards', help='move flat image files into shards')
+    migrate_parser.add_argument('--batch-size', type=int,
+                                default=constants.SHARD_MIGRATE_BATCH_SIZE)
+    migrate_parser.add_argument('--pause', type=float,
+                                default=constants.SHARD_MIGRATE_PAUSE)
+
+    reconcile_parser = commands.add_parser(
+        'reconcile', help='find orphaned files and rows without files')
+    reconcile_parser.add_argument('--delete', action='store_true',
+                                  help='remove orphans instead of reporting')
+    reconcile_parser.add_argument('--rate', type=float,
+                                  default=constants.RECONCILE_RATE,
+                                  help='filesystem operations per second')
+    reconcile_parser.add_argument('--grace', type=float,
+                                  default=constants.RECONCILE_GRACE)
+    reconcile_parser.add_argument('--batch-size', type=int,
+                                  default=constants.RECONCILE_BATCH_SIZE)
+
+    args = parser.parse_args()
+    setup_logging(log_file=constants.MANAGE_LOG_FILE)
+    handlers = {'backfill-metadata': backfill_metadata,
+                'migrate-shards': migrate_shards,
+                'reconcile': reconcile}
+    return asyncio.run(handlers[args.command](args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,300 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+from aiohttp import web
+
+import constants
+
+LabelValues = tuple[str, ...]
+Collector = Callable[[], Iterable[tuple[str, str, float]]]
+
+
+class Metric:
+    """Base class of in-process metrics with optional labels."""
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple[str, ...] = ()):
+        """Initialize the metric.
+
+        Args:
+            name: Metric name.
+            documentation: HELP text.
+            labelnames: Names of the labels, in order.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        """Return label values in labelnames order."""
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues,
+                       extra: tuple[tuple[str, str], ...] = ()) -> str:
+        """Render a label set in exposition format."""
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', r'\\').replace('"', r'\"')
+                   for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value
+                              in zip(pairs, escaped)) + '}'
+
+    def samples(self) -> Iterator[str]:
+        """Yield sample lines in exposition format."""
+        raise NotImplementedError
+
+    def render(self) -> Iterator[str]:
+        """Yield HELP, TYPE and sample lines."""
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type_name}'
+        yield from self.samples()
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+    type_name = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the counter.
+
+        Args:
+            amount: Increment.
+            **labels: Label values.
+        """
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f'{self.name}{self._format_labels(key)} {value}'
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+    type_name = 'gauge'
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """Decrease the gauge.
+
+        Args:
+            amount: Decrement.
+            **labels: Label values.
+        """
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the gauge.
+
+        Args:
+            value: New value.
+            **labels: Label values.
+        """
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Cumulative histogram with fixed buckets."""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = constants.LATENCY_BUCKETS):
+        """Initialize the histogram.
+
+        Args:
+            name: Metric name.
+            documentation: HELP text.
+            labelnames: Names of the labels, in order.
+            buckets: Sorted upper bounds, +Inf is added implicitly.
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        self._values: dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record an observation.
+
+        Args:
+            value: Observed value.
+            **labels: Label values.
+        """
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[0][index] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of the block in seconds.
+
+        Args:
+            **labels: Label values.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = self._format_labels(key, (('le', repr(bound)),))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = self._format_labels(key, (('le', '+Inf'),))
+            yield f'{self.name}_bucket{labels} {count}'
+            yield f'{self.name}_sum{self._format_labels(key)} {total}'
+            yield f'{self.name}_count{self._format_labels(key)} {count}'
+
+
+class Registry:
+    """Collection of metrics rendered for the /metrics endpoint."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._metrics: list[Metric] = []
+        self._collectors: list[Collector] = []
+
+    def register(self, metric: Metric) -> Metric:
+        """Add a metric to the registry.
+
+        Args:
+            metric: The metric.
+        Returns:
+            Metric: The same metric, for assignment.
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        """Add a callable evaluated on every scrape.
+
+        Args:
+            collector: Returns (name, documentation, value) gauge samples.
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text exposition format.
+
+        Returns:
+            str: Exposition text.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, documentation, value in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS_TOTAL = REGISTRY.register(Counter(
+    'http_requests_total', 'HTTP requests handled.',
+    ('route', 'method', 'status')))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Time spent in request handlers.',
+    ('route', 'method')))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'http_requests_in_flight', 'Requests currently being handled.'))
+RESPONSE_BYTES = REGISTRY.register(Histogram(
+    'http_response_size_bytes', 'Size of response bodies.', ('route',),
+    buckets=constants.SIZE_BUCKETS))
+UPLOAD_STAGE_SECONDS = REGISTRY.register(Histogram(
+    'upload_stage_duration_seconds', 'Time spent in upload stages.',
+    ('stage',)))
+DB_CHECKOUT_SECONDS = REGISTRY.register(Histogram(
+    'db_pool_checkout_duration_seconds',
+    'Time spent waiting for a pooled connection.'))
+JOBS_TOTAL = REGISTRY.register(Counter(
+    'jobs_total', 'Background jobs run.', ('kind', 'result')))
+JOB_SECONDS = REGISTRY.register(Histogram(
+    'job_duration_seconds', 'Time spent running background jobs.',
+    ('kind',)))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    'admission_rejected_total', 'Requests rejected by admission control.',
+    ('kind', 'reason')))
+
+
+def route_name(request: web.Request) -> str:
+    """Return a low-cardinality name of the matched route.
+
+    Args:
+        request: Request object.
+    Returns:
+        str: Canonical route path or 'unmatched'.
+    """
+    resource = request.match_info.route.resource
+    return resource.canonical if resource is not None else 'unmatched'
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request,
+                             handler: Callable) -> web.StreamResponse:
+    """Record latency, status and in-flight count of every request.
+
+    Args:
+        request: Request object.
+        handler: Next handler.
+    Returns:
+        web.StreamResponse: The handler response.
+    """
+    route = route_name(request)
+    status = constants.HTTP_500_INTERNAL_SERVER_ERROR
+    REQUESTS_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                route=route, method=request.method)
+        REQUESTS_TOTAL.inc(route=route, method=request.method,
+                           status=str(status))
+
+
+async def record_response_size(request: web.Request,
+                               response: web.StreamResponse) -> None:
+    """Record the response size once headers are prepared.
+
+    Args:
+        request: Request object.
+        response: Response being prepared.
+    """
+    if response.content_length is not None:
+        RESPONSE_BYTES.observe(response.content_length,
+                               route=route_name(request))
+
+
+def setup_metrics(app: web.Application) -> None:
+    """Install the metrics middleware and response hook.
+
+    Args:
+        app: aiohttp application instance
+    """
+    app.middlewares.append(metrics_middleware)
+    app.on_response_prepare.append(record_response_size)
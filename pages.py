@@ -0,0 +1,180 @@
+import gzip
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import aiofiles
+import aiofiles.os
+from aiohttp import web
+from loguru import logger
+
+import constants
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+@dataclass
+class CachedPage:
+    """HTML page with precomputed encodings and a strong ETag."""
+    body: bytes
+    gzip: bytes
+    brotli: Optional[bytes]
+    etag: str
+    mtime: float
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """Returns the ETag of one encoding of the page.
+
+        Strong validators must differ between content codings, so the
+        coding is appended to the tag of the identity body.
+
+        Args:
+            encoding: Content-Encoding of the body or None for identity.
+        Returns:
+            str: The quoted ETag.
+        """
+        if encoding is None:
+            return self.etag
+        return f'{self.etag[:-1]}-{encoding}"'
+
+
+class PageCache:
+    """In-memory cache of static HTML pages.
+
+    Pages are loaded once (at startup or on first request) and then served
+    from memory. With check_mtime the file is re-read when it changes on disk.
+    """
+
+    def __init__(self, static_dir: str = constants.STATIC_DIR,
+                 check_mtime: bool = constants.STATIC_PAGES_CHECK_MTIME):
+        """Initialize the cache.
+
+        Args:
+            static_dir: The directory containing the pages.
+            check_mtime: Whether to stat the file on every request.
+        """
+        self.static_dir = static_dir
+        self.check_mtime = check_mtime
+        self._pages: dict[str, CachedPage] = {}
+
+    async def load(self, html_file: str) -> CachedPage:
+        """Read a page from disk and precompute its variants.
+
+        Args:
+            html_file: Page path relative to the static directory.
+        Returns:
+            CachedPage: The cached page.
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        file_path = os.path.join(self.static_dir, html_file)
+        async with aiofiles.open(file_path, 'rb') as file:
+            body = await file.read()
+        mtime = (await aiofiles.os.stat(file_path)).st_mtime
+        page = CachedPage(
+            body=body,
+            gzip=gzip.compress(body),
+            brotli=brotli.compress(body) if brotli else None,
+            etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+            mtime=mtime,
+        )
+        self._pages[html_file] = page
+        logger.info(constants.PAGE_CACHED.format(page=html_file))
+        return page
+
+    async def preload(self, html_files: Iterable[str]) -> None:
+        """Load pages at startup, logging pages that cannot be read.
+
+        Args:
+            html_files: Page paths relative to the static directory.
+        """
+        for html_file in html_files:
+            try:
+                await self.load(html_file)
+            except OSError as e:
+                logger.error(constants.PAGE_CACHE_ERROR.format(
+                    page=html_file, error=e))
+
+    async def get(self, html_file: str) -> CachedPage:
+        """Return a cached page, loading it on a miss.
+
+        Args:
+            html_file: Page path relative to the static directory.
+        Returns:
+            CachedPage: The cached page.
+        Raises:
+            FileNotFoundError: If the file does not exist.
+        """
+        page = self._pages.get(html_file)
+        if page is None:
+            return await self.load(html_file)
+        if self.check_mtime:
+            file_path = os.path.join(self.static_dir, html_file)
+            if (await aiofiles.os.stat(file_path)).st_mtime != page.mtime:
+                return await self.load(html_file)
+        return page
+
+    @staticmethod
+    def respond(request: web.Request, page: CachedPage) -> web.Response:
+        """Build a response for a page honoring If-None-Match and
+        Accept-Encoding.
+
+        Args:
+            request: Request object.
+            page: The cached page.
+        Returns:
+            web.Response: 304 if the client copy is current, otherwise 200
+            with the best encoding the client accepts.
+        """
+        encodings = accepted_tokens(
+            request.headers.get('Accept-Encoding', ''))
+        body, encoding = page.body, None
+        if page.brotli is not None and 'br' in encodings:
+            body, encoding = page.brotli, 'br'
+        elif 'gzip' in encodings:
+            body, encoding = page.gzip, 'gzip'
+        headers = {
+            'ETag': page.etag_for(encoding),
+            'Cache-Control': constants.PAGE_CACHE_CONTROL,
+            'Vary': 'Accept-Encoding',
+        }
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        tags = {tag.strip().removeprefix('W/')
+                for tag in if_none_match.split(',')}
+        if headers['ETag'] in tags or '*' in tags:
+            headers.pop('Content-Encoding', None)
+            return web.Response(status=constants.HTTP_304_NOT_MODIFIED,
+                                headers=headers)
+        return web.Response(status=constants.HTTP_200_OK, body=body,
+                            content_type=constants.CONTENT_TYPE_HTML,
+                            charset='utf-8', headers=headers)
+
+
+def accepted_tokens(header: str) -> set[str]:
+    """Parse an Accept or Accept-Encoding header, dropping values with q=0.
+
+    Args:
+        header: Header value.
+    Returns:
+        set: Accepted media types or content codings in lower case.
+    """
+    tokens = set()
+    for item in header.split(','):
+        token, _, params = item.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if token.strip():
+            tokens.add(token.strip().lower())
+    return tokens
@@ -8,31 +8,255 @@ CREATE TABLE IF NOT EXISTS images (
     size INTEGER NOT NULL,
     upload_time TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     file_type VARCHAR(10) NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_upload_time_id_idx
+    ON images (upload_time DESC, id DESC);
+ALTER TABLE images
+    ADD COLUMN IF NOT EXISTS content_hash VARCHAR(128),
+    ADD COLUMN IF NOT EXISTS ref_count INTEGER NOT NULL DEFAULT 1;
+CREATE UNIQUE INDEX IF NOT EXISTS images_content_hash_idx
+    ON images (content_hash);
+ALTER TABLE images
+    ADD COLUMN IF NOT EXISTS width INTEGER,
+    ADD COLUMN IF NOT EXISTS height INTEGER,
+    ADD COLUMN IF NOT EXISTS orientation SMALLINT,
+    ADD COLUMN IF NOT EXISTS placeholder TEXT,
+    ADD COLUMN IF NOT EXISTS processing_status VARCHAR(16) NOT NULL
+        DEFAULT 'ready';
+ALTER TABLE images ADD COLUMN IF NOT EXISTS phash BIGINT;
+CREATE INDEX IF NOT EXISTS images_filename_c_idx
+    ON images (filename COLLATE "C");
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGSERIAL PRIMARY KEY,
+    image_id INTEGER NOT NULL REFERENCES images (id) ON DELETE CASCADE,
+    kind VARCHAR(32) NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS jobs_run_after_idx
+    ON jobs (run_after) WHERE status IN ('pending', 'running');
+CREATE INDEX IF NOT EXISTS jobs_image_id_idx ON jobs (image_id);
+CREATE TABLE IF NOT EXISTS image_variants (
+    image_id INTEGER NOT NULL REFERENCES images (id) ON DELETE CASCADE,
+    format VARCHAR(10) NOT NULL,
+    size INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (image_id, format)
 )
 """
 
 INSERT_IMAGE = """
-    INSERT INTO images (filename, original_name, size, file_type) 
-    VALUES (%s, %s, %s, %s)
-    RETURNING id
+    INSERT INTO images (filename, original_name, size, file_type, content_hash,
+                        width, height, orientation, placeholder, phash)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (content_hash)
+        DO UPDATE SET ref_count = images.ref_count + 1
+    RETURNING id, xmax = 0 AS inserted
 """
 
-GET_IMAGES = """
-    SELECT 
+IMAGE_COLUMNS = """
         id,
         filename,
         original_name,
         size,
         file_type,
         size/1024 AS size_kb,
-        to_char(upload_time, 'YYYY-MM-DD HH24:MI:SS') AS upload_date
+        to_char(upload_time, 'YYYY-MM-DD HH24:MI:SS') AS upload_date,
+        width,
+        height,
+        orientation,
+        placeholder,
+        processing_status,
+        upload_time
+"""
+
+GET_IMAGES = f"""
+    SELECT {IMAGE_COLUMNS}
     FROM images
-    ORDER BY upload_time DESC
+    ORDER BY upload_time DESC, id DESC
     LIMIT %s OFFSET %s
 """
 
+GET_IMAGES_AFTER = f"""
+    SELECT {IMAGE_COLUMNS}
+    FROM images
+    WHERE (upload_time, id) < (%s, %s)
+    ORDER BY upload_time DESC, id DESC
+    LIMIT %s
+"""
+
 COUNT_IMAGES = """SELECT COUNT(*) FROM images"""
 
+ESTIMATE_IMAGES = """
+    SELECT reltuples::bigint FROM pg_class WHERE oid = 'images'::regclass
+"""
+
 FIND_BY_ID = """SELECT filename FROM images WHERE id = %s"""
 
-DELETE_BY_ID = """DELETE FROM images WHERE id = %s RETURNING filename"""
+GET_IMAGES_BY_IDS = f"""
+    SELECT {IMAGE_COLUMNS}
+    FROM images
+    WHERE id = ANY(%s)
+"""
+
+GET_FILENAMES = """
+    SELECT id, filename FROM images
+    WHERE filename COLLATE "C" > %s
+    ORDER BY filename COLLATE "C"
+    LIMIT %s
+"""
+
+FIND_FILENAMES = """SELECT filename FROM images WHERE filename = ANY(%s)"""
+
+EXPORT_IMAGES = """
+    SELECT id, filename, original_name, size, file_type, content_hash,
+           ref_count, width, height, orientation, placeholder, phash,
+           processing_status, upload_time
+    FROM images
+    WHERE upload_time >= COALESCE(%s::timestamptz, '-infinity')
+    ORDER BY id
+"""
+
+GET_PHASH = """SELECT phash FROM images WHERE id = %s"""
+
+FIND_BY_CONTENT_HASH = """SELECT id FROM images WHERE content_hash = %s"""
+
+GET_PHASHES = """
+    SELECT id, phash FROM images
+    WHERE id > %s AND phash IS NOT NULL
+    ORDER BY id
+    LIMIT %s
+"""
+
+GET_PHASHES_BY_IDS = """
+    SELECT id, phash FROM images
+    WHERE id = ANY(%s) AND phash IS NOT NULL
+"""
+
+GET_UNDESCRIBED = """
+    SELECT id, filename FROM images
+    WHERE (width IS NULL OR phash IS NULL) AND id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+UPDATE_METADATA = """
+    UPDATE images SET width = %s, height = %s, orientation = %s,
+                      placeholder = %s, phash = %s
+    WHERE id = %s
+"""
+
+ENQUEUE_JOBS = """
+    WITH queued AS (
+        INSERT INTO jobs (image_id, kind)
+        SELECT image_id, kind
+        FROM unnest(%s::integer[]) AS image_id
+        CROSS JOIN unnest(%s::varchar[]) AS kind
+        RETURNING image_id
+    )
+    UPDATE images SET processing_status = 'pending'
+    WHERE id IN (SELECT image_id FROM queued)
+"""
+
+CLAIM_JOBS = """
+    UPDATE jobs
+    SET status = 'running',
+        attempts = jobs.attempts + 1,
+        run_after = CURRENT_TIMESTAMP + make_interval(secs => %s)
+    FROM images
+    WHERE jobs.id IN (
+        SELECT id FROM jobs
+        WHERE status IN ('pending', 'running')
+            AND run_after <= CURRENT_TIMESTAMP
+        ORDER BY run_after
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ) AND images.id = jobs.image_id
+    RETURNING jobs.id, jobs.kind, jobs.attempts, images.id, images.filename
+"""
+
+COMPLETE_JOB = """
+    WITH done AS (
+        DELETE FROM jobs WHERE id = %(id)s RETURNING image_id
+    )
+    UPDATE images SET processing_status = 'ready'
+    FROM done
+    WHERE images.id = done.image_id
+        AND images.processing_status = 'pending'
+        AND NOT EXISTS (SELECT 1 FROM jobs
+                        WHERE jobs.image_id = done.image_id
+                            AND jobs.id <> %(id)s)
+    RETURNING images.id
+"""
+
+FAIL_JOB = """
+    WITH failed AS (
+        UPDATE jobs
+        SET status = CASE WHEN attempts >= %(max_attempts)s
+                          THEN 'failed' ELSE 'pending' END,
+            run_after = CURRENT_TIMESTAMP + make_interval(secs => %(delay)s),
+            last_error = %(error)s
+        WHERE id = %(id)s
+        RETURNING image_id, status
+    )
+    UPDATE images SET processing_status = 'failed'
+    FROM failed
+    WHERE images.id = failed.image_id AND failed.status = 'failed'
+    RETURNING images.id
+"""
+
+ADD_VARIANT = """
+    INSERT INTO image_variants (image_id, format, size)
+    SELECT id, %s, %s FROM images WHERE filename = %s
+    ON CONFLICT (image_id, format) DO UPDATE SET size = EXCLUDED.size
+    RETURNING image_id
+"""
+
+EVICT_VARIANTS = """
+    WITH ranked AS (
+        SELECT image_id, format,
+               SUM(size) OVER (ORDER BY created_at DESC, image_id DESC,
+                               format) AS cached
+        FROM image_variants
+    )
+    DELETE FROM image_variants USING ranked, images
+    WHERE image_variants.image_id = ranked.image_id
+        AND image_variants.format = ranked.format
+        AND ranked.cached > %s
+        AND images.id = image_variants.image_id
+    RETURNING images.filename, image_variants.format
+"""
+
+_DELETE_IMAGES = """
+    WITH targets AS (
+        SELECT id, ref_count FROM images WHERE {condition} FOR UPDATE
+    ), released AS (
+        UPDATE images SET ref_count = images.ref_count - 1
+        FROM targets
+        WHERE images.id = targets.id AND targets.ref_count > 1
+        RETURNING images.id
+    ), deleted AS (
+        DELETE FROM images USING targets
+        WHERE images.id = targets.id AND targets.ref_count <= 1
+        RETURNING images.id, images.filename
+    )
+    SELECT id, filename FROM deleted
+    UNION ALL
+    SELECT id, NULL FROM released
+"""
+
+DELETE_BY_IDS = _DELETE_IMAGES.format(condition='id = ANY(%s)')
+
+PURGE_BY_IDS = """
+    DELETE FROM images WHERE id = ANY(%s)
+    RETURNING id, filename
+"""
+
+DELETE_BY_TIME_RANGE = _DELETE_IMAGES.format(
+    condition="upload_time >= COALESCE(%s::timestamptz, '-infinity') "
+              "AND upload_time < COALESCE(%s::timestamptz, 'infinity')")
+
+NOTIFY = """SELECT pg_notify(%s, %s)"""
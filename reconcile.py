@@ -0,0 +1,328 @@
+import asyncio
+import fcntl
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Optional
+
+import aiofiles.os
+from loguru import logger
+
+import constants
+from storage import Storage, storage
+
+HEX_DIGITS = frozenset('0123456789abcdef')
+
+
+class Throttle:
+    """Spaces operations out to at most rate per second."""
+
+    def __init__(self, rate: float):
+        """Initialize the throttle.
+
+        Args:
+            rate: Operations per second, 0 for no limit.
+        """
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+
+    async def wait(self) -> None:
+        """Wait for the next operation slot."""
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next > now:
+            await asyncio.sleep(self._next - now)
+        self._next = max(self._next, now) + self.interval
+
+
+@dataclass
+class ReconcileReport:
+    """Counts collected by one reconciliation run."""
+    files: int = 0
+    orphan_files: int = 0
+    recent_files: int = 0
+    missing_files: int = 0
+    removed_files: int = 0
+    removed_rows: int = 0
+
+
+def stored_name(filename: str) -> str:
+    """Returns the name of the image a stored file belongs to.
+
+    Args:
+        filename: Name of an image or of its variant, e.g. 'ab.jpg.webp'.
+    Returns:
+        str: The image name.
+    """
+    stem, extension = os.path.splitext(filename)
+    if extension[1:] in constants.VARIANT_FORMATS and '.' in stem:
+        return stem
+    return filename
+
+
+class Reconciler:
+    """Finds files without rows and rows without files, and removes them.
+
+    Files in the sharded layout are read in name order, one directory at a
+    time, and merge-joined with filenames read from the database in sorted
+    batches, so neither side is loaded into memory. Files still in the flat
+    layout are looked up in the database batch by batch. Filesystem
+    operations are throttled to a configurable rate.
+    """
+
+    def __init__(self, db: Any = None,
+                 image_storage: Storage = storage,
+                 rate: float = constants.RECONCILE_RATE,
+                 grace: float = constants.RECONCILE_GRACE,
+                 batch_size: int = constants.RECONCILE_BATCH_SIZE):
+        """Initialize the reconciler.
+
+        Args:
+            db: Database providing get_filenames, find_filenames and
+                delete_images with force; may be given later to start.
+            image_storage: Storage of the image files.
+            rate: Filesystem operations per second, 0 for no limit.
+            grace: Files younger than this many seconds are left alone,
+                since an upload writes its file before its row.
+            batch_size: Filenames read from the database at once.
+        """
+        self.db = db
+        self.storage = image_storage
+        self.rate = rate
+        self.grace = grace
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self, delete: bool = False) -> Optional[ReconcileReport]:
+        """Reconcile the images directory with the images table once.
+
+        Only one run at a time is allowed across processes sharing the
+        directory; others return at once.
+
+        Args:
+            delete: Remove orphaned files and rows instead of only
+                reporting them.
+        Returns:
+            Optional[ReconcileReport]: Counts of the run, or None if
+            another run holds the lock.
+        """
+        lock_path = os.path.join(self.storage.root, constants.RECONCILE_LOCK)
+        with open(lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info(constants.RECONCILE_BUSY)
+                return None
+            try:
+                report = ReconcileReport()
+                throttle = Throttle(self.rate)
+                await self._merge(report, throttle, delete)
+                await self._check_flat(report, throttle, delete)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        logger.info(constants.RECONCILE_DONE.format(**asdict(report)))
+        return report
+
+    async def _merge(self, report: ReconcileReport, throttle: Throttle,
+                     delete: bool) -> None:
+        """Merge-join sharded files with database rows."""
+        files = self._sharded_files(throttle)
+        rows = self._rows()
+        file_path = await anext(files, None)
+        row = await anext(rows, None)
+        found = False
+        dangling: list[int] = []
+        while file_path is not None or row is not None:
+            name = (stored_name(os.path.basename(file_path))
+                    if file_path is not None else None)
+            if row is None or (name is not None and name < row[1]):
+                report.files += 1
+                await self._orphan_file(file_path, report, throttle, delete)
+                file_path = await anext(files, None)
+            elif name == row[1]:
+                report.files += 1
+                found = found or os.path.basename(file_path) == row[1]
+                file_path = await anext(files, None)
+            else:
+                if not found and not await self.storage.exists(row[1]):
+                    report.missing_files += 1
+                    logger.warning(constants.RECONCILE_MISSING_FILE.format(
+                        id=row[0], filename=row[1]))
+                    dangling.append(row[0])
+                    if len(dangling) >= self.batch_size:
+                        await self._remove_rows(dangling, report, delete)
+                found = False
+                row = await anext(rows, None)
+        await self._remove_rows(dangling, report, delete)
+
+    async def _check_flat(self, report: ReconcileReport, throttle: Throttle,
+                          delete: bool) -> None:
+        """Look up files left in the flat layout, batch by batch."""
+        async for batch in self._flat_files(throttle):
+            report.files += len(batch)
+            known = await self.db.find_filenames(
+                list({stored_name(filename) for filename in batch}))
+            for filename in batch:
+                if stored_name(filename) not in known:
+                    await self._orphan_file(
+                        self.storage.flat_path(filename), report, throttle,
+                        delete)
+
+    async def _orphan_file(self, file_path: str, report: ReconcileReport,
+                           throttle: Throttle, delete: bool) -> None:
+        """Report a file without a row and remove it once it is old enough.
+        """
+        await throttle.wait()
+        try:
+            stat = await aiofiles.os.stat(file_path)
+        except FileNotFoundError:
+            return
+        if time.time() - stat.st_mtime < self.grace:
+            report.recent_files += 1
+            return
+        report.orphan_files += 1
+        logger.warning(constants.RECONCILE_ORPHAN_FILE.format(
+            file_path=file_path, size=stat.st_size))
+        if not delete:
+            return
+        await throttle.wait()
+        try:
+            await aiofiles.os.remove(file_path)
+            report.removed_files += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(constants.DELETE_FILE_ERROR.format(error=e))
+
+    async def _remove_rows(self, image_ids: list[int],
+                           report: ReconcileReport, delete: bool) -> None:
+        """Delete rows whose files are missing and empty the list.
+
+        References held by other uploads do not keep such rows, since
+        their file is gone for all of them.
+        """
+        if delete and image_ids:
+            rows = await self.db.delete_images(image_ids=list(image_ids),
+                                               force=True)
+            report.removed_rows += len(rows)
+        image_ids.clear()
+
+    async def _rows(self) -> AsyncIterator[tuple[int, str]]:
+        """Yield (id, filename) of all images in filename order."""
+        last_filename = ''
+        while True:
+            rows = await self.db.get_filenames(last_filename,
+                                               self.batch_size)
+            for row in rows:
+                yield row
+            if len(rows) < self.batch_size:
+                return
+            last_filename = rows[-1][1]
+
+    async def _sharded_files(self,
+                             throttle: Throttle) -> AsyncIterator[str]:
+        """Yield paths of sharded files in name order.
+
+        Shard directories are named by the leading hex digits of the files
+        they hold, so walking them in sorted order yields files sorted by
+        name while only one listing per level is in memory.
+        """
+        async def walk(path: str, depth: int) -> AsyncIterator[str]:
+            await throttle.wait()
+            try:
+                names = await asyncio.to_thread(
+                    self._list, path, depth < self.storage.levels)
+            except FileNotFoundError:
+                return
+            for name in names:
+                if depth < self.storage.levels:
+                    async for file_path in walk(os.path.join(path, name),
+                                                depth + 1):
+                        yield file_path
+                else:
+                    yield os.path.join(path, name)
+
+        async for file_path in walk(self.storage.root, 0):
+            yield file_path
+
+    def _list(self, path: str, directories: bool) -> list[str]:
+        """List shard directories or stored files of a directory, sorted."""
+        with os.scandir(path) as entries:
+            if directories:
+                names = [entry.name for entry in entries
+                         if len(entry.name) == self.storage.width
+                         and set(entry.name) <= HEX_DIGITS
+                         and entry.is_dir(follow_symlinks=False)]
+            else:
+                names = [entry.name for entry in entries
+                         if not entry.name.endswith(
+                             constants.TEMP_FILE_SUFFIX)
+                         and entry.is_file(follow_symlinks=False)]
+        return sorted(names)
+
+    async def _flat_files(self,
+                          throttle: Throttle) -> AsyncIterator[list[str]]:
+        """Yield names of files in the flat layout, in batches."""
+        entries = await asyncio.to_thread(os.scandir, self.storage.root)
+        try:
+            while True:
+                await throttle.wait()
+                batch = await asyncio.to_thread(self._take_flat, entries)
+                if not batch:
+                    return
+                yield batch
+        finally:
+            entries.close()
+
+    def _take_flat(self, entries: Any) -> list[str]:
+        """Read up to batch_size flat image files from a scandir iterator."""
+        names = []
+        for entry in entries:
+            if (not entry.name.endswith(constants.TEMP_FILE_SUFFIX)
+                    and self.storage.shard(entry.name) is not None
+                    and entry.is_file(follow_symlinks=False)):
+                names.append(entry.name)
+                if len(names) >= self.batch_size:
+                    break
+        return names
+
+    def start(self, db: Any,
+              interval: float = constants.RECONCILE_INTERVAL,
+              delete: bool = constants.RECONCILE_DELETE) -> None:
+        """Start reconciling periodically.
+
+        Args:
+            db: Database to reconcile with.
+            interval: Seconds between runs.
+            delete: Remove orphans instead of only reporting them.
+        """
+        if self._task is None:
+            self.db = db
+            self._task = asyncio.create_task(
+                self._run_forever(interval, delete))
+
+    async def stop(self) -> None:
+        """Stop the periodic reconciliation."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run_forever(self, interval: float, delete: bool) -> None:
+        """Reconcile every interval seconds, logging failures.
+
+        Args:
+            interval: Seconds between runs.
+            delete: Remove orphans instead of only reporting them.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.run(delete)
+            except (OSError, RuntimeError) as e:
+                logger.error(constants.RECONCILE_ERROR.format(error=e))
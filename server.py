@@ -0,0 +1,243 @@
+"""Pre-fork launcher running several app workers on one port.
+
+Usage:
+    python server.py [--workers N] [--host HOST] [--port PORT]
+
+Each worker is a separate process with its own event loop, database
+pool and image executor; the global DB_CONNECTION_BUDGET and
+IMAGE_WORKERS are split between workers. Workers bind the port with
+SO_REUSEPORT so the kernel balances connections between them; where
+SO_REUSEPORT is unavailable they share a socket created by the launcher.
+SIGHUP restarts workers one by one, SIGTERM and SIGINT stop them
+gracefully.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from multiprocessing.process import BaseProcess
+from multiprocessing.synchronize import Event
+from typing import Optional
+
+from loguru import logger
+
+import constants
+from log_config import setup_logging
+
+
+def run_worker(index: int, host: str, port: int, ready: Event,
+               sock: Optional[socket.socket] = None) -> None:
+    """Run one app worker until it receives SIGTERM or SIGINT.
+
+    Args:
+        index: Worker number.
+        host: Host to bind.
+        port: Port to bind.
+        ready: Set once the worker accepts connections.
+        sock: Shared listening socket, if SO_REUSEPORT is unavailable.
+    """
+    # Before app is imported, so its setup_logging call keeps this file.
+    setup_logging(log_file=constants.WORKER_LOG_FILE.format(index=index))
+
+    from aiohttp import web
+
+    import app
+
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    logger.info(constants.WORKER_STARTED.format(
+        index=index, pid=os.getpid(), pool_size=constants.DB_POOL_MAX_SIZE))
+    bind = ({'sock': sock} if sock is not None
+            else {'host': host, 'port': port, 'reuse_port': True})
+    # run_app calls print once every site is started, which is exactly
+    # when the worker becomes ready.
+    web.run_app(app.init_app(), print=lambda *_: ready.set(),
+                shutdown_timeout=constants.WORKER_STOP_TIMEOUT, **bind)
+
+
+class Supervisor:
+    """Starts, restarts and stops app worker processes."""
+
+    def __init__(self, workers: int, host: str, port: int):
+        """Initialize the supervisor.
+
+        Args:
+            workers: Number of worker processes.
+            host: Host to bind.
+            port: Port to bind.
+        """
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.context = multiprocessing.get_context('spawn')
+        self.processes: list[Optional[BaseProcess]] = [None] * workers
+        self.sock: Optional[socket.socket] = None
+        self._restart = False
+        self._stop = False
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            self.sock = socket.create_server((host, port))
+
+    def spawn(self, index: int) -> BaseProcess:
+        """Start a worker and wait until it accepts connections, exits or
+        the supervisor is asked to stop.
+
+        Args:
+            index: Worker number.
+        Returns:
+            BaseProcess: The started process.
+        """
+        ready = self.context.Event()
+        process = self.context.Process(
+            target=run_worker, name=f'worker-{index}',
+            args=(index, self.host, self.port, ready, self.sock))
+        process.start()
+        # Poll so that a worker dying during startup or a stop request
+        # does not hold the supervisor for the whole timeout.
+        deadline = time.monotonic() + constants.WORKER_READY_TIMEOUT
+        while not ready.wait(constants.WORKER_READY_POLL):
+            if not process.is_alive():
+                logger.error(constants.WORKER_START_FAILED.format(
+                    index=index, code=process.exitcode))
+                break
+            if self._stop:
+                break
+            if time.monotonic() > deadline:
+                logger.error(constants.WORKER_NOT_READY.format(index=index))
+                break
+        return process
+
+    @staticmethod
+    def stop(process: BaseProcess) -> None:
+        """Stop a worker gracefully, killing it after the timeout.
+
+        Args:
+            process: The worker process.
+        """
+        process.terminate()
+        process.join(constants.WORKER_STOP_TIMEOUT + 5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def restart_all(self) -> None:
+        """Replace workers one at a time so the port is always served."""
+        logger.info(constants.SERVER_RESTART.format(workers=self.workers))
+        for index, process in enumerate(self.processes):
+            if self._stop:
+                return
+            self.processes[index] = self.spawn(index)
+            if process is not None:
+                self.stop(process)
+
+    def stop_all(self) -> None:
+        """Stop all workers."""
+        logger.info(constants.SERVER_STOP.format(workers=self.workers))
+        for process in self.processes:
+            if process is not None:
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join(constants.WORKER_STOP_TIMEOUT + 5)
+                if process.is_alive():
+                    process.kill()
+
+    def _request_restart(self, signum: int, frame) -> None:
+        self._restart = True
+
+    def _request_stop(self, signum: int, frame) -> None:
+        self._stop = True
+
+    def run(self) -> None:
+        """Start workers and supervise them until asked to stop."""
+        signal.signal(signal.SIGHUP, self._request_restart)
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        for index in range(self.workers):
+            if self._stop:
+                break
+            self.processes[index] = self.spawn(index)
+        logger.info(constants.SERVER_LISTENING.format(
+            host=self.host, port=self.port, workers=self.workers))
+        while not self._stop:
+            time.sleep(0.5)
+            if self._restart:
+                self._restart = False
+                self.restart_all()
+            for index, process in enumerate(self.processes):
+                if (not self._stop and process is not None
+                        and process.exitcode is not None):
+                    logger.warning(constants.WORKER_EXITED.format(
+                        index=index, code=process.exitcode))
+                    self.processes[index] = self.spawn(index)
+        self.stop_all()
+
+
+def pool_size_per_worker(workers: int) -> int:
+    """Split the global connection budget between workers.
+
+    Each worker also holds one connection for LISTEN when enabled.
+
+    Args:
+        workers: Number of worker processes.
+    Returns:
+        int: Maximum pool size of one worker.
+    """
+    per_worker = constants.DB_CONNECTION_BUDGET // workers
+    if constants.DB_LISTENER:
+        per_worker -= 1
+    return max(1, per_worker)
+
+
+def max_workers() -> int:
+    """Largest number of workers the connection budget can serve.
+
+    Every worker needs at least one pooled connection, plus one for LISTEN
+    when enabled.
+
+    Returns:
+        int: Maximum number of worker processes.
+    """
+    per_worker = 2 if constants.DB_LISTENER else 1
+    return max(1, constants.DB_CONNECTION_BUDGET // per_worker)
+
+
+def image_workers_per_worker(workers: int) -> int:
+    """Split the image executor processes between workers.
+
+    Args:
+        workers: Number of worker processes.
+    Returns:
+        int: Image executor size of one worker.
+    """
+    return max(1, constants.IMAGE_WORKERS // workers)
+
+
+def main() -> int:
+    """Parse arguments and run the supervisor.
+
+    Returns:
+        int: Process exit status.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=constants.WORKERS)
+    parser.add_argument('--host', default=constants.APP_HOST)
+    parser.add_argument('--port', type=int, default=constants.APP_PORT)
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.workers > max_workers():
+        logger.warning(constants.WORKERS_CAPPED.format(
+            workers=args.workers, limit=max_workers(),
+            budget=constants.DB_CONNECTION_BUDGET))
+        args.workers = max_workers()
+    # Spawned workers re-read constants from the inherited environment.
+    os.environ['DB_POOL_MAX_SIZE'] = str(pool_size_per_worker(args.workers))
+    os.environ['IMAGE_WORKERS'] = str(image_workers_per_worker(args.workers))
+    Supervisor(args.workers, args.host, args.port).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
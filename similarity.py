@@ -0,0 +1,182 @@
+import asyncio
+import time
+from typing import Any, Iterable, Optional
+
+import numpy as np
+from loguru import logger
+
+import constants
+
+
+class SimilarityIndex:
+    """In-memory index of the perceptual hashes of all images.
+
+    Hashes are kept in NumPy blocks and compared with a vectorized XOR and
+    popcount, so a query scans millions of hashes in milliseconds without
+    touching the database. Every worker process holds its own copy: new
+    rows are pulled by ID at most once per refresh interval, and deletes
+    and hashes written to existing rows, e.g. by manage.py
+    backfill-metadata, arrive as database change notifications.
+    """
+
+    def __init__(self, block_size: int = constants.SIMILARITY_BLOCK_SIZE,
+                 refresh_interval: float = (
+                     constants.SIMILARITY_REFRESH_INTERVAL)):
+        """Initialize an empty index.
+
+        Args:
+            block_size: Maximum number of hashes in one block.
+            refresh_interval: Minimum seconds between database refreshes.
+        """
+        self.block_size = block_size
+        self.refresh_interval = refresh_interval
+        self.last_id = 0
+        self._ids: list[np.ndarray] = []
+        self._hashes: list[np.ndarray] = []
+        self._refreshed: Optional[float] = None
+        self._changed: set[int] = set()
+        self._reload = False
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self._ids)
+
+    def add(self, rows: list[tuple[int, int]]) -> None:
+        """Add hashes of images, filling the last block first.
+
+        Args:
+            rows: (id, phash) tuples, phash as a signed 64-bit integer.
+        """
+        if not rows:
+            return
+        ids = np.fromiter((image_id for image_id, _ in rows), np.int64,
+                          len(rows))
+        hashes = np.fromiter((phash for _, phash in rows), np.int64,
+                             len(rows)).view(np.uint64)
+        if self._ids and len(self._ids[-1]) + len(ids) <= self.block_size:
+            self._ids[-1] = np.concatenate((self._ids[-1], ids))
+            self._hashes[-1] = np.concatenate((self._hashes[-1], hashes))
+        else:
+            self._ids.append(ids)
+            self._hashes.append(hashes)
+        self.last_id = max(self.last_id, int(ids.max()))
+
+    def remove(self, image_ids: Iterable[int]) -> None:
+        """Drop hashes of deleted images.
+
+        Args:
+            image_ids: IDs of the images.
+        """
+        targets = np.fromiter(image_ids, np.int64)
+        if not len(targets):
+            return
+        for index, ids in enumerate(self._ids):
+            keep = ~np.isin(ids, targets)
+            if not keep.all():
+                self._ids[index] = ids[keep]
+                self._hashes[index] = self._hashes[index][keep]
+
+    def publish(self, change: dict[str, Any]) -> None:
+        """Note a database change; used as a database subscriber.
+
+        Deleted images are dropped at once and updated images are pulled
+        on the next refresh. A change without IDs may have touched any
+        row, so the index is then reloaded.
+
+        Args:
+            change: {'op': ..., 'id': ...} as sent by Database._notify.
+        """
+        op = change.get('op')
+        image_ids = change.get('id')
+        if image_ids is None:
+            self._reload = True
+            return
+        if not isinstance(image_ids, list):
+            image_ids = [image_ids]
+        if op == constants.OP_DELETE:
+            self.remove(image_ids)
+            self._changed.difference_update(image_ids)
+        elif op == constants.OP_UPDATE:
+            self._changed.update(image_ids)
+
+    def search(self, phash: int, max_distance: int, limit: int,
+               exclude: Optional[int] = None) -> list[tuple[int, int]]:
+        """Find the hashes closest to phash by Hamming distance.
+
+        Args:
+            phash: Perceptual hash to compare with.
+            max_distance: Maximum number of differing bits.
+            limit: Maximum number of matches.
+            exclude: ID of an image to leave out, e.g. the queried one.
+        Returns:
+            list: (id, distance) tuples, closest first.
+        """
+        query = np.array([phash], np.int64).view(np.uint64)[0]
+        found_ids = []
+        found_distances = []
+        for ids, hashes in zip(self._ids, self._hashes):
+            distances = np.bitwise_count(hashes ^ query)
+            matches = distances <= max_distance
+            if exclude is not None:
+                matches &= ids != exclude
+            if matches.any():
+                found_ids.append(ids[matches])
+                found_distances.append(distances[matches])
+        if not found_ids:
+            return []
+        ids = np.concatenate(found_ids)
+        distances = np.concatenate(found_distances)
+        order = np.lexsort((ids, distances))[:limit]
+        return [(int(ids[i]), int(distances[i])) for i in order]
+
+    async def refresh(self, db: Any, force: bool = False) -> None:
+        """Load hashes of images added or changed since the last refresh.
+
+        Args:
+            db: Database providing get_phashes and get_phashes_by_ids.
+            force: Refresh even within the refresh interval.
+        Raises:
+            RuntimeError: If the hashes cannot be fetched.
+        """
+        if not force and self._is_fresh():
+            return
+        async with self._lock:
+            if not force and self._is_fresh():
+                return
+            if self._reload:
+                self._reload = False
+                self._changed.clear()
+                self._ids, self._hashes = [], []
+                self.last_id = 0
+                # Make other callers wait for the reload to finish.
+                self._refreshed = None
+            if self._changed:
+                changed = [image_id for image_id in self._changed
+                           if image_id <= self.last_id]
+                self._changed.clear()
+                rows = await db.get_phashes_by_ids(changed)
+                self.remove(changed)
+                self.add(rows)
+            while True:
+                rows = await db.get_phashes(self.last_id,
+                                            constants.SIMILARITY_LOAD_BATCH)
+                self.add(rows)
+                if len(rows) < constants.SIMILARITY_LOAD_BATCH:
+                    break
+            self._refreshed = time.monotonic()
+
+    def _is_fresh(self) -> bool:
+        """Checks whether the last refresh is within the interval."""
+        return (self._refreshed is not None and
+                time.monotonic() - self._refreshed < self.refresh_interval)
+
+    async def load(self, db: Any) -> None:
+        """Load all hashes at startup.
+
+        Args:
+            db: Database providing get_phashes.
+        Raises:
+            RuntimeError: If the hashes cannot be fetched.
+        """
+        await self.refresh(db, force=True)
+        logger.info(constants.SIMILARITY_LOADED.format(count=len(self)))
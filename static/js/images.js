@@ -8,17 +8,25 @@ paginationContainer.className = 'pagination'; // Добавляем класс 
 gallery.after(paginationContainer);
 
 let currentPage = 1;
+let perPage = 10;
+let totalImages = 0;
+
+// Changes pushed by the server, applied to the page without refetching
+const events = window.EventSource ? new EventSource('/api/images/events') : null;
 
 const handleDelete = (id) => {
     fetch(`/api/images/${id}`, {
         method: 'DELETE'
     }).then(() => {
-        fetchImages(currentPage);
+        // The delete event removes the card, refetch only without events
+        if (!events || events.readyState !== EventSource.OPEN) {
+            fetchImages(currentPage);
+        }
     });
 }
 
 // Main function to load images
-async function fetchImages(page = 1) {
+async function fetchImages(page = 1, pushHistory = true) {
     try {
         const response = await fetch(`/api/images?page=${page}`);
         if (response.status === 404) {
@@ -28,26 +36,93 @@ async function fetchImages(page = 1) {
         const data = await response.json();
 
         gallery.innerHTML = '';
-        console.log(data.images)
         if (!data.images.length) {
-            const notFoundMessage = document.createElement("div")
-            notFoundMessage.innerHTML = "В галерее еще нет изображений."
-            gallery.className = "gallery notFoundMessage"
-
-            gallery.appendChild(notFoundMessage)
+            showEmptyMessage();
         } else {
+            gallery.className = "gallery"
             data.images.forEach(item => gallery.appendChild(card(item)));
         }
 
+        perPage = data.per_page || perPage;
+        totalImages = data.total || 0;
         renderPagination(page, data.total_pages || 1);
         currentPage = page;
 
-        history.pushState(null, null, `?page=${page}`);
+        if (pushHistory) {
+            history.pushState(null, null, `?page=${page}`);
+        }
     } catch (error) {
         console.error('Error loading images:', error);
     }
 }
 
+function showEmptyMessage() {
+    const notFoundMessage = document.createElement("div")
+    notFoundMessage.innerHTML = "В галерее еще нет изображений."
+    gallery.className = "gallery notFoundMessage"
+
+    gallery.appendChild(notFoundMessage)
+}
+
+const totalPages = () => Math.max(1, Math.ceil(totalImages / perPage));
+
+// New images go on top of the first page, pushing the last cards out.
+// Other pages only update the page count.
+function applyInsert(images) {
+    totalImages += images.length;
+    if (currentPage === 1) {
+        if (gallery.classList.contains('notFoundMessage')) {
+            gallery.innerHTML = '';
+            gallery.className = "gallery"
+        }
+        images
+            .filter(item => !gallery.querySelector(`[data-id="${item.id}"]`))
+            .sort((a, b) => a.id - b.id)
+            .forEach(item => gallery.prepend(card(item)));
+        while (gallery.children.length > perPage) {
+            gallery.lastElementChild.remove();
+        }
+    }
+    renderPagination(currentPage, totalPages());
+}
+
+// Changed images, e.g. with finished thumbnails, replace their cards
+function applyUpdate(images) {
+    images.forEach(item => gallery.querySelector(`[data-id="${item.id}"]`)?.replaceWith(card(item)));
+}
+
+function applyDelete(ids) {
+    totalImages = Math.max(0, totalImages - ids.length);
+    ids.forEach(id => gallery.querySelector(`[data-id="${id}"]`)?.remove());
+    if (!gallery.children.length) {
+        if (currentPage > 1 || totalImages > 0) {
+            fetchImages(Math.min(currentPage, totalPages()), currentPage > totalPages());
+        } else {
+            showEmptyMessage();
+        }
+        return;
+    }
+    renderPagination(currentPage, totalPages());
+}
+
+if (events) {
+    let missedEvents = false;
+    events.addEventListener('insert', (e) => applyInsert(JSON.parse(e.data).images));
+    events.addEventListener('update', (e) => applyUpdate(JSON.parse(e.data).images));
+    events.addEventListener('delete', (e) => applyDelete(JSON.parse(e.data).ids));
+    // Changes may have been missed, reload the current page
+    events.addEventListener('reset', () => fetchImages(currentPage, false));
+    events.addEventListener('error', () => {
+        missedEvents = true;
+    });
+    events.addEventListener('open', () => {
+        if (missedEvents) {
+            missedEvents = false;
+            fetchImages(currentPage, false);
+        }
+    });
+}
+
 // Rendering pagination
 function renderPagination(currentPage, totalPages) {
     paginationContainer.innerHTML = '';
@@ -124,6 +199,7 @@ function createPaginationButton(text, onClick) {
 const card = (item) => {
     const card = document.createElement('div');
     card.className = 'card';
+    card.dataset.id = item.id;
 
     const link = document.createElement('a');
     link.href = `/images/${item.filename}`;
@@ -132,9 +208,21 @@ const card = (item) => {
     imgContainer.className = 'imgContainer';
 
     const img = document.createElement('img');
-    img.src = `/images/${item.filename}`;
+    img.src = item.thumbnail_url || `/images/${item.filename}`;
     img.alt = item.filename;
+    img.loading = 'lazy';
     img.className = 'img';
+    if (item.width && item.height) {
+        img.width = item.width;
+        img.height = item.height;
+    }
+    // Show the inline placeholder until the image itself arrives
+    if (item.placeholder) {
+        imgContainer.style.backgroundImage = `url(${item.placeholder})`;
+        imgContainer.classList.add('placeholder');
+        img.classList.add('loading');
+        img.addEventListener('load', () => img.classList.remove('loading'));
+    }
 
     const textContainer = document.createElement('div');
     textContainer.className = 'textContainer';
@@ -0,0 +1,215 @@
+import asyncio
+import os
+import string
+from typing import Optional
+
+import aiofiles.os
+from loguru import logger
+
+import constants
+
+
+class Storage:
+    """Stored files laid out in two levels of hex prefix directories.
+
+    A file named ``abcdef….jpg`` lives in ``{root}/ab/cd/``. Names start
+    with a random UUID or a content hash, so files spread evenly over the
+    shards. Files from the flat layout are still found until they are
+    moved by ``migrate``, which can run while the server is serving them.
+    """
+
+    def __init__(self, root: str = constants.IMAGES_DIR,
+                 levels: int = constants.SHARD_LEVELS,
+                 width: int = constants.SHARD_WIDTH):
+        """Initialize the storage.
+
+        Args:
+            root: The directory containing the shards.
+            levels: Number of prefix directories.
+            width: Number of hex digits in each prefix directory name.
+        """
+        self.root = root
+        self.levels = levels
+        self.width = width
+
+    def shard(self, filename: str) -> Optional[str]:
+        """Returns the shard directory of a file relative to the root.
+
+        Args:
+            filename: Name of the file. Variants and other files derived
+                from an image share its prefix and therefore its shard.
+        Returns:
+            Optional[str]: The shard, or None if the name is not sharded.
+        """
+        prefix_length = self.levels * self.width
+        prefix = filename[:prefix_length]
+        if (len(prefix) < prefix_length
+                or not set(prefix) <= set(string.hexdigits.lower())):
+            return None
+        return os.path.join(*(prefix[i:i + self.width]
+                              for i in range(0, prefix_length, self.width)))
+
+    def path(self, filename: str) -> str:
+        """Returns the path of a file in the sharded layout.
+
+        Args:
+            filename: Name of the file.
+        Returns:
+            str: Path to the file.
+        """
+        shard = self.shard(filename)
+        if shard is None:
+            return self.flat_path(filename)
+        return os.path.join(self.root, shard, filename)
+
+    def flat_path(self, filename: str) -> str:
+        """Returns the path of a file in the flat layout."""
+        return os.path.join(self.root, filename)
+
+    async def locate(self, filename: str) -> str:
+        """Returns the path of a stored file in either layout.
+
+        Misses resolve to the sharded path, so a file moved by a concurrent
+        migration between the two checks is still found.
+
+        Args:
+            filename: Name of the file.
+        Returns:
+            str: Path to the file, the sharded path if it does not exist.
+        """
+        file_path = self.path(filename)
+        if await aiofiles.os.path.exists(file_path):
+            return file_path
+        flat_path = self.flat_path(filename)
+        if (flat_path != file_path
+                and await aiofiles.os.path.exists(flat_path)):
+            return flat_path
+        return file_path
+
+    async def exists(self, filename: str) -> bool:
+        """Checks whether a file is stored in either layout.
+
+        Args:
+            filename: Name of the file.
+        Returns:
+            bool: True if the file exists.
+        """
+        return await aiofiles.os.path.exists(await self.locate(filename))
+
+    async def prepare(self, filename: str) -> str:
+        """Creates the shard directory of a file and returns its path.
+
+        Args:
+            filename: Name of the file.
+        Returns:
+            str: Path to the file in the sharded layout.
+        """
+        file_path = self.path(filename)
+        await aiofiles.os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return file_path
+
+    async def store(self, temp_path: str, filename: str) -> str:
+        """Atomically moves a file into its shard.
+
+        Args:
+            temp_path: Path to the file on the same filesystem.
+            filename: Name to store the file under.
+        Returns:
+            str: Path to the stored file.
+        """
+        file_path = await self.prepare(filename)
+        await aiofiles.os.replace(temp_path, file_path)
+        return file_path
+
+    async def remove(self, filename: str) -> None:
+        """Removes a file from both layouts, logging instead of raising.
+
+        Args:
+            filename: Name of the file.
+        """
+        for file_path in {self.path(filename), self.flat_path(filename)}:
+            try:
+                await aiofiles.os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(constants.DELETE_FILE_ERROR.format(error=e))
+
+    def url(self, filename: str, base_url: str) -> str:
+        """Returns the public URL of a file.
+
+        URLs do not include the shard, so they survive the migration; the
+        web server and the image route map them onto the layout.
+
+        Args:
+            filename: Name of the file.
+            base_url: The base URL.
+        Returns:
+            str: The file URL.
+        """
+        return f'{base_url}/{self.root}/{filename}'
+
+    def _flat_batch(self, limit: int, skip: set[str]) -> list[str]:
+        """Lists up to limit files still stored in the flat layout."""
+        names = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if (entry.name in skip
+                        or entry.name.endswith(constants.TEMP_FILE_SUFFIX)
+                        or self.shard(entry.name) is None
+                        or not entry.is_file(follow_symlinks=False)):
+                    continue
+                names.append(entry.name)
+                if len(names) >= limit:
+                    break
+        return names
+
+    def _move(self, filename: str) -> None:
+        """Moves a flat file into its shard, keeping a newer sharded copy."""
+        file_path = self.path(filename)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if os.path.exists(file_path):
+            os.remove(self.flat_path(filename))
+        else:
+            os.replace(self.flat_path(filename), file_path)
+
+    async def migrate(self,
+                      batch_size: int = constants.SHARD_MIGRATE_BATCH_SIZE,
+                      pause: float = constants.SHARD_MIGRATE_PAUSE) -> int:
+        """Moves files from the flat layout into shards, in batches.
+
+        Each move is an atomic rename and readers fall back from one layout
+        to the other, so the server keeps serving files during migration.
+        The pause between batches limits the load on the filesystem.
+
+        Args:
+            batch_size: Number of files moved per batch.
+            pause: Seconds to wait between batches.
+        Returns:
+            int: Number of files moved.
+        """
+        moved = 0
+        failed: set[str] = set()
+        while True:
+            names = await asyncio.to_thread(self._flat_batch, batch_size,
+                                            failed)
+            if not names:
+                break
+            for filename in names:
+                try:
+                    await asyncio.to_thread(self._move, filename)
+                    moved += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(constants.SHARD_MIGRATE_ERROR.format(
+                        filename=filename, error=e))
+                    failed.add(filename)
+            logger.info(constants.SHARD_MIGRATE_PROGRESS.format(
+                moved=moved, failed=len(failed)))
+            await asyncio.sleep(pause)
+        return moved
+
+
+storage = Storage()
+derivative_storage = Storage(constants.DERIVATIVES_DIR)
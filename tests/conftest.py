@@ -0,0 +1,22 @@
+"""Shared test setup.
+
+constants reads its required settings from the environment at import
+time, so defaults are set here before any module of the app is imported.
+"""
+import os
+import sys
+
+os.environ.setdefault('ALLOWED_EXTENSIONS', 'jpg,jpeg,png,gif')
+os.environ.setdefault('APP_PORT', '8000')
+os.environ.setdefault('BASE_URL', 'http://localhost')
+os.environ.setdefault('MAX_FILE_SIZE', str(30 * 1024 * 1024))
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/images')
+os.environ.setdefault('POSTGRES_DB', 'images')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_config  # noqa: E402
+
+# Keep the default stderr sink rather than creating logs/ in the checkout
+# when a test imports app.
+log_config._configured = True
@@ -0,0 +1,86 @@
+import ipaddress
+
+import pytest
+from aiohttp.test_utils import make_mocked_request
+
+import admission
+from admission import Budget, RateLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('admission.time.monotonic', lambda: now[0])
+    return now
+
+
+def test_bucket_allows_burst_then_refills(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert bucket.take() == 0
+    clock[0] += 100
+    assert [bucket.take() for _ in range(4)][-1] > 0
+
+
+def test_limiter_tracks_clients_separately(clock):
+    limiter = RateLimiter(rate=1, burst=1)
+    assert limiter.check('a') == 0
+    assert limiter.check('a') > 0
+    assert limiter.check('b') == 0
+
+
+def test_limiter_forgets_least_recent_clients(clock):
+    limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+    limiter.check('a')
+    limiter.check('b')
+    limiter.check('a')
+    limiter.check('c')
+    assert list(limiter._buckets) == ['a', 'c']
+    assert limiter.check('b') == 0
+
+
+def test_zero_rate_disables_the_limit(clock):
+    limiter = RateLimiter(rate=0, burst=0)
+    assert all(limiter.check('a') == 0 for _ in range(100))
+
+
+def test_budget():
+    budget = Budget(10)
+    assert budget.try_take(6)
+    assert not budget.try_take(5)
+    assert budget.try_take(4)
+    budget.release(6)
+    assert budget.used == 4
+
+
+def test_budget_caps_requests_larger_than_the_capacity():
+    budget = Budget(10)
+    assert budget.try_take(50)
+    assert not budget.try_take(1)
+    budget.release(50)
+    assert budget.used == 0
+
+
+def test_unlimited_budget():
+    budget = Budget(0)
+    assert all(budget.try_take(10 ** 9) for _ in range(10))
+    budget.release(10 ** 9)
+    assert budget.used == 0
+
+
+@pytest.mark.parametrize('remote, client', [
+    ('172.28.0.10', '203.0.113.7'),
+    ('10.1.2.3', '203.0.113.7'),
+    ('198.51.100.1', '198.51.100.1'),
+    (None, ''),
+])
+def test_real_ip_is_trusted_only_from_proxies(monkeypatch, remote, client):
+    monkeypatch.setattr(admission, 'TRUSTED_NETWORKS', (
+        ipaddress.ip_network('172.28.0.10'),
+        ipaddress.ip_network('10.0.0.0/8')))
+    request = make_mocked_request('GET', '/api/images',
+                                  headers={'X-Real-IP': '203.0.113.7'})
+    monkeypatch.setattr(type(request), 'remote', remote)
+    assert admission.client_address(request) == client
@@ -0,0 +1,102 @@
+import asyncio
+import io
+
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+
+import app
+import constants
+import utils
+from benchmarks.memory_db import MemoryDatabase
+from executor import ImageExecutor
+from storage import Storage
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 24), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest_asyncio.fixture
+async def client(monkeypatch, tmp_path):
+    image_storage = Storage(str(tmp_path))
+    monkeypatch.setattr(constants, 'IMAGES_DIR', str(tmp_path))
+    monkeypatch.setattr(utils, 'storage', image_storage)
+    monkeypatch.setattr(app, 'db', MemoryDatabase())
+    image_executor = ImageExecutor()
+    await image_executor.shutdown()
+    image_executor.start(constants.EXECUTOR_THREAD, workers=2, queue_size=8)
+    application = web.Application()
+    application.router.add_post('/api/images/batch',
+                                app.batch_upload_handler)
+    async with TestClient(TestServer(application)) as test_client:
+        yield test_client
+    await image_executor.shutdown()
+
+
+async def post_batch(client, *files):
+    form = aiohttp.FormData()
+    for name, data in files:
+        form.add_field('file', data, filename=name)
+    response = await client.post('/api/images/batch', data=form)
+    assert response.status == constants.HTTP_200_OK
+    return await response.json()
+
+
+@pytest.mark.asyncio
+async def test_batch_reports_each_file(client, tmp_path):
+    results = await post_batch(client, ('a.png', png('red')),
+                               ('notes.png', b'not an image'),
+                               ('b.png', png('blue')))
+    assert [result['status'] for result in results] == [
+        constants.HTTP_201_CREATED,
+        constants.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        constants.HTTP_201_CREATED]
+    records = await app.db.get_images_by_ids(
+        [results[0]['id'], results[2]['id']])
+    assert all(record['width'] == 32 for record in records.values())
+    assert not list(tmp_path.glob(f'*{constants.TEMP_FILE_SUFFIX}'))
+
+
+@pytest.mark.asyncio
+async def test_oversized_part_is_rejected(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(constants, 'MAX_FILE_SIZE', 1024)
+    results = await post_batch(client, ('big.png', bytes(4096)),
+                               ('a.png', png('red')))
+    assert [result['status'] for result in results] == [
+        constants.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        constants.HTTP_201_CREATED]
+    assert not list(tmp_path.glob(f'*{constants.TEMP_FILE_SUFFIX}'))
+
+
+@pytest.mark.asyncio
+async def test_parts_are_checked_while_the_next_is_read(client,
+                                                        monkeypatch):
+    checking = asyncio.Event()
+    overlapped = []
+    check_received_file = app.check_received_file
+
+    async def slow_check(upload, allowed_extensions):
+        checking.set()
+        await asyncio.sleep(0.05)
+        return await check_received_file(upload, allowed_extensions)
+
+    receive_part = app.receive_part
+
+    async def receive(*args):
+        upload = await receive_part(*args)
+        overlapped.append(checking.is_set())
+        return upload
+
+    monkeypatch.setattr(app, 'check_received_file', slow_check)
+    monkeypatch.setattr(app, 'receive_part', receive)
+    results = await post_batch(client, ('a.png', png('red')),
+                               ('b.png', png('blue')))
+    assert [result['status'] for result in results] == [
+        constants.HTTP_201_CREATED] * 2
+    assert overlapped == [False, True]
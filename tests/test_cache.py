@@ -0,0 +1,48 @@
+from cache import TTLCache
+
+
+def test_get_and_stats():
+    cache = TTLCache(maxsize=2, ttl=60)
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    assert cache.stats() == {'size': 1, 'maxsize': 2, 'hits': 1,
+                             'misses': 1, 'invalidations': 0}
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_expired_entry_is_a_miss(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('cache.time.monotonic', lambda: now[0])
+    cache = TTLCache(maxsize=2, ttl=5)
+    cache.set('a', 1)
+    now[0] += 6
+    assert cache.get('a') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_zero_maxsize_disables_caching():
+    cache = TTLCache(maxsize=0, ttl=60)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_fill_from_before_a_clear_is_dropped():
+    cache = TTLCache(maxsize=2, ttl=60)
+    generation = cache.invalidations
+    # A write commits and clears the cache while the read is in flight.
+    cache.clear()
+    cache.set('page', 'stale', generation)
+    assert cache.get('page') is None
+    cache.set('page', 'fresh', cache.invalidations)
+    assert cache.get('page') == 'fresh'
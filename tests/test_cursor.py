@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import constants
+from benchmarks.memory_db import MemoryDatabase
+from db import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    upload_time = datetime(2024, 5, 1, 12, 30, 15, 123456,
+                           tzinfo=timezone.utc)
+    cursor = encode_cursor(upload_time, 42)
+    assert decode_cursor(cursor) == (upload_time, 42)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor(datetime.now(timezone.utc), 2 ** 40)
+    assert '=' not in cursor
+    assert '+' not in cursor and '/' not in cursor
+
+
+@pytest.mark.parametrize('cursor', [
+    '',
+    'not a cursor',
+    'W10',
+    encode_cursor(datetime.now(timezone.utc), 1)[:-4],
+])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError, match=constants.INVALID_CURSOR.format(
+            cursor='.*')):
+        decode_cursor(cursor)
+
+
+@pytest.mark.asyncio
+async def test_cursor_walk_visits_every_image_once():
+    db = MemoryDatabase()
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for index in range(7):
+        image_id = await db.insert_image(f'{index}.jpg', f'{index}.jpg',
+                                         1024, 'jpg')
+        # Pairs of images share an upload time, so the ID breaks ties.
+        db._rows[image_id]['upload_time'] = start + timedelta(
+            seconds=index // 2)
+    seen = []
+    cursor = None
+    while True:
+        page = await db.get_images(cursor=cursor, per_page=3)
+        seen.extend(image['id'] for image in page[constants.IMAGES])
+        cursor = page[constants.NEXT_CURSOR]
+        if cursor is None:
+            break
+    assert seen == [7, 6, 5, 4, 3, 2, 1]
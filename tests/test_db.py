@@ -0,0 +1,26 @@
+import pytest
+
+from db import Database
+from queries import COUNT_IMAGES, ESTIMATE_IMAGES, GET_IMAGES
+
+
+class RecordingConnection:
+    """Connection that records the statements it is asked to run."""
+
+    def __init__(self):
+        self.queries = []
+
+    async def execute(self, query, params=None, prepare=None):
+        self.queries.append(query)
+
+    async def commit(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_new_connections_skip_the_exact_count():
+    conn = RecordingConnection()
+    await Database._prepare_statements(conn)
+    assert GET_IMAGES in conn.queries
+    assert ESTIMATE_IMAGES in conn.queries
+    assert COUNT_IMAGES not in conn.queries
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+import pytest_asyncio
+
+from benchmarks.memory_db import MemoryDatabase
+
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+
+@pytest_asyncio.fixture(params=['memory', 'postgres'])
+async def db(request):
+    if request.param == 'memory':
+        yield MemoryDatabase()
+        return
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    from db import Database
+    database = Database()
+    await database.connect(TEST_DATABASE_URL)
+    await database.init_db()
+    yield database
+    await database.disconnect()
+
+
+async def insert(db, content_hash):
+    return await db.insert_image(f'{content_hash}.jpg', 'photo.jpg', 1024,
+                                 'jpg', content_hash)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_uploads_share_one_row(db):
+    content_hash = uuid.uuid4().hex
+    image_ids = await asyncio.gather(*(insert(db, content_hash)
+                                       for _ in range(5)))
+    assert len(set(image_ids)) == 1
+    assert await db.find_by_content_hash(content_hash) == image_ids[0]
+    await db.delete_images(image_ids=image_ids[:1], force=True)
+
+
+@pytest.mark.asyncio
+async def test_file_is_released_with_the_last_reference(db):
+    content_hash = uuid.uuid4().hex
+    image_id = await insert(db, content_hash)
+    await insert(db, content_hash)
+    await insert(db, content_hash)
+    assert await db.delete_image(image_id) == (True, None)
+    assert await db.delete_image(image_id) == (True, None)
+    assert await db.delete_image(image_id) == (True, f'{content_hash}.jpg')
+    assert await db.find_by_content_hash(content_hash) is None
+    assert await db.delete_image(image_id) == (False, None)
+
+
+@pytest.mark.asyncio
+async def test_forced_delete_ignores_references(db):
+    content_hash = uuid.uuid4().hex
+    image_id = await insert(db, content_hash)
+    await insert(db, content_hash)
+    assert await db.delete_images(image_ids=[image_id], force=True) == [
+        (image_id, f'{content_hash}.jpg')]
+    assert await db.get_filename(image_id) is None
+
+
+@pytest.mark.asyncio
+async def test_uploads_without_hash_are_not_shared(db):
+    first = await db.insert_image('a.jpg', 'a.jpg', 1024, 'jpg')
+    second = await db.insert_image('b.jpg', 'a.jpg', 1024, 'jpg')
+    assert first != second
+    await db.delete_images(image_ids=[first, second])
+
+
+@pytest.fixture
+def stored_upload(monkeypatch, tmp_path):
+    import app
+    import constants
+    import utils
+    from storage import Storage
+    from utils import UploadedFile
+
+    image_storage = Storage(str(tmp_path))
+    monkeypatch.setattr(utils, 'storage', image_storage)
+    monkeypatch.setattr(app, 'db', MemoryDatabase())
+    monkeypatch.setattr(constants, 'CONTENT_ADDRESSED_STORAGE', True)
+
+    def upload():
+        temp_path = tmp_path / f'{uuid.uuid4().hex}.part'
+        temp_path.write_bytes(b'same image')
+        return UploadedFile(temp_path=str(temp_path), file_extension='jpg',
+                            size=10, content_hash='abcdef0123')
+
+    return app, image_storage, upload
+
+
+@pytest.mark.asyncio
+async def test_duplicate_upload_reuses_the_stored_file(stored_upload):
+    app, image_storage, upload = stored_upload
+    first, second = upload(), upload()
+    filename = await app.store_upload(first, 'a.jpg')
+    assert await app.store_upload(second, 'b.jpg') == filename
+    assert os.path.exists(image_storage.path(filename))
+    assert not os.path.exists(second.temp_path)
+    assert len(app.db._rows) == 1
+
+
+@pytest.mark.asyncio
+async def test_duplicate_survives_concurrent_delete_of_last_reference(
+        stored_upload, monkeypatch):
+    app, image_storage, upload = stored_upload
+    filename = await app.store_upload(upload(), 'a.jpg')
+    image_id = await app.db.find_by_content_hash('abcdef0123')
+    insert_image = app.db.insert_image
+
+    async def insert_after_delete(*args, **kwargs):
+        # The last reference goes away after save_file found the file.
+        await app.db.delete_image(image_id)
+        await image_storage.remove(filename)
+        return await insert_image(*args, **kwargs)
+
+    monkeypatch.setattr(app.db, 'insert_image', insert_after_delete)
+    duplicate = upload()
+    assert await app.store_upload(duplicate, 'b.jpg') == filename
+    assert os.path.exists(image_storage.path(filename))
+    assert not os.path.exists(duplicate.temp_path)
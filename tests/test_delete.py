@@ -0,0 +1,164 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import app
+import constants
+import derivatives
+import utils
+from benchmarks.memory_db import MemoryDatabase
+from storage import Storage
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest_asyncio.fixture
+async def client(monkeypatch, tmp_path):
+    image_storage = Storage(str(tmp_path / 'images'))
+    derivative_storage = Storage(str(tmp_path / 'derivatives'))
+    monkeypatch.setattr(utils, 'storage', image_storage)
+    monkeypatch.setattr(derivatives, 'storage', image_storage)
+    monkeypatch.setattr(derivatives, 'derivative_storage', derivative_storage)
+    monkeypatch.setattr(app, 'db', MemoryDatabase())
+    application = web.Application()
+    application.router.add_delete('/api/images/{id}', app.delete_handler)
+    application.router.add_delete('/api/images', app.bulk_delete_handler)
+    async with TestClient(TestServer(application)) as test_client:
+        yield test_client, image_storage
+
+
+async def add_image(image_storage, name, days=0, content_hash=None):
+    """Stores a file and its row, uploaded days after START."""
+    file_path = image_storage.path(name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'wb') as f:
+        f.write(b'image')
+    image_id = await app.db.insert_image(name, name, 5, 'jpg',
+                                         content_hash=content_hash)
+    app.db._rows[image_id]['upload_time'] = START + timedelta(days=days)
+    return image_id
+
+
+async def bulk_delete(test_client, body):
+    response = await test_client.delete('/api/images', json=body)
+    assert response.status == constants.HTTP_200_OK
+    return json.loads(await response.text())
+
+
+@pytest.mark.asyncio
+async def test_delete_removes_row_and_file(client):
+    test_client, image_storage = client
+    image_id = await add_image(image_storage, 'aaaa01.jpg')
+    response = await test_client.delete(f'/api/images/{image_id}')
+    assert response.status == constants.HTTP_200_OK
+    assert await app.db.get_filename(image_id) is None
+    assert not await image_storage.exists('aaaa01.jpg')
+
+
+@pytest.mark.asyncio
+async def test_delete_unknown_image(client):
+    test_client, _ = client
+    response = await test_client.delete('/api/images/404')
+    assert response.status == constants.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_delete_invalid_id(client):
+    test_client, _ = client
+    response = await test_client.delete('/api/images/abc')
+    assert response.status == constants.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_delete_shared_file_only_releases_it(client, monkeypatch):
+    monkeypatch.setattr(constants, 'CONTENT_ADDRESSED_STORAGE', True)
+    test_client, image_storage = client
+    image_id = await add_image(image_storage, 'aaaa01.jpg', content_hash='h')
+    assert await add_image(image_storage, 'aaaa01.jpg',
+                           content_hash='h') == image_id
+    response = await test_client.delete(f'/api/images/{image_id}')
+    assert response.status == constants.HTTP_200_OK
+    assert await app.db.get_filename(image_id) == 'aaaa01.jpg'
+    assert await image_storage.exists('aaaa01.jpg')
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_by_ids_reports_not_found(client):
+    test_client, image_storage = client
+    first = await add_image(image_storage, 'aaaa01.jpg')
+    second = await add_image(image_storage, 'bbbb02.jpg')
+    kept = await add_image(image_storage, 'cccc03.jpg')
+    result = await bulk_delete(test_client,
+                               {constants.IDS: [first, second, 999]})
+    assert result == {constants.DELETED: [first, second],
+                      constants.RELEASED: [],
+                      constants.NOT_FOUND: [999]}
+    assert not await image_storage.exists('aaaa01.jpg')
+    assert not await image_storage.exists('bbbb02.jpg')
+    assert await image_storage.exists('cccc03.jpg')
+    assert await app.db.get_filename(kept) == 'cccc03.jpg'
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_splits_released_from_deleted(client, monkeypatch):
+    monkeypatch.setattr(constants, 'CONTENT_ADDRESSED_STORAGE', True)
+    test_client, image_storage = client
+    shared = await add_image(image_storage, 'aaaa01.jpg', content_hash='h')
+    await add_image(image_storage, 'aaaa01.jpg', content_hash='h')
+    single = await add_image(image_storage, 'bbbb02.jpg', content_hash='g')
+    result = await bulk_delete(test_client, {constants.IDS: [shared, single]})
+    assert result[constants.DELETED] == [single]
+    assert result[constants.RELEASED] == [shared]
+    assert await image_storage.exists('aaaa01.jpg')
+    assert not await image_storage.exists('bbbb02.jpg')
+
+    result = await bulk_delete(test_client, {constants.IDS: [shared]})
+    assert result[constants.DELETED] == [shared]
+    assert not await image_storage.exists('aaaa01.jpg')
+
+
+@pytest.mark.parametrize('body, deleted', [
+    ({constants.TIME_FROM: '2026-01-02T00:00:00+00:00'}, [1, 2]),
+    ({constants.TIME_TO: '2026-01-02T00:00:00+00:00'}, [0]),
+    ({constants.TIME_FROM: '2026-01-02T00:00:00+00:00',
+      constants.TIME_TO: '2026-01-03T00:00:00+00:00'}, [1]),
+])
+@pytest.mark.asyncio
+async def test_bulk_delete_by_time_range(client, body, deleted):
+    test_client, image_storage = client
+    image_ids = [await add_image(image_storage, f'{day:04x}aa.jpg', day)
+                 for day in range(3)]
+    result = await bulk_delete(test_client, body)
+    assert sorted(result[constants.DELETED]) == [image_ids[day]
+                                                 for day in deleted]
+    assert result[constants.NOT_FOUND] == []
+    for day, image_id in enumerate(image_ids):
+        assert (await app.db.get_filename(image_id) is None) == (
+            day in deleted)
+
+
+@pytest.mark.parametrize('body', [
+    {},
+    {constants.IDS: ['x']},
+    {constants.TIME_FROM: 'yesterday'},
+    [1, 2],
+])
+@pytest.mark.asyncio
+async def test_bulk_delete_rejects_invalid_body(client, body):
+    test_client, _ = client
+    response = await test_client.delete('/api/images', json=body)
+    assert response.status == constants.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_rejects_too_many_ids(client, monkeypatch):
+    monkeypatch.setattr(constants, 'BULK_DELETE_MAX_IDS', 2)
+    test_client, _ = client
+    response = await test_client.delete('/api/images',
+                                        json={constants.IDS: [1, 2, 3]})
+    assert response.status == constants.HTTP_400_BAD_REQUEST
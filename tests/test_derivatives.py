@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+import constants
+import derivatives
+from derivatives import (bucket_width, negotiate_format, remove_thumbnails,
+                         supported_variant_formats, thumbnail_path)
+from storage import Storage
+
+
+@pytest.fixture
+def widths(monkeypatch):
+    monkeypatch.setattr(constants, 'THUMBNAIL_WIDTHS', (160, 320, 640))
+    monkeypatch.setattr(constants, 'THUMBNAIL_DEFAULT_WIDTH', 320)
+
+
+@pytest.mark.parametrize('width, bucket', [
+    (None, 320),
+    (1, 160),
+    (160, 160),
+    (161, 320),
+    (640, 640),
+    (5000, 640),
+])
+def test_bucket_width(widths, width, bucket):
+    assert bucket_width(width) == bucket
+
+
+def test_thumbnail_path_keeps_extension():
+    path = thumbnail_path('abc.png', 320, Storage('cache'))
+    assert path == os.path.join('cache', 'abc_w320.png')
+
+
+def test_thumbnail_path_is_sharded_like_the_image():
+    path = thumbnail_path('abcdef.jpg', 320, Storage('cache'))
+    assert path == os.path.join('cache', 'ab', 'cd', 'abcdef_w320.jpg')
+
+
+@pytest.mark.asyncio
+async def test_remove_thumbnails_in_both_layouts(widths, monkeypatch,
+                                                 tmp_path):
+    derivatives_storage = Storage(str(tmp_path))
+    monkeypatch.setattr(derivatives, 'derivative_storage',
+                        derivatives_storage)
+    sharded = derivatives_storage.path('abcdef_w160.jpg')
+    os.makedirs(os.path.dirname(sharded))
+    flat = derivatives_storage.flat_path('abcdef_w640.jpg')
+    for path in (sharded, flat):
+        with open(path, 'wb') as f:
+            f.write(b'thumbnail')
+    await remove_thumbnails('abcdef.jpg')
+    assert not os.path.exists(sharded)
+    assert not os.path.exists(flat)
+
+
+@pytest.fixture
+def formats(monkeypatch):
+    monkeypatch.setattr(derivatives, 'VARIANT_FORMATS', ('avif', 'webp'))
+
+
+@pytest.mark.parametrize('filename, accept, image_format', [
+    ('a.jpg', 'image/avif,image/webp,*/*', 'avif'),
+    ('a.JPEG', 'image/webp,image/avif', 'avif'),
+    ('a.png', 'image/webp,*/*;q=0.8', 'webp'),
+    ('a.jpg', 'image/avif;q=0, image/webp', 'webp'),
+    ('a.jpg', 'image/avif;q=0,image/webp;q=0', None),
+    ('a.jpg', '*/*', None),
+    ('a.jpg', '', None),
+    ('a.gif', 'image/avif,image/webp', None),
+])
+def test_negotiate_format(formats, filename, accept, image_format):
+    assert negotiate_format(filename, accept) == image_format
+
+
+def test_negotiate_format_skips_unsupported(monkeypatch):
+    monkeypatch.setattr(derivatives, 'VARIANT_FORMATS', ('webp',))
+    assert negotiate_format('a.jpg', 'image/avif') is None
+    assert negotiate_format('a.jpg', 'image/avif,image/webp') == 'webp'
+
+
+def test_supported_variant_formats_keeps_order():
+    formats = ('png', 'nonexistent', 'jpeg')
+    assert supported_variant_formats(formats) == ('png', 'jpeg')
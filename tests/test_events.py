@@ -0,0 +1,186 @@
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import app
+import constants
+from benchmarks.memory_db import MemoryDatabase
+from events import RESET_EVENT, ImageEvents, format_event
+
+
+def parse(event):
+    lines = event.decode().splitlines()
+    assert lines[0].startswith('event: ') and lines[1].startswith('data: ')
+    return lines[0][len('event: '):], json.loads(lines[1][len('data: '):])
+
+
+async def insert(db, name):
+    return await db.insert_image(name, name, 10, 'jpg')
+
+
+@pytest_asyncio.fixture
+async def events():
+    db = MemoryDatabase()
+    image_events = ImageEvents(queue_size=4, max_clients=2)
+    image_events.start(db)
+    yield image_events, db
+    await image_events.stop()
+
+
+def test_format_event():
+    event = format_event('delete', {'ids': [1, 2], 'name': 'фото'})
+    assert event == ('event: delete\ndata: {"ids":[1,2],"name":"фото"}\n\n'
+                     .encode())
+
+
+@pytest.mark.asyncio
+async def test_insert_event_carries_the_records(events):
+    image_events, db = events
+    queue = image_events.connect()
+    image_id = await insert(db, 'a.jpg')
+    op, data = parse(await asyncio.wait_for(queue.get(), 1))
+    assert op == constants.OP_INSERT
+    assert [image['id'] for image in data[constants.IMAGES]] == [image_id]
+    assert data[constants.IMAGES][0]['filename'] == 'a.jpg'
+
+
+@pytest.mark.asyncio
+async def test_update_event_carries_each_record_once(events):
+    image_events, db = events
+    image_id = await insert(db, 'a.jpg')
+    queue = image_events.connect()
+    image_events.publish({'op': constants.OP_UPDATE,
+                          'id': [image_id, image_id]})
+    op, data = parse(await asyncio.wait_for(queue.get(), 1))
+    assert op == constants.OP_UPDATE
+    assert [image['id'] for image in data[constants.IMAGES]] == [image_id]
+
+
+@pytest.mark.asyncio
+async def test_delete_event_carries_ids(events):
+    image_events, db = events
+    image_id = await insert(db, 'a.jpg')
+    queue = image_events.connect()
+    await db.delete_image(image_id)
+    op, data = parse(await asyncio.wait_for(queue.get(), 1))
+    assert op == constants.OP_DELETE
+    assert data == {constants.IDS: [image_id]}
+
+
+@pytest.mark.asyncio
+async def test_update_of_deleted_image_sends_nothing(events):
+    image_events, db = events
+    queue = image_events.connect()
+    image_events.publish({'op': constants.OP_UPDATE, 'id': 404})
+    image_events.publish({'op': constants.OP_DELETE, 'id': 404})
+    op, _ = parse(await asyncio.wait_for(queue.get(), 1))
+    assert op == constants.OP_DELETE
+
+
+@pytest.mark.parametrize('change', [
+    {'op': constants.OP_INSERT, 'id': None},
+    {'op': 'truncate', 'id': 1},
+])
+@pytest.mark.asyncio
+async def test_unknown_change_resets(events, change):
+    image_events, _ = events
+    queue = image_events.connect()
+    image_events.publish(change)
+    assert await asyncio.wait_for(queue.get(), 1) == RESET_EVENT
+
+
+@pytest.mark.asyncio
+async def test_database_error_resets(events, monkeypatch):
+    image_events, db = events
+
+    async def fail(image_ids):
+        raise RuntimeError('connection lost')
+
+    monkeypatch.setattr(db, 'get_images_by_ids', fail)
+    queue = image_events.connect()
+    image_events.publish({'op': constants.OP_INSERT, 'id': 1})
+    assert await asyncio.wait_for(queue.get(), 1) == RESET_EVENT
+
+
+@pytest.mark.asyncio
+async def test_changes_without_clients_are_dropped(events):
+    image_events, db = events
+    await insert(db, 'a.jpg')
+    assert image_events._changes.empty()
+
+
+def test_overflow_replaces_backlog_with_reset():
+    image_events = ImageEvents(queue_size=2)
+    slow = image_events.connect()
+    for index in range(3):
+        image_events._broadcast(format_event('insert', {'n': index}))
+    assert slow.qsize() == 1
+    assert slow.get_nowait() == RESET_EVENT
+
+
+def test_overflow_leaves_other_clients_alone():
+    image_events = ImageEvents(queue_size=2)
+    slow, fast = image_events.connect(), image_events.connect()
+    image_events._broadcast(b'one')
+    image_events._broadcast(b'two')
+    fast.get_nowait()
+    fast.get_nowait()
+    image_events._broadcast(b'three')
+    assert slow.get_nowait() == RESET_EVENT
+    assert fast.get_nowait() == b'three'
+
+
+def test_connect_rejects_past_max_clients():
+    image_events = ImageEvents(max_clients=2)
+    first = image_events.connect()
+    assert image_events.connect() is not None
+    assert image_events.connect() is None
+    image_events.disconnect(first)
+    assert image_events.connect() is not None
+    assert len(image_events) == 2
+
+
+@pytest_asyncio.fixture
+async def client(monkeypatch):
+    image_events = ImageEvents(max_clients=1)
+    image_events.start(MemoryDatabase())
+    monkeypatch.setattr(app, 'image_events', image_events)
+    application = web.Application()
+    application.router.add_get(constants.EVENTS_ROUTE,
+                               app.image_events_handler)
+    async with TestClient(TestServer(application)) as test_client:
+        yield test_client, image_events
+    await image_events.stop()
+
+
+@pytest.mark.asyncio
+async def test_handler_rejects_past_max_clients(client):
+    test_client, _ = client
+    async with test_client.get(constants.EVENTS_ROUTE) as stream:
+        assert stream.status == 200
+        await stream.content.readuntil(b'\n\n')
+        busy = await test_client.get(constants.EVENTS_ROUTE)
+        assert busy.status == constants.HTTP_503_SERVICE_UNAVAILABLE
+        assert busy.headers['Retry-After'] == str(
+            constants.RETRY_AFTER_SECONDS)
+
+
+@pytest.mark.asyncio
+async def test_stop_ends_streams(client):
+    test_client, image_events = client
+    async with test_client.get(constants.EVENTS_ROUTE) as stream:
+        assert stream.headers['Content-Type'].startswith(
+            constants.CONTENT_TYPE_EVENT_STREAM)
+        assert await stream.content.readuntil(b'\n\n') == (
+            f'retry: {constants.EVENTS_RETRY_MS}\n\n'.encode())
+        image_events.publish({'op': constants.OP_DELETE, 'id': [1]})
+        op, _ = parse(await asyncio.wait_for(
+            stream.content.readuntil(b'\n\n'), 1))
+        assert op == constants.OP_DELETE
+        await image_events.stop()
+        assert await asyncio.wait_for(stream.content.read(), 1) == b''
+    assert len(image_events) == 0
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import threading
+
+import pytest
+import pytest_asyncio
+
+import constants
+from executor import (ExecutorBrokenError, ExecutorSaturatedError,
+                      ImageExecutor)
+
+
+@pytest_asyncio.fixture
+async def image_executor():
+    executor = ImageExecutor()
+    await executor.shutdown()
+    yield executor
+    await executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_saturated_executor_fails_fast(image_executor):
+    image_executor.start(constants.EXECUTOR_THREAD, workers=1, queue_size=1)
+    release = threading.Event()
+    running = [asyncio.create_task(image_executor.run(release.wait))
+               for _ in range(2)]
+    await asyncio.sleep(0)
+    with pytest.raises(ExecutorSaturatedError):
+        await image_executor.run(release.wait)
+    release.set()
+    assert await asyncio.gather(*running) == [True, True]
+    assert image_executor.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_broken_pool_is_rebuilt(image_executor):
+    image_executor.start(constants.EXECUTOR_PROCESS, workers=2,
+                         queue_size=2)
+    broken = image_executor.executor
+    results = await asyncio.gather(
+        image_executor.run(os._exit, 1), image_executor.run(os._exit, 1),
+        return_exceptions=True)
+    assert all(isinstance(result, ExecutorBrokenError)
+               for result in results)
+    assert image_executor.executor is not broken
+    assert image_executor.pending == 0
+    assert await image_executor.run(pow, 2, 10) == 1024
+
+
+@pytest.mark.asyncio
+async def test_shutdown_without_start(image_executor):
+    await image_executor.shutdown()
+    assert image_executor.executor is None
@@ -0,0 +1,103 @@
+import io
+import json
+import tarfile
+from datetime import datetime, timezone
+
+import pytest
+
+import constants
+import export
+from export import TarWriter, write_ndjson, write_snapshot
+from storage import Storage
+
+
+class FakeResponse:
+    """Collects what is written to a stream response."""
+
+    def __init__(self):
+        self.body = bytearray()
+        self.writes = 0
+
+    async def write(self, data):
+        self.body += data
+        self.writes += 1
+
+    def tar(self):
+        return tarfile.open(fileobj=io.BytesIO(bytes(self.body)))
+
+
+class ShrunkFile:
+    """Async file that ends before the size recorded for it."""
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    async def read(self, size):
+        return self.data.read(size)
+
+
+async def records(*items):
+    for item in items:
+        yield item
+
+
+@pytest.mark.asyncio
+async def test_tar_members_round_trip(tmp_path):
+    file_path = tmp_path / 'a.jpg'
+    file_path.write_bytes(b'x' * 1000)
+    response = FakeResponse()
+    tar = TarWriter(response, chunk_size=64)
+    long_name = 'images/' + 'n' * 150 + '.jpg'
+    assert await tar.add_file(long_name, str(file_path))
+    assert not await tar.add_file('images/b.jpg', str(tmp_path / 'b.jpg'))
+    await tar.close()
+    assert len(response.body) % tarfile.BLOCKSIZE == 0
+    with response.tar() as archive:
+        assert archive.getnames() == [long_name]
+        assert archive.extractfile(long_name).read() == b'x' * 1000
+
+
+@pytest.mark.asyncio
+async def test_shrunk_file_is_padded():
+    response = FakeResponse()
+    tar = TarWriter(response, chunk_size=4)
+    await tar.add_stream('a.bin', ShrunkFile(b'abc'), 10, 0)
+    await tar.close()
+    with response.tar() as archive:
+        assert archive.extractfile('a.bin').read() == b'abc' + bytes(7)
+
+
+@pytest.mark.asyncio
+async def test_ndjson_is_written_in_chunks():
+    upload_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    response = FakeResponse()
+    count = await write_ndjson(
+        response,
+        records(*({'id': i, 'upload_time': upload_time, 'name': 'фото'}
+                  for i in range(10))),
+        chunk_size=100)
+    assert count == 10
+    assert 1 < response.writes < 10
+    lines = [json.loads(line) for line in response.body.splitlines()]
+    assert [line['id'] for line in lines] == list(range(10))
+    assert lines[0]['upload_time'] == upload_time.isoformat()
+    assert lines[0]['name'] == 'фото'
+
+
+@pytest.mark.asyncio
+async def test_snapshot_skips_missing_files(monkeypatch, tmp_path):
+    image_storage = Storage(str(tmp_path))
+    monkeypatch.setattr(export, 'storage', image_storage)
+    stored = 'abcdef.jpg'
+    with open(await image_storage.prepare(stored), 'wb') as f:
+        f.write(b'image')
+    response = FakeResponse()
+    count = await write_snapshot(response, records(
+        {'id': 1, 'filename': stored}, {'id': 2, 'filename': 'fedcba.jpg'}))
+    assert count == 2
+    with response.tar() as archive:
+        assert archive.getnames() == [
+            f'{constants.IMAGES_DIR}/{stored}',
+            constants.EXPORT_METADATA_NAME]
+        metadata = archive.extractfile(constants.EXPORT_METADATA_NAME)
+        assert [json.loads(line)['id'] for line in metadata] == [1, 2]
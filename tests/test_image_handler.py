@@ -0,0 +1,62 @@
+import os
+
+import pytest
+from aiohttp.test_utils import make_mocked_request
+
+import app
+import constants
+import derivatives
+from storage import Storage
+
+FILENAME = 'abcdef.png'
+
+
+@pytest.fixture
+def variant(monkeypatch, tmp_path):
+    image_storage = Storage(str(tmp_path))
+    file_path = image_storage.path(FILENAME)
+    os.makedirs(os.path.dirname(file_path))
+    with open(file_path, 'wb') as f:
+        f.write(b'png')
+    monkeypatch.setattr(app, 'storage', image_storage)
+    monkeypatch.setattr(derivatives, 'VARIANT_FORMATS', ('webp',))
+    ready = {}
+
+    async def ensure_variant(filename, image_format, on_created):
+        return ready.get(image_format)
+
+    monkeypatch.setattr(app, 'ensure_variant', ensure_variant)
+    return ready
+
+
+async def get(accept):
+    request = make_mocked_request(
+        'GET', f'/images/{FILENAME}', headers={'Accept': accept},
+        match_info={'filename': FILENAME})
+    return await app.image_handler(request)
+
+
+@pytest.mark.asyncio
+async def test_original_is_cached_forever_without_negotiation(variant):
+    response = await get('image/png')
+    assert response.headers['Cache-Control'] == constants.FILE_CACHE_CONTROL
+    assert 'Vary' not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_original_is_cached_briefly_while_variant_is_pending(variant):
+    response = await get('image/webp,*/*')
+    assert response.headers['Cache-Control'] == (
+        constants.VARIANT_PENDING_CACHE_CONTROL)
+    assert response.headers['Vary'] == 'Accept'
+
+
+@pytest.mark.asyncio
+async def test_variant_is_cached_forever(variant, tmp_path):
+    variant_path = tmp_path / 'variant.webp'
+    variant_path.write_bytes(b'webp')
+    variant['webp'] = str(variant_path)
+    response = await get('image/webp,*/*')
+    assert response.headers['Cache-Control'] == constants.FILE_CACHE_CONTROL
+    assert response.headers['Content-Type'] == 'image/webp'
+    assert response.headers['Vary'] == 'Accept'
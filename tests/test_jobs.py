@@ -0,0 +1,187 @@
+import asyncio
+
+import pytest
+
+import constants
+from benchmarks.memory_db import MemoryDatabase
+from jobs import JobQueue
+
+KIND = 'test'
+
+
+async def insert(db, name='a.jpg'):
+    return await db.insert_image(name, name, 10, 'jpg', jobs=[KIND])
+
+
+def status(db, image_id):
+    return db._rows[image_id]['processing_status']
+
+
+async def wait_for_status(db, image_id, expected):
+    for _ in range(200):
+        if status(db, image_id) == expected:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(status(db, image_id))
+
+
+@pytest.mark.asyncio
+async def test_insert_enqueues_jobs_and_marks_image_pending():
+    db = MemoryDatabase()
+    image_id = await insert(db)
+    plain_id = await db.insert_image('b.jpg', 'b.jpg', 10, 'jpg')
+    assert status(db, image_id) == constants.STATUS_PENDING
+    assert status(db, plain_id) == constants.STATUS_READY
+    assert await db.claim_jobs(10) == [(1, KIND, 1, image_id, 'a.jpg')]
+
+
+@pytest.mark.asyncio
+async def test_claimed_job_is_leased():
+    db = MemoryDatabase()
+    await insert(db)
+    assert len(await db.claim_jobs(10, lease=60)) == 1
+    assert await db.claim_jobs(10) == []
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_claimed_again():
+    db = MemoryDatabase()
+    await insert(db)
+    await db.claim_jobs(10, lease=0)
+    [(_, _, attempt, _, _)] = await db.claim_jobs(10)
+    assert attempt == 2
+
+
+@pytest.mark.asyncio
+async def test_claim_respects_limit():
+    db = MemoryDatabase()
+    for name in ('a.jpg', 'b.jpg', 'c.jpg'):
+        await insert(db, name)
+    assert len(await db.claim_jobs(2)) == 2
+    assert len(await db.claim_jobs(2)) == 1
+
+
+@pytest.mark.asyncio
+async def test_complete_job_marks_image_ready_after_last_job():
+    db = MemoryDatabase()
+    image_id = await db.insert_image('a.jpg', 'a.jpg', 10, 'jpg',
+                                     jobs=[KIND, 'other'])
+    first, second = await db.claim_jobs(10)
+    await db.complete_job(first[0])
+    assert status(db, image_id) == constants.STATUS_PENDING
+    await db.complete_job(second[0])
+    assert status(db, image_id) == constants.STATUS_READY
+
+
+@pytest.mark.asyncio
+async def test_failed_job_is_retried_after_delay():
+    db = MemoryDatabase()
+    image_id = await insert(db)
+    [(job_id, *_)] = await db.claim_jobs(10)
+    await db.fail_job(job_id, 'boom', delay=60, max_attempts=2)
+    assert status(db, image_id) == constants.STATUS_PENDING
+    assert await db.claim_jobs(10) == []
+    db._jobs[job_id]['run_after'] = 0
+    assert [job[2] for job in await db.claim_jobs(10)] == [2]
+
+
+@pytest.mark.asyncio
+async def test_job_out_of_attempts_marks_image_failed():
+    db = MemoryDatabase()
+    image_id = await insert(db)
+    [(job_id, *_)] = await db.claim_jobs(10)
+    await db.fail_job(job_id, 'boom', delay=0, max_attempts=1)
+    assert status(db, image_id) == constants.STATUS_FAILED
+    assert db._jobs[job_id]['last_error'] == 'boom'
+    assert await db.claim_jobs(10) == []
+
+
+@pytest.mark.asyncio
+async def test_delete_drops_jobs_of_the_image():
+    db = MemoryDatabase()
+    image_id = await insert(db)
+    await db.delete_image(image_id)
+    assert await db.claim_jobs(10) == []
+
+
+@pytest.mark.asyncio
+async def test_queue_runs_jobs_until_ready():
+    db = MemoryDatabase()
+    queue = JobQueue(concurrency=2, poll_interval=0.01)
+    done = []
+
+    async def handler(filename):
+        done.append(filename)
+
+    queue.register(KIND, handler)
+    image_id = await insert(db)
+    queue.start(db)
+    try:
+        await wait_for_status(db, image_id, constants.STATUS_READY)
+    finally:
+        await queue.stop()
+    assert done == ['a.jpg']
+    assert db._jobs == {}
+
+
+@pytest.mark.asyncio
+async def test_queue_retries_with_backoff(monkeypatch):
+    monkeypatch.setattr(constants, 'JOB_RETRY_DELAY', 0.01)
+    db = MemoryDatabase()
+    queue = JobQueue(concurrency=2, poll_interval=0.01)
+    delays = []
+    fail_job = db.fail_job
+
+    async def record_delay(job_id, error, delay, *args):
+        delays.append(delay)
+        await fail_job(job_id, error, delay, *args)
+
+    async def handler(filename):
+        if len(delays) < 2:
+            raise OSError('busy')
+
+    monkeypatch.setattr(db, 'fail_job', record_delay)
+    queue.register(KIND, handler)
+    image_id = await insert(db)
+    queue.start(db)
+    try:
+        await wait_for_status(db, image_id, constants.STATUS_READY)
+    finally:
+        await queue.stop()
+    assert delays == [0.01, 0.02]
+
+
+@pytest.mark.asyncio
+async def test_queue_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(constants, 'JOB_RETRY_DELAY', 0)
+    db = MemoryDatabase()
+    queue = JobQueue(concurrency=2, poll_interval=0.01)
+    attempts = []
+
+    async def handler(filename):
+        attempts.append(filename)
+        raise OSError('broken')
+
+    queue.register(KIND, handler)
+    image_id = await insert(db)
+    queue.start(db)
+    try:
+        await wait_for_status(db, image_id, constants.STATUS_FAILED)
+    finally:
+        await queue.stop()
+    assert len(attempts) == constants.JOB_MAX_ATTEMPTS
+
+
+@pytest.mark.asyncio
+async def test_unknown_job_kind_fails():
+    db = MemoryDatabase()
+    queue = JobQueue(concurrency=1, poll_interval=0.01)
+    queue.db = db
+    image_id = await insert(db)
+    [(job_id, *_)] = await db.claim_jobs(10)
+    await queue._semaphore.acquire()
+    await queue._run(job_id, KIND, 1, image_id, 'a.jpg')
+    assert db._jobs[job_id]['last_error'] == constants.UNKNOWN_JOB.format(
+        kind=KIND)
+    assert db._jobs[job_id]['status'] == constants.STATUS_PENDING
+    assert not queue._semaphore.locked()
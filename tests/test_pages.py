@@ -0,0 +1,55 @@
+import pytest
+import pytest_asyncio
+from aiohttp.test_utils import make_mocked_request
+
+import constants
+from pages import PageCache, accepted_tokens
+
+
+@pytest_asyncio.fixture
+async def page(tmp_path):
+    (tmp_path / 'index.html').write_text('<p>' + 'gallery ' * 200 + '</p>')
+    return await PageCache(str(tmp_path)).get('index.html')
+
+
+def respond(page, **headers):
+    request = make_mocked_request('GET', '/', headers=headers)
+    return PageCache.respond(request, page)
+
+
+def test_accepted_tokens_drop_refused_values():
+    assert accepted_tokens('gzip;q=0, br, Deflate;q=0.5') == {'br', 'deflate'}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('accept_encoding, encoding', [
+    ('', None),
+    ('gzip', 'gzip'),
+    ('gzip, br', 'br'),
+    ('br;q=0, gzip', 'gzip'),
+])
+async def test_each_encoding_has_its_own_etag(page, accept_encoding,
+                                              encoding):
+    response = respond(page, **{'Accept-Encoding': accept_encoding})
+    assert response.headers.get('Content-Encoding') == encoding
+    assert response.headers['ETag'] == page.etag_for(encoding)
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+
+@pytest.mark.asyncio
+async def test_etags_differ_between_encodings(page):
+    tags = {page.etag_for(encoding) for encoding in (None, 'gzip', 'br')}
+    assert len(tags) == 3
+
+
+@pytest.mark.asyncio
+async def test_not_modified_only_for_the_same_encoding(page):
+    gzip_tag = page.etag_for('gzip')
+    response = respond(page, **{'Accept-Encoding': 'gzip',
+                                'If-None-Match': gzip_tag})
+    assert response.status == constants.HTTP_304_NOT_MODIFIED
+    assert 'Content-Encoding' not in response.headers
+    response = respond(page, **{'Accept-Encoding': 'br',
+                                'If-None-Match': gzip_tag})
+    assert response.status == constants.HTTP_200_OK
+    assert response.headers['Content-Encoding'] == 'br'
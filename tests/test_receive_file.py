@@ -0,0 +1,157 @@
+import io
+import os
+
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+
+import app
+import constants
+import utils
+from benchmarks.memory_db import MemoryDatabase
+from executor import ImageExecutor
+from storage import Storage
+from utils import UploadError, receive_file, save_file
+
+ALLOWED = ('png', 'jpg')
+
+
+def png(size=(32, 24)):
+    buffer = io.BytesIO()
+    noise = os.urandom(size[0] * size[1] * 3)
+    Image.frombytes('RGB', size, noise).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class FakeField:
+    """Multipart field returning data in chunks of the requested size."""
+
+    def __init__(self, data, content_length=None, fail_after=None):
+        self.data = data
+        self.offset = 0
+        self.fail_after = fail_after
+        self.headers = ({} if content_length is None
+                        else {'Content-Length': str(content_length)})
+
+    async def read_chunk(self, size):
+        if self.fail_after is not None and self.offset >= self.fail_after:
+            raise ConnectionResetError('client went away')
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+
+
+def leftovers(directory):
+    return [name for name in os.listdir(directory)
+            if name.endswith(constants.TEMP_FILE_SUFFIX)]
+
+
+@pytest_asyncio.fixture
+async def executor():
+    image_executor = ImageExecutor()
+    await image_executor.shutdown()
+    image_executor.start(constants.EXECUTOR_THREAD, workers=1, queue_size=4)
+    yield image_executor
+    await image_executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_receive_file_describes_the_image(executor, tmp_path):
+    data = png()
+    upload = await receive_file(FakeField(data), str(tmp_path), ALLOWED,
+                                len(data), chunk_size=64)
+    assert upload.file_extension == 'png'
+    assert upload.size == len(data)
+    assert (upload.width, upload.height) == (32, 24)
+    assert upload.temp_path.endswith(constants.TEMP_FILE_SUFFIX)
+    with open(upload.temp_path, 'rb') as f:
+        assert f.read() == data
+
+
+@pytest.mark.asyncio
+async def test_size_limit_applies_to_received_bytes(tmp_path):
+    data = png()
+    field = FakeField(data, content_length=10)
+    with pytest.raises(UploadError) as error:
+        await receive_file(field, str(tmp_path), ALLOWED, len(data) - 1,
+                           chunk_size=64)
+    assert error.value.status == constants.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert leftovers(tmp_path) == []
+
+
+@pytest.mark.asyncio
+async def test_unknown_type_is_rejected_before_writing(tmp_path):
+    with pytest.raises(UploadError) as error:
+        await receive_file(FakeField(b'plain text' * 100), str(tmp_path),
+                           ALLOWED, 10 ** 6, chunk_size=64)
+    assert error.value.status == constants.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.asyncio
+async def test_undecodable_image_removes_temp_file(executor, tmp_path):
+    data = png()[:100]
+    with pytest.raises(UploadError) as error:
+        await receive_file(FakeField(data), str(tmp_path), ALLOWED,
+                           len(data), chunk_size=64)
+    assert error.value.status == constants.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    assert leftovers(tmp_path) == []
+
+
+@pytest.mark.asyncio
+async def test_read_error_removes_temp_file(tmp_path):
+    data = png()
+    with pytest.raises(ConnectionResetError):
+        await receive_file(FakeField(data, fail_after=128), str(tmp_path),
+                           ALLOWED, len(data), chunk_size=64)
+    assert leftovers(tmp_path) == []
+
+
+@pytest.mark.asyncio
+async def test_save_file_renames_temp_file_into_place(executor, monkeypatch,
+                                                      tmp_path):
+    image_storage = Storage(str(tmp_path))
+    monkeypatch.setattr(utils, 'storage', image_storage)
+    data = png()
+    upload = await receive_file(FakeField(data), str(tmp_path), ALLOWED,
+                                len(data), chunk_size=64)
+    inode = os.stat(upload.temp_path).st_ino
+    filename = await save_file(upload)
+    file_path = image_storage.path(filename)
+    assert filename.endswith('.png')
+    assert os.stat(file_path).st_ino == inode
+    assert not os.path.exists(upload.temp_path)
+    assert leftovers(tmp_path) == []
+
+
+@pytest_asyncio.fixture
+async def client(executor, monkeypatch, tmp_path):
+    monkeypatch.setattr(constants, 'IMAGES_DIR', str(tmp_path))
+    monkeypatch.setattr(utils, 'storage', Storage(str(tmp_path)))
+    monkeypatch.setattr(app, 'db', MemoryDatabase())
+    application = web.Application()
+    application.router.add_post('/upload', app.post_handler)
+    async with TestClient(TestServer(application)) as test_client:
+        yield test_client
+
+
+@pytest.mark.asyncio
+async def test_chunked_upload_over_limit_is_rejected(client, monkeypatch,
+                                                     tmp_path):
+    data = png((256, 256))
+    monkeypatch.setattr(constants, 'MAX_FILE_SIZE', len(data) // 2)
+
+    async def body():
+        for offset in range(0, len(data), 1024):
+            yield data[offset:offset + 1024]
+
+    with aiohttp.MultipartWriter('form-data') as form:
+        part = form.append(body())
+        part.set_content_disposition('form-data', name='file',
+                                     filename='big.png')
+    response = await client.post('/upload', data=form)
+    assert response.status == constants.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert leftovers(tmp_path) == []
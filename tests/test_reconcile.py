@@ -0,0 +1,86 @@
+import fcntl
+import os
+import time
+
+import pytest
+import pytest_asyncio
+
+import constants
+from benchmarks.memory_db import MemoryDatabase
+from reconcile import Reconciler, stored_name
+from storage import Storage
+
+OLD = time.time() - 3600
+
+
+def write(file_path, mtime=OLD):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'wb') as f:
+        f.write(b'image')
+    os.utime(file_path, (mtime, mtime))
+
+
+@pytest_asyncio.fixture
+async def library(tmp_path):
+    image_storage = Storage(str(tmp_path))
+    db = MemoryDatabase()
+    ids = {}
+    for filename in ('aaaa01.jpg', 'cccc03.jpg'):
+        ids[filename] = await db.insert_image(filename, filename, 5, 'jpg')
+    # A row without a file, shared by two uploads.
+    for _ in range(2):
+        ids['bbbb02.jpg'] = await db.insert_image(
+            'bbbb02.jpg', 'bbbb02.jpg', 5, 'jpg', 'hash')
+    write(image_storage.path('aaaa01.jpg'))
+    write(image_storage.flat_path('cccc03.jpg'))
+    write(image_storage.path('eeee05.jpg'))
+    write(image_storage.flat_path('ffff06.jpg'))
+    write(image_storage.path('abab07.jpg'), mtime=time.time())
+    reconciler = Reconciler(db, image_storage, rate=0, grace=60,
+                            batch_size=2)
+    return reconciler, db, image_storage, ids
+
+
+@pytest.mark.asyncio
+async def test_report_only(library):
+    reconciler, db, image_storage, ids = library
+    report = await reconciler.run()
+    assert (report.files, report.orphan_files, report.recent_files,
+            report.missing_files) == (5, 2, 1, 1)
+    assert (report.removed_files, report.removed_rows) == (0, 0)
+    assert os.path.exists(image_storage.path('eeee05.jpg'))
+    assert await db.get_filename(ids['bbbb02.jpg']) == 'bbbb02.jpg'
+
+
+@pytest.mark.asyncio
+async def test_delete_removes_orphans(library):
+    reconciler, db, image_storage, ids = library
+    report = await reconciler.run(delete=True)
+    assert (report.removed_files, report.removed_rows) == (2, 1)
+    assert not os.path.exists(image_storage.path('eeee05.jpg'))
+    assert not os.path.exists(image_storage.flat_path('ffff06.jpg'))
+    assert os.path.exists(image_storage.path('abab07.jpg'))
+    assert os.path.exists(image_storage.flat_path('cccc03.jpg'))
+    # Other references must not keep a row whose file is gone.
+    assert await db.get_filename(ids['bbbb02.jpg']) is None
+    assert await db.get_filename(ids['aaaa01.jpg']) == 'aaaa01.jpg'
+
+
+@pytest.mark.asyncio
+async def test_variants_belong_to_their_image(library, monkeypatch):
+    monkeypatch.setattr(constants, 'VARIANT_FORMATS', ('webp',))
+    reconciler, db, image_storage, ids = library
+    write(image_storage.path('aaaa01.jpg.webp'))
+    write(image_storage.path('bbbb02.jpg.webp'))
+    report = await reconciler.run()
+    assert (report.orphan_files, report.missing_files) == (2, 1)
+    assert stored_name('aaaa01.jpg.webp') == 'aaaa01.jpg'
+
+
+@pytest.mark.asyncio
+async def test_concurrent_run_is_skipped(library):
+    reconciler, db, image_storage, ids = library
+    lock_path = os.path.join(image_storage.root, constants.RECONCILE_LOCK)
+    with open(lock_path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert await reconciler.run() is None
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+
+import pytest
+
+import constants
+import server
+
+
+@pytest.mark.parametrize('listener, workers, pool_size', [
+    (False, 4, 10),
+    (True, 4, 9),
+    (True, 3, 12),
+    (True, 100, 1),
+])
+def test_pool_size_per_worker(monkeypatch, listener, workers, pool_size):
+    monkeypatch.setattr(constants, 'DB_CONNECTION_BUDGET', 40)
+    monkeypatch.setattr(constants, 'DB_LISTENER', listener)
+    assert server.pool_size_per_worker(workers) == pool_size
+
+
+@pytest.mark.parametrize('workers, image_workers', [
+    (1, 8),
+    (4, 2),
+    (3, 2),
+    (16, 1),
+])
+def test_image_workers_per_worker(monkeypatch, workers, image_workers):
+    monkeypatch.setattr(constants, 'IMAGE_WORKERS', 8)
+    assert server.image_workers_per_worker(workers) == image_workers
+
+
+class FakeProcess:
+    """Worker process that never becomes ready."""
+
+    def __init__(self, alive, **kwargs):
+        self.alive = alive
+        self.exitcode = None if alive else 1
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        return self.alive
+
+
+class FakeContext:
+    def __init__(self, alive):
+        self.alive = alive
+
+    def Event(self):
+        return threading.Event()
+
+    def Process(self, **kwargs):
+        return FakeProcess(self.alive, **kwargs)
+
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    monkeypatch.setattr(constants, 'WORKER_READY_TIMEOUT', 60)
+    return server.Supervisor(1, '127.0.0.1', 0)
+
+
+def test_spawn_returns_when_worker_dies(supervisor):
+    supervisor.context = FakeContext(alive=False)
+    started = time.monotonic()
+    process = supervisor.spawn(0)
+    assert process.exitcode == 1
+    assert time.monotonic() - started < 5
+
+
+def test_spawn_returns_when_asked_to_stop(supervisor):
+    supervisor.context = FakeContext(alive=True)
+    threading.Timer(0.2, supervisor._request_stop, (None, None)).start()
+    started = time.monotonic()
+    supervisor.spawn(0)
+    assert time.monotonic() - started < 5
+
+
+@pytest.mark.parametrize('listener, budget, limit', [
+    (False, 40, 40),
+    (True, 40, 20),
+    (True, 5, 2),
+    (True, 1, 1),
+])
+def test_max_workers(monkeypatch, listener, budget, limit):
+    monkeypatch.setattr(constants, 'DB_CONNECTION_BUDGET', budget)
+    monkeypatch.setattr(constants, 'DB_LISTENER', listener)
+    assert server.max_workers() == limit
+    if budget >= 2:
+        workers = limit
+        per_worker = server.pool_size_per_worker(workers)
+        assert workers * (per_worker + listener) <= budget
+
+
+def test_main_caps_workers_to_budget(monkeypatch):
+    started = []
+
+    class FakeSupervisor:
+        def __init__(self, workers, host, port):
+            started.append(workers)
+
+        def run(self):
+            pass
+
+    monkeypatch.setattr(constants, 'DB_CONNECTION_BUDGET', 10)
+    monkeypatch.setattr(constants, 'DB_LISTENER', True)
+    monkeypatch.setattr(server, 'Supervisor', FakeSupervisor)
+    monkeypatch.setattr(server, 'setup_logging', lambda: None)
+    monkeypatch.setattr('sys.argv', ['server.py', '--workers', '16'])
+    monkeypatch.setenv('DB_POOL_MAX_SIZE', '')
+    monkeypatch.setenv('IMAGE_WORKERS', '')
+    assert server.main() == 0
+    assert started == [5]
+    assert os.environ['DB_POOL_MAX_SIZE'] == '1'
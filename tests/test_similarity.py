@@ -0,0 +1,146 @@
+import pytest
+
+import constants
+from benchmarks.memory_db import MemoryDatabase
+from similarity import SimilarityIndex
+from utils import UploadedFile, UploadError
+
+# Hashes are stored as signed 64-bit integers.
+HASH = -0x0123456789abcdf0
+NEAR = HASH ^ 0b101
+FAR = ~HASH
+
+
+def test_search_orders_by_distance():
+    index = SimilarityIndex(block_size=2)
+    index.add([(1, FAR), (2, NEAR), (3, HASH)])
+    assert len(index) == 3
+    assert index.search(HASH, 4, 10) == [(3, 0), (2, 2)]
+    assert index.search(HASH, 4, 1) == [(3, 0)]
+    assert index.search(HASH, 4, 10, exclude=3) == [(2, 2)]
+    assert index.search(HASH, 64, 10)[-1] == (1, 64)
+
+
+def test_remove():
+    index = SimilarityIndex(block_size=2)
+    index.add([(1, HASH), (2, HASH), (3, HASH)])
+    index.remove([2, 3])
+    assert index.search(HASH, 0, 10) == [(1, 0)]
+
+
+async def add_image(db, phash, content_hash=None):
+    return await db.insert_image(f'{content_hash}.jpg', 'a.jpg', 1024, 'jpg',
+                                 content_hash, phash=phash)
+
+
+@pytest.mark.asyncio
+async def test_refresh_pulls_new_rows():
+    db = MemoryDatabase()
+    index = SimilarityIndex(refresh_interval=0)
+    await add_image(db, HASH)
+    await index.load(db)
+    image_id = await add_image(db, NEAR)
+    await add_image(db, None)
+    await index.refresh(db)
+    assert index.search(NEAR, 0, 10) == [(image_id, 0)]
+    assert len(index) == 2
+
+
+@pytest.mark.asyncio
+async def test_refresh_pulls_hashes_of_updated_rows():
+    db = MemoryDatabase()
+    index = SimilarityIndex(refresh_interval=0)
+    first = await add_image(db, None)
+    second = await add_image(db, FAR)
+    await index.load(db)
+    # A backfill writes hashes to rows the index has already passed.
+    db._rows[first]['phash'] = HASH
+    db._rows[second]['phash'] = NEAR
+    index.publish({'op': constants.OP_UPDATE, 'id': [first, second]})
+    await index.refresh(db)
+    assert index.search(HASH, 4, 10) == [(first, 0), (second, 2)]
+    assert len(index) == 2
+
+
+@pytest.mark.asyncio
+async def test_reset_reloads_the_index():
+    db = MemoryDatabase()
+    index = SimilarityIndex(refresh_interval=0)
+    image_id = await add_image(db, FAR)
+    await index.load(db)
+    db._rows[image_id]['phash'] = HASH
+    index.publish({'op': constants.OP_RESET, 'id': None})
+    await index.refresh(db)
+    assert index.search(HASH, 0, 10) == [(image_id, 0)]
+    assert len(index) == 1
+
+
+@pytest.mark.asyncio
+async def test_delete_from_another_worker_is_dropped():
+    db = MemoryDatabase()
+    index = SimilarityIndex(refresh_interval=0)
+    image_id = await add_image(db, HASH)
+    await index.load(db)
+    db.subscribe(index.publish)
+    await db.delete_image(image_id)
+    assert index.search(HASH, 0, 10) == []
+
+
+@pytest.fixture
+def app_db(monkeypatch):
+    import app
+    db = MemoryDatabase()
+    monkeypatch.setattr(app, 'db', db)
+    monkeypatch.setattr(app, 'similarity_index',
+                        SimilarityIndex(refresh_interval=0))
+    monkeypatch.setattr(constants, 'PHASH_REJECT_DISTANCE', 4)
+    monkeypatch.setattr(constants, 'CONTENT_ADDRESSED_STORAGE', True)
+    return db
+
+
+def upload(content_hash, phash):
+    return UploadedFile(temp_path='upload.tmp', file_extension='jpg',
+                        size=1024, content_hash=content_hash, phash=phash)
+
+
+@pytest.mark.asyncio
+async def test_near_duplicate_is_rejected(app_db):
+    from app import reject_near_duplicate
+    image_id = await add_image(app_db, HASH, 'stored')
+    with pytest.raises(UploadError) as error:
+        await reject_near_duplicate(upload('other', NEAR))
+    assert error.value.status == constants.HTTP_409_CONFLICT
+    assert str(image_id) in error.value.text
+    await reject_near_duplicate(upload('other', FAR))
+
+
+@pytest.mark.asyncio
+async def test_exact_copy_reaches_deduplication(app_db):
+    from app import reject_near_duplicate
+    await add_image(app_db, HASH, 'stored')
+    await reject_near_duplicate(upload('stored', HASH))
+
+
+@pytest.mark.asyncio
+async def test_deleted_matches_are_replaced(app_db):
+    import app
+    first = await add_image(app_db, HASH, 'first')
+    second = await add_image(app_db, NEAR, 'second')
+    third = await add_image(app_db, NEAR ^ 0b1000, 'third')
+    await app.similarity_index.load(app_db)
+    # Deleted without a notification, as if it had not arrived yet.
+    del app_db._rows[first]
+    matches = await app.find_similar(HASH, 4, 2)
+    assert [match['id'] for match in matches] == [second, third]
+
+
+@pytest.mark.asyncio
+async def test_deleted_match_does_not_hide_a_near_duplicate(app_db):
+    import app
+    first = await add_image(app_db, HASH, 'first')
+    second = await add_image(app_db, NEAR, 'second')
+    await app.similarity_index.load(app_db)
+    del app_db._rows[first]
+    with pytest.raises(UploadError) as error:
+        await app.reject_near_duplicate(upload('other', HASH))
+    assert str(second) in error.value.text
@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+import constants
+from storage import Storage
+
+
+def write(path, data=b'data'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return Storage(str(tmp_path))
+
+
+@pytest.mark.parametrize('filename, shard', [
+    ('abcdef.jpg', os.path.join('ab', 'cd')),
+    ('abcdef.jpg.webp', os.path.join('ab', 'cd')),
+    ('0123_w320.png', os.path.join('01', '23')),
+    ('ABCDEF.jpg', None),
+    ('abc.jpg', None),
+    ('abcxyz.jpg', None),
+    ('ab', None),
+])
+def test_shard(filename, shard):
+    assert Storage('images').shard(filename) == shard
+
+
+def test_shard_uses_levels_and_width():
+    assert Storage('images', levels=3, width=1).shard('abcd') == (
+        os.path.join('a', 'b', 'c'))
+
+
+def test_path(storage):
+    assert storage.path('abcdef.jpg') == os.path.join(
+        storage.root, 'ab', 'cd', 'abcdef.jpg')
+    assert storage.path('photo.jpg') == os.path.join(storage.root,
+                                                     'photo.jpg')
+
+
+@pytest.mark.asyncio
+async def test_locate_prefers_sharded_copy(storage):
+    write(storage.path('abcdef.jpg'))
+    write(storage.flat_path('abcdef.jpg'))
+    assert await storage.locate('abcdef.jpg') == storage.path('abcdef.jpg')
+
+
+@pytest.mark.asyncio
+async def test_locate_falls_back_to_flat_layout(storage):
+    write(storage.flat_path('abcdef.jpg'))
+    assert await storage.locate('abcdef.jpg') == (
+        storage.flat_path('abcdef.jpg'))
+    assert await storage.exists('abcdef.jpg')
+
+
+@pytest.mark.asyncio
+async def test_locate_miss_resolves_to_sharded_path(storage):
+    assert await storage.locate('abcdef.jpg') == storage.path('abcdef.jpg')
+    assert not await storage.exists('abcdef.jpg')
+
+
+@pytest.mark.asyncio
+async def test_store_and_remove(storage, tmp_path):
+    temp_path = tmp_path / 'upload.part'
+    temp_path.write_bytes(b'image')
+    file_path = await storage.store(str(temp_path), 'abcdef.jpg')
+    assert file_path == storage.path('abcdef.jpg')
+    assert read(file_path) == b'image'
+    assert not temp_path.exists()
+    write(storage.flat_path('abcdef.jpg'))
+    await storage.remove('abcdef.jpg')
+    assert not await storage.exists('abcdef.jpg')
+
+
+def test_url_has_no_shard():
+    assert Storage('images').url('abcdef.jpg', 'http://host') == (
+        'http://host/images/abcdef.jpg')
+
+
+@pytest.mark.asyncio
+async def test_migrate_moves_flat_files(storage):
+    names = [f'{index:04x}beef.jpg' for index in range(5)]
+    for name in names:
+        write(storage.flat_path(name), name.encode())
+    assert await storage.migrate(batch_size=2, pause=0) == 5
+    for name in names:
+        assert read(storage.path(name)) == name.encode()
+        assert not os.path.exists(storage.flat_path(name))
+
+
+@pytest.mark.asyncio
+async def test_migrate_keeps_newer_sharded_copy(storage):
+    write(storage.flat_path('abcdef.jpg'), b'old')
+    write(storage.path('abcdef.jpg'), b'new')
+    assert await storage.migrate(pause=0) == 1
+    assert read(storage.path('abcdef.jpg')) == b'new'
+    assert not os.path.exists(storage.flat_path('abcdef.jpg'))
+
+
+@pytest.mark.asyncio
+async def test_migrate_skips_unsharded_and_temp_files(storage):
+    temp_name = f'abcdef.jpg{constants.TEMP_FILE_SUFFIX}'
+    for name in ('photo.jpg', temp_name):
+        write(storage.flat_path(name))
+    assert await storage.migrate(pause=0) == 0
+    assert os.path.exists(storage.flat_path('photo.jpg'))
+    assert os.path.exists(storage.flat_path(temp_name))
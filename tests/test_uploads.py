@@ -0,0 +1,142 @@
+import asyncio
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from uploads import SessionBusyError, SessionLimitError, UploadSessions
+
+
+async def stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    return UploadSessions(str(tmp_path))
+
+
+@pytest.mark.asyncio
+async def test_create_preallocates_the_file(sessions):
+    session = await sessions.create(10, 'photo.jpg')
+    assert os.path.getsize(sessions.data_path(session.id)) == 10
+    assert await sessions.load(session.id) == session
+
+
+@pytest.mark.asyncio
+async def test_upload_resumes_at_the_saved_offset(sessions):
+    session = await sessions.create(10, 'photo.jpg')
+    assert await sessions.write(session, stream(b'abc', b'de')) == 5
+    session = await sessions.load(session.id)
+    assert session.offset == 5
+    assert await sessions.write(session, stream(b'fghij')) == 10
+    with open(sessions.data_path(session.id), 'rb') as f:
+        assert f.read() == b'abcdefghij'
+
+
+@pytest.mark.asyncio
+async def test_write_past_the_size_keeps_the_offset(sessions):
+    session = await sessions.create(4, 'photo.jpg')
+    with pytest.raises(ValueError):
+        await sessions.write(session, stream(b'abc', b'de'))
+    assert (await sessions.load(session.id)).offset == 3
+
+
+@pytest.mark.asyncio
+async def test_unknown_session_leaves_no_state(sessions, tmp_path):
+    state = dict(vars(sessions))
+    for index in range(100):
+        async with sessions.locked(f'missing{index}') as session:
+            assert session is None
+    assert vars(sessions) == state
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.asyncio
+async def test_concurrent_request_is_rejected(sessions):
+    session = await sessions.create(4, 'photo.jpg')
+    async with sessions.locked(session.id) as locked:
+        assert locked == session
+        with pytest.raises(SessionBusyError):
+            async with sessions.locked(session.id):
+                pass
+    async with sessions.locked(session.id) as locked:
+        assert locked == session
+
+
+@pytest.mark.asyncio
+async def test_lock_is_shared_between_processes(sessions):
+    session = await sessions.create(4, 'photo.jpg')
+    holder = subprocess.Popen(
+        [sys.executable, '-c', textwrap.dedent('''
+            import fcntl, os, sys
+            fd = os.open(sys.argv[1], os.O_RDONLY)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            print('locked', flush=True)
+            sys.stdin.read()
+        '''), sessions.data_path(session.id)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == 'locked'
+        with pytest.raises(SessionBusyError):
+            async with sessions.locked(session.id):
+                pass
+    finally:
+        holder.communicate('')
+    async with sessions.locked(session.id) as locked:
+        assert locked == session
+
+
+@pytest.mark.asyncio
+async def test_sweep_removes_only_idle_unlocked_sessions(sessions):
+    fresh = await sessions.create(4, 'fresh.jpg')
+    idle = await sessions.create(4, 'idle.jpg')
+    busy = await sessions.create(4, 'busy.jpg')
+    for session in (idle, busy):
+        session.updated -= 100
+        await sessions.save(session)
+    async with sessions.locked(busy.id):
+        assert await sessions.sweep(ttl=50) == 1
+    assert await sessions.load(fresh.id) == fresh
+    assert await sessions.load(idle.id) is None
+    assert not os.path.exists(sessions.data_path(idle.id))
+    assert await sessions.load(busy.id) == busy
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_capped_per_client(tmp_path):
+    sessions = UploadSessions(str(tmp_path), max_sessions=10,
+                              max_per_client=2)
+    first = await sessions.create(10, 'a.jpg', '10.0.0.1')
+    await sessions.create(10, 'b.jpg', '10.0.0.1')
+    with pytest.raises(SessionLimitError):
+        await sessions.create(10 ** 12, 'c.jpg', '10.0.0.1')
+    await sessions.create(10, 'c.jpg', '10.0.0.2')
+    await sessions.delete(first.id)
+    await sessions.create(10, 'd.jpg', '10.0.0.1')
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_capped_in_total(tmp_path):
+    sessions = UploadSessions(str(tmp_path), max_sessions=2,
+                              max_per_client=0)
+    await sessions.create(10, 'a.jpg', '10.0.0.1')
+    await sessions.create(10, 'b.jpg', '10.0.0.2')
+    with pytest.raises(SessionLimitError):
+        await sessions.create(10, 'c.jpg', '10.0.0.3')
+    assert len([name for name in os.listdir(tmp_path)
+                if name.endswith('.upload')]) == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_creates_respect_the_cap(tmp_path):
+    sessions = UploadSessions(str(tmp_path), max_sessions=3,
+                              max_per_client=0)
+    results = await asyncio.gather(
+        *(sessions.create(10, f'{index}.jpg') for index in range(8)),
+        return_exceptions=True)
+    assert len([result for result in results
+                if isinstance(result, SessionLimitError)]) == 5
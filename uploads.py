@@ -0,0 +1,321 @@
+import asyncio
+import fcntl
+import json
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator, Optional
+
+import aiofiles
+import aiofiles.os
+from loguru import logger
+
+import constants
+
+
+class SessionBusyError(RuntimeError):
+    """Raised when another request holds the lock of an upload session."""
+
+
+class SessionLimitError(RuntimeError):
+    """Raised when too many upload sessions are open to create another."""
+
+
+@dataclass
+class UploadSession:
+    """State of a resumable upload, stored in a JSON file next to its data.
+    """
+    id: str
+    size: int
+    filename: str
+    offset: int = 0
+    updated: float = 0.0
+    client: str = ''
+
+
+class UploadSessions:
+    """Resumable uploads written chunk by chunk into preallocated files.
+
+    Session state lives on disk, so any worker process can continue an
+    upload started by another. Requests for one session are serialized
+    across processes by a lock on its data file; a concurrent request gets
+    a conflict instead of waiting.
+    """
+
+    def __init__(self, uploads_dir: str = constants.UPLOADS_DIR,
+                 max_sessions: int = constants.UPLOAD_SESSIONS_MAX,
+                 max_per_client: int = constants.UPLOAD_SESSIONS_PER_CLIENT):
+        """Initialize the store.
+
+        Args:
+            uploads_dir: The directory for session files. It must be on the
+                same filesystem as the images so files can be renamed.
+            max_sessions: Maximum number of open sessions, 0 for no limit.
+            max_per_client: Maximum number of open sessions of one client,
+                0 for no limit.
+        """
+        self.uploads_dir = uploads_dir
+        self.max_sessions = max_sessions
+        self.max_per_client = max_per_client
+        # Only one thread per process waits for the directory lock, so
+        # waiters cannot take every thread the lock holder needs.
+        self._creating = asyncio.Lock()
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def data_path(self, session_id: str) -> str:
+        """Returns the path of the file receiving the upload."""
+        return os.path.join(self.uploads_dir,
+                            f'{session_id}{constants.UPLOAD_SESSION_SUFFIX}')
+
+    def meta_path(self, session_id: str) -> str:
+        """Returns the path of the session state file."""
+        return self.data_path(session_id) + constants.UPLOAD_META_SUFFIX
+
+    @asynccontextmanager
+    async def locked(
+            self, session_id: str) -> AsyncIterator[Optional[UploadSession]]:
+        """Lock a session and read its state.
+
+        The lock is an flock on the data file, held until the block exits.
+        Nothing is kept for sessions that do not exist.
+
+        Args:
+            session_id: ID of the session.
+        Yields:
+            Optional[UploadSession]: The session or None if it does not
+            exist.
+        Raises:
+            SessionBusyError: If another request holds the lock.
+        """
+        try:
+            fd = os.open(self.data_path(session_id), os.O_RDONLY)
+        except FileNotFoundError:
+            yield None
+            return
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise SessionBusyError(session_id) from None
+            yield await self.load(session_id)
+        finally:
+            os.close(fd)
+
+    async def create(self, size: int, filename: str,
+                     client: str = '') -> UploadSession:
+        """Create a session and preallocate its file.
+
+        Open sessions are counted and the new one is recorded under a lock
+        on the uploads directory, so workers cannot together go past the
+        limits; only then is disk space reserved.
+
+        Args:
+            size: Total size of the upload in bytes.
+            filename: Original filename from the client.
+            client: Address of the client.
+        Returns:
+            UploadSession: The new session.
+        Raises:
+            SessionLimitError: If too many sessions are open in total or
+                for the client.
+        """
+        session = UploadSession(id=uuid.uuid4().hex, size=size,
+                                filename=filename, updated=time.time(),
+                                client=client)
+        async with self._creating:
+            lock_fd = await asyncio.to_thread(self._lock_directory)
+            try:
+                total, of_client = await asyncio.to_thread(
+                    self._count_sessions, client)
+                if ((self.max_sessions and total >= self.max_sessions)
+                        or (self.max_per_client
+                            and of_client >= self.max_per_client)):
+                    logger.warning(constants.UPLOAD_SESSIONS_LIMITED.format(
+                        client=client, total=total, of_client=of_client))
+                    raise SessionLimitError(client)
+                await self.save(session)
+            finally:
+                os.close(lock_fd)
+        await asyncio.to_thread(self._preallocate,
+                                self.data_path(session.id), size)
+        logger.info(constants.UPLOAD_SESSION_CREATED.format(
+            session_id=session.id, size=size))
+        return session
+
+    def _lock_directory(self) -> int:
+        """Open and lock the directory lock file, waiting for the lock.
+
+        Returns:
+            int: The locked file descriptor, to be closed by the caller.
+        """
+        fd = os.open(os.path.join(self.uploads_dir,
+                                  constants.UPLOAD_SESSIONS_LOCK),
+                     os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    def _count_sessions(self, client: str) -> tuple[int, int]:
+        """Count open sessions, in total and of one client.
+
+        Args:
+            client: Address of the client.
+        Returns:
+            tuple: (total, of_client).
+        """
+        suffix = constants.UPLOAD_SESSION_SUFFIX + constants.UPLOAD_META_SUFFIX
+        total = of_client = 0
+        for name in os.listdir(self.uploads_dir):
+            if not name.endswith(suffix):
+                continue
+            total += 1
+            try:
+                with open(os.path.join(self.uploads_dir, name)) as f:
+                    if json.load(f).get('client', '') == client:
+                        of_client += 1
+            except (OSError, ValueError):
+                continue
+        return total, of_client
+
+    @staticmethod
+    def _preallocate(file_path: str, size: int) -> None:
+        """Create a file with its blocks reserved, where supported."""
+        with open(file_path, 'wb') as f:
+            if size and hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, size)
+            else:
+                f.truncate(size)
+
+    async def load(self, session_id: str) -> Optional[UploadSession]:
+        """Read the state of a session.
+
+        Args:
+            session_id: ID of the session.
+        Returns:
+            Optional[UploadSession]: The session or None if it does not
+            exist.
+        """
+        try:
+            async with aiofiles.open(self.meta_path(session_id)) as f:
+                return UploadSession(**json.loads(await f.read()))
+        except FileNotFoundError:
+            return None
+
+    async def save(self, session: UploadSession) -> None:
+        """Atomically write the state of a session.
+
+        Args:
+            session: The session.
+        """
+        meta_path = self.meta_path(session.id)
+        temp_path = f'{meta_path}{constants.TEMP_FILE_SUFFIX}'
+        async with aiofiles.open(temp_path, 'w') as f:
+            await f.write(json.dumps(asdict(session)))
+        await aiofiles.os.replace(temp_path, meta_path)
+
+    async def write(self, session: UploadSession,
+                    chunks: AsyncIterator[bytes]) -> int:
+        """Write a stream at the session offset, advancing it.
+
+        The offset is saved even if the stream breaks, so the client can
+        resume after the last byte written.
+
+        Args:
+            session: The session.
+            chunks: Request body chunks.
+        Returns:
+            int: The new offset.
+        Raises:
+            ValueError: If the stream goes past the upload size.
+        """
+        try:
+            async with aiofiles.open(self.data_path(session.id), 'r+b') as f:
+                await f.seek(session.offset)
+                async for chunk in chunks:
+                    if session.offset + len(chunk) > session.size:
+                        raise ValueError(constants.FILE_TOO_LARGE.format(
+                            size=session.offset + len(chunk)))
+                    await f.write(chunk)
+                    session.offset += len(chunk)
+        finally:
+            session.updated = time.time()
+            await self.save(session)
+        return session.offset
+
+    async def delete(self, session_id: str, keep_data: bool = False) -> None:
+        """Remove a session.
+
+        Args:
+            session_id: ID of the session.
+            keep_data: Keep the data file, e.g. once it has been moved.
+        """
+        paths = [self.meta_path(session_id)]
+        if not keep_data:
+            paths.append(self.data_path(session_id))
+        for file_path in paths:
+            try:
+                await aiofiles.os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    async def sweep(self, ttl: float = constants.UPLOAD_SESSION_TTL) -> int:
+        """Remove sessions not updated for longer than ttl.
+
+        Args:
+            ttl: Maximum session idle time in seconds.
+        Returns:
+            int: Number of removed sessions.
+        """
+        expired_before = time.time() - ttl
+        suffix = constants.UPLOAD_SESSION_SUFFIX
+        removed = 0
+        for name in await aiofiles.os.listdir(self.uploads_dir):
+            if not name.endswith(suffix):
+                continue
+            session_id = name[:-len(suffix)]
+            try:
+                async with self.locked(session_id) as session:
+                    if session is None or session.updated < expired_before:
+                        await self.delete(session_id)
+                        removed += 1
+            except SessionBusyError:
+                continue
+        if removed:
+            logger.info(constants.UPLOAD_SESSIONS_EXPIRED.format(
+                count=removed))
+        return removed
+
+    def start_sweeper(
+            self, interval: float = constants.UPLOAD_SWEEP_INTERVAL) -> None:
+        """Start removing expired sessions periodically.
+
+        Args:
+            interval: Seconds between sweeps.
+        """
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever(interval))
+
+    async def stop_sweeper(self) -> None:
+        """Stop the periodic sweep."""
+        if self._sweeper is None:
+            return
+        self._sweeper.cancel()
+        try:
+            await self._sweeper
+        except asyncio.CancelledError:
+            pass
+        self._sweeper = None
+
+    async def _sweep_forever(self, interval: float) -> None:
+        """Sweep sessions every interval seconds, logging failures.
+
+        Args:
+            interval: Seconds between sweeps.
+        """
+        while True:
+            try:
+                await self.sweep()
+            except OSError as e:
+                logger.error(constants.UPLOAD_SWEEP_ERROR.format(error=e))
+            await asyncio.sleep(interval)
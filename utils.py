@@ -1,17 +1,57 @@
+import asyncio
+import hashlib
 import json
 import os
+import time
 import uuid
+from dataclasses import dataclass, replace
 from io import BytesIO
+from typing import Iterable, Optional
 
 import aiofiles
-from aiohttp import web
+import aiofiles.os
+from aiohttp import BodyPartReader, web
 from loguru import logger
 from PIL import Image
 
 import constants
+from derivatives import describe_image, remove_thumbnails, remove_variants
+from executor import ExecutorSaturatedError, ImageExecutor
+from log_config import log_request
+from metrics import UPLOAD_STAGE_SECONDS
+from pages import PageCache
+from storage import storage
 
-log_file = os.path.join('logs', constants.LOG_FILE)
-logger.add(log_file, format=constants.LOG_FORMAT, level=constants.LOG_LEVEL)
+image_executor = ImageExecutor()
+page_cache = PageCache()
+
+
+class UploadError(Exception):
+    """Raised when an uploaded file is rejected.
+
+    Attributes:
+        status: HTTP status code to respond with.
+        text: Response text for the client.
+    """
+
+    def __init__(self, status: int, text: str):
+        super().__init__(text)
+        self.status = status
+        self.text = text
+
+
+@dataclass
+class UploadedFile:
+    """File received from a multipart field into a temporary file."""
+    temp_path: str
+    file_extension: str
+    size: int
+    content_hash: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    orientation: Optional[int] = None
+    placeholder: Optional[str] = None
+    phash: Optional[int] = None
 
 
 async def read_file_async(file_path: str) -> str:
@@ -33,7 +73,7 @@ async def read_file_async(file_path: str) -> str:
 
 async def get_html_page(request: web.Request, html_file: str,
                         error_message: str) -> web.Response:
-    """Get HTML page from static directory.
+    """Get HTML page from the static page cache.
 
     Args:
         request: Request object.
@@ -41,15 +81,13 @@ async def get_html_page(request: web.Request, html_file: str,
         error_message: Error message to log if something goes wrong.
 
     Returns:
-        web.Response: Response with HTML content or an error message.
+        web.Response: Response with HTML content, 304 if the client copy
+        is current, or an error message.
     """
     try:
-        html_content = await read_file_async(os.path.join('static', html_file))
-        logger.info(constants.GET_REQUEST.format(request=request.path))
-        return web.Response(
-            text=html_content,
-            content_type=constants.CONTENT_TYPE_HTML
-        )
+        page = await page_cache.get(html_file)
+        log_request(constants.GET_REQUEST.format(request=request.path))
+        return page_cache.respond(request, page)
     except Exception as e:
         logger.error(error_message.format(error=e))
         return web.Response(
@@ -89,6 +127,22 @@ async def check_file_size(content_length: int, max_file_size: int) -> bool:
     return True
 
 
+def detect_image_format(file_data: bytes) -> Optional[str]:
+    """Identifies the image format of the given bytes with Pillow.
+
+    Runs inside the image executor, so it must stay a module-level function.
+
+    Args:
+        file_data: Byte content of the file (a header is enough).
+    Returns:
+        Optional[str]: Lowercase format name or None if unknown.
+    Raises:
+        PIL.UnidentifiedImageError: If the data is not an image.
+    """
+    with Image.open(BytesIO(file_data)) as image:
+        return image.format.lower() if image.format else None
+
+
 async def check_file_type(file_data: bytes,
                           allowed_extensions: tuple[str, ...]) -> tuple:
     """
@@ -101,55 +155,345 @@ async def check_file_type(file_data: bytes,
         tuple: tuple (extension, error).
             If the file is valid, returns (extension, None).
             If the file is invalid, returns (None, error message).
+    Raises:
+        ExecutorSaturatedError: If the image executor is saturated.
     """
     try:
-        with Image.open(BytesIO(file_data)) as image:
-            file_extension = image.format.lower() if image.format else None
-            if file_extension not in allowed_extensions:
-                logger.error(constants.UNSUPPORTED_EXTENSION.format(
-                    extension=file_extension))
-                return None, constants.UNSUPPORTED_EXTENSION_RU.format(
-                    file_extension=file_extension)
-            return file_extension, None
+        file_extension = await image_executor.run(detect_image_format,
+                                                  file_data)
+    except ExecutorSaturatedError:
+        raise
     except Exception as e:
         logger.error(constants.UNSUPPORTED_FILE_TYPE.format(error=e))
         return None, constants.UNSUPPORTED_FILE_TYPE_RU
+    if file_extension not in allowed_extensions:
+        logger.error(constants.UNSUPPORTED_EXTENSION.format(
+            extension=file_extension))
+        return None, constants.UNSUPPORTED_EXTENSION_RU.format(
+            file_extension=file_extension)
+    return file_extension, None
+
+
+async def receive_file(field: BodyPartReader, images_dir: str,
+                       allowed_extensions: tuple[str, ...],
+                       max_file_size: int,
+                       chunk_size: int = constants.UPLOAD_CHUNK_SIZE
+                       ) -> UploadedFile:
+    """Streams a multipart field into a temporary file in images_dir.
+
+    The format is sniffed from the first chunk and the size limit is
+    enforced on the bytes actually received, so at most one chunk of the
+    file is held in memory at a time. The content is hashed on the way.
+    Once the whole file is on disk, its dimensions, orientation,
+    placeholder and perceptual hash are read in the image executor.
+
+    Args:
+        field: The file field from a multipart request.
+        images_dir: The directory to store the temporary file in.
+        allowed_extensions: Tuple of allowed file extensions.
+        max_file_size: The maximum allowed file size in bytes.
+        chunk_size: The size of chunks read from the request body.
+    Returns:
+        UploadedFile: The received file.
+    Raises:
+        UploadError: If the file type is not allowed, it is too large or
+            cannot be decoded.
+        ExecutorSaturatedError: If the image executor is saturated.
+    """
+    started = time.perf_counter()
+    head = bytearray()
+    while len(head) < chunk_size:
+        chunk = await field.read_chunk(chunk_size - len(head))
+        if not chunk:
+            break
+        head += chunk
+
+    check_started = time.perf_counter()
+    file_extension, error = await check_file_type(bytes(head),
+                                                  allowed_extensions)
+    check_seconds = time.perf_counter() - check_started
+    UPLOAD_STAGE_SECONDS.observe(check_seconds,
+                                 stage=constants.STAGE_CHECK_FILE_TYPE)
+    if error:
+        raise UploadError(constants.HTTP_415_UNSUPPORTED_MEDIA_TYPE, error)
+
+    upload = await write_part(field, images_dir, max_file_size, bytes(head),
+                              chunk_size)
+    del head
+    UPLOAD_STAGE_SECONDS.observe(
+        time.perf_counter() - started - check_seconds,
+        stage=constants.STAGE_MULTIPART_READ)
+    try:
+        with UPLOAD_STAGE_SECONDS.time(stage=constants.STAGE_DESCRIBE_IMAGE):
+            (width, height, orientation, placeholder,
+             phash) = await describe_upload(upload.temp_path)
+    except BaseException:
+        await discard_file(upload.temp_path)
+        raise
+    return replace(upload, file_extension=file_extension, width=width,
+                   height=height, orientation=orientation,
+                   placeholder=placeholder, phash=phash)
+
+
+async def receive_part(field: BodyPartReader, images_dir: str,
+                       max_file_size: int,
+                       chunk_size: int = constants.UPLOAD_CHUNK_SIZE
+                       ) -> UploadedFile:
+    """Streams a multipart field into a temporary file without checking it.
+
+    Used by batch uploads, which check the received files with
+    check_received_file while the next part is read.
+
+    Args:
+        field: The file field from a multipart request.
+        images_dir: The directory to store the temporary file in.
+        max_file_size: The maximum allowed file size in bytes.
+        chunk_size: The size of chunks read from the request body.
+    Returns:
+        UploadedFile: The received file, without its type and metadata.
+    Raises:
+        UploadError: If the file is too large.
+    """
+    with UPLOAD_STAGE_SECONDS.time(stage=constants.STAGE_MULTIPART_READ):
+        return await write_part(field, images_dir, max_file_size, b'',
+                                chunk_size)
+
+
+async def write_part(field: BodyPartReader, images_dir: str,
+                     max_file_size: int, head: bytes,
+                     chunk_size: int = constants.UPLOAD_CHUNK_SIZE
+                     ) -> UploadedFile:
+    """Writes already read bytes and the rest of a field to a temporary
+    file, hashing the content and enforcing the size limit on the way.
+
+    The temporary file is removed if writing fails.
+
+    Args:
+        field: The file field from a multipart request.
+        images_dir: The directory to store the temporary file in.
+        max_file_size: The maximum allowed file size in bytes.
+        head: Bytes of the field read before.
+        chunk_size: The size of chunks read from the request body.
+    Returns:
+        UploadedFile: The received file, without its type and metadata.
+    Raises:
+        UploadError: If the file is too large.
+    """
+    temp_path = os.path.join(
+        images_dir, f'{uuid.uuid4().hex}{constants.TEMP_FILE_SUFFIX}')
+    size = 0
+    hasher = hashlib.blake2b(digest_size=constants.CONTENT_HASH_SIZE)
+    chunk = head or await field.read_chunk(chunk_size)
+    try:
+        async with aiofiles.open(temp_path, mode='wb') as f:
+            while chunk:
+                size += len(chunk)
+                if not await check_file_size(size, max_file_size):
+                    raise UploadError(
+                        constants.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        constants.FILE_TOO_LARGE_RU.format(size=size))
+                hasher.update(chunk)
+                await f.write(chunk)
+                chunk = await field.read_chunk(chunk_size)
+    except BaseException:
+        await discard_file(temp_path)
+        raise
+    return UploadedFile(temp_path=temp_path, file_extension='', size=size,
+                        content_hash=hasher.hexdigest())
+
+
+async def check_received_file(
+        upload: UploadedFile, allowed_extensions: tuple[str, ...],
+        chunk_size: int = constants.UPLOAD_CHUNK_SIZE) -> UploadedFile:
+    """Checks the type of a file already on disk and reads its metadata.
 
+    Args:
+        upload: The received file.
+        allowed_extensions: Tuple of allowed file extensions.
+        chunk_size: The number of bytes the type is sniffed from.
+    Returns:
+        UploadedFile: The file with its type and metadata.
+    Raises:
+        UploadError: If the file type is not allowed or it cannot be
+            decoded.
+        ExecutorSaturatedError: If the image executor is saturated.
+    """
+    async with aiofiles.open(upload.temp_path, 'rb') as f:
+        head = await f.read(chunk_size)
+    with UPLOAD_STAGE_SECONDS.time(stage=constants.STAGE_CHECK_FILE_TYPE):
+        file_extension, error = await check_file_type(head,
+                                                      allowed_extensions)
+    if error:
+        raise UploadError(constants.HTTP_415_UNSUPPORTED_MEDIA_TYPE, error)
+    with UPLOAD_STAGE_SECONDS.time(stage=constants.STAGE_DESCRIBE_IMAGE):
+        (width, height, orientation, placeholder,
+         phash) = await describe_upload(upload.temp_path)
+    return replace(upload, file_extension=file_extension, width=width,
+                   height=height, orientation=orientation,
+                   placeholder=placeholder, phash=phash)
+
+
+async def examine_file(file_path: str,
+                       allowed_extensions: tuple[str, ...],
+                       chunk_size: int = constants.UPLOAD_CHUNK_SIZE
+                       ) -> UploadedFile:
+    """Checks and describes a file already received into file_path.
+
+    Runs the same checks as receive_file, for files assembled by resumable
+    uploads.
+
+    Args:
+        file_path: The path to the received file.
+        allowed_extensions: Tuple of allowed file extensions.
+        chunk_size: The size of chunks read from the file.
+    Returns:
+        UploadedFile: The received file.
+    Raises:
+        UploadError: If the file type is not allowed or it cannot be
+            decoded.
+        ExecutorSaturatedError: If the image executor is saturated.
+    """
+    hasher = hashlib.blake2b(digest_size=constants.CONTENT_HASH_SIZE)
+    size = 0
+    async with aiofiles.open(file_path, 'rb') as f:
+        chunk = await f.read(chunk_size)
+        while chunk:
+            size += len(chunk)
+            hasher.update(chunk)
+            chunk = await f.read(chunk_size)
+    return await check_received_file(
+        UploadedFile(temp_path=file_path, file_extension='', size=size,
+                     content_hash=hasher.hexdigest()),
+        allowed_extensions, chunk_size)
 
-async def save_file(file_data: bytes, file_extension: str,
-                    images_dir: str
-                    ) -> str:
-    """Saves a file to disk and returns the filename.
+
+async def describe_upload(
+        file_path: str) -> tuple[int, int, int, str, int]:
+    """Reads the metadata of a received file in the image executor.
 
     Args:
-        file_data: The byte content of the file.
-        file_extension: The file extension (e.g., "jpg", "png").
-        images_dir: The directory to save the file in.
+        file_path: The path to the received file.
+    Returns:
+        tuple: (width, height, orientation, placeholder, phash).
+    Raises:
+        UploadError: If the image cannot be decoded.
+        ExecutorSaturatedError: If the image executor is saturated.
+    """
+    try:
+        return await image_executor.run(describe_image, file_path)
+    except ExecutorSaturatedError:
+        raise
+    except Exception as e:
+        logger.error(constants.UNSUPPORTED_FILE_TYPE.format(error=e))
+        raise UploadError(constants.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                          constants.UNSUPPORTED_FILE_TYPE_RU) from e
+
+
+async def discard_file(file_path: str) -> None:
+    """Removes a file if it exists, logging instead of raising on failure.
+
+    Args:
+        file_path: The path to the file.
+    """
+    try:
+        await aiofiles.os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(constants.TEMP_FILE_REMOVE_ERROR.format(
+            file_path=file_path, error=e))
+
+
+async def remove_stored_files(
+        filenames: Iterable[str],
+        concurrency: int = constants.FILE_REMOVE_CONCURRENCY) -> None:
+    """Removes stored images, their thumbnails and variants in parallel.
+
+    Unlinks run in the default executor, so the event loop never blocks on
+    the filesystem.
+
+    Args:
+        filenames: Names of the files to remove.
+        concurrency: Maximum number of files removed at once.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def remove(filename: str) -> None:
+        async with semaphore:
+            await storage.remove(filename)
+            await remove_thumbnails(filename)
+            await remove_variants(filename)
+
+    await asyncio.gather(*(remove(filename) for filename in filenames))
+
+
+async def save_file(upload: UploadedFile) -> str:
+    """Atomically moves a received file into its shard and returns its name.
+
+    With content-addressed storage the file is named by its hash, and a
+    duplicate of an already stored file is left in its temporary file
+    until finish_save runs after the insert of its row.
+
+    Args:
+        upload: The received file.
     Returns:
         str: The name of the saved file.
         """
-    filename = f'{uuid.uuid4().hex}.{file_extension}'
-    file_path = os.path.join(images_dir, filename)
-    async with aiofiles.open(file_path, mode='wb') as f:
-        await f.write(file_data)
-    logger.info(constants.FILE_UPLOAD_SUCCESS.format(file_path=file_path))
+    if constants.CONTENT_ADDRESSED_STORAGE:
+        filename = f'{upload.content_hash}.{upload.file_extension}'
+    else:
+        filename = f'{uuid.uuid4().hex}.{upload.file_extension}'
+    if (constants.CONTENT_ADDRESSED_STORAGE
+            and await storage.exists(filename)):
+        logger.info(constants.DUPLICATE_UPLOAD.format(
+            file_path=await storage.locate(filename)))
+        return filename
+    file_path = await storage.store(upload.temp_path, filename)
+    log_request(constants.FILE_UPLOAD_SUCCESS.format(file_path=file_path))
     return filename
 
 
-async def create_upload_response(filename: str, base_url: str,
-                                 images_dir: str) -> web.Response:
+async def finish_save(upload: UploadedFile, filename: str) -> None:
+    """Stores a duplicate kept by save_file once its row is inserted.
+
+    The stored copy may have been removed with its last reference after
+    save_file found it, and the insert may then have created a new row for
+    it. The kept copy is therefore moved over the stored one instead of
+    being discarded; both have the same content.
+
+    Args:
+        upload: The received file.
+        filename: The name returned by save_file.
+    """
+    if await aiofiles.os.path.exists(upload.temp_path):
+        await storage.store(upload.temp_path, filename)
+
+
+def build_file_url(filename: str, base_url: str) -> str:
+    """Builds the public URL of a stored file.
+
+    Args:
+        filename: The name of the file.
+        base_url: The base URL.
+    Returns:
+        str: The file URL.
+    """
+    return storage.url(filename, base_url)
+
+
+async def create_upload_response(filename: str,
+                                 base_url: str) -> web.Response:
     """Creates a JSON response for a successful file upload.
 
     Args:
         filename: The name of the file.
         base_url: The base URL.
-        images_dir: The directory containing the images.
     Returns:
         web.Response: A response with JSON data.
         """
     response = {
         'message': constants.UPLOAD_SUCCESS_MESSAGE,
-        'file_url': f'{base_url}/{images_dir}/{filename}'
+        'file_url': build_file_url(filename, base_url)
     }
     return web.Response(
         status=constants.HTTP_201_CREATED,